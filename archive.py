@@ -0,0 +1,206 @@
+"""冷数据归档：把早于保留期的已结算佣金流水从热库移入归档库（ATTACH），热库只留汇总行。
+
+每批在热库连接上 ATTACH 归档库，于一个事务中：
+- 将该批流水原样（保留 id）复制到 archive.referral_events（INSERT OR IGNORE，重复执行安全）
+- 按 (服务器, 邀请者, 月份, 层级, 是否续费) 累加到热库 referral_rollups
+- 记录该批中出现的 (成员, 角色) 到 archived_member_roles，升级/续费防重复判断仍能看到
+- 从热库删除该批流水
+已结算流水不会再被修改（结算只处理 settled = 0 的行），因此汇总后的总额、已结算额与归档前完全一致。
+WAL 模式下跨库事务只保证各库各自原子：归档库先提交、热库未提交时重跑会被 INSERT OR IGNORE 去重。
+
+自动归档由 ARCHIVE_RETENTION_DAYS 开启（单进程模式在 Bot 内，多进程模式在写入进程内定时执行）。
+
+    python archive.py --days 180
+    python archive.py --days 180 --dry-run
+    python archive.py --days 180 --vacuum
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from config import ARCHIVE_BATCH_SIZE, ARCHIVE_DATABASE_PATH, DATABASE_PATH
+import sqltrace
+
+
+def _cutoff(retention_days: int) -> str:
+    # joined_at 为本地时间文本（YYYY-MM-DD HH:MM:SS），按字符串比较即按时间比较
+    return (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _ensure_archive_schema(conn: sqlite3.Connection):
+    """归档表的列与热表保持一致（热表后续新增的列也补到归档表）。"""
+    columns = [(row[1], row[2]) for row in conn.execute("PRAGMA main.table_info(referral_events)")]
+    existing = {row[1] for row in conn.execute("PRAGMA archive.table_info(referral_events)")}
+    if not existing:
+        definitions = ", ".join(
+            f"{name} INTEGER PRIMARY KEY" if name == 'id' else f"{name} {col_type}" for name, col_type in columns
+        )
+        conn.execute(f"CREATE TABLE archive.referral_events ({definitions})")
+        conn.execute("CREATE INDEX archive.idx_archive_guild_inviter ON referral_events (guild_id, inviter_id)")
+    else:
+        for name, col_type in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE archive.referral_events ADD COLUMN {name} {col_type}")
+    conn.commit()
+    return [name for name, _ in columns]
+
+
+def pending_summary(retention_days: int, guild_id: int | None = None) -> tuple[int, float]:
+    """可归档的流水条数与金额（只读）。"""
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        sql = "SELECT COUNT(*), COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE settled = 1 AND joined_at < ?"
+        params = [_cutoff(retention_days)]
+        if guild_id is not None:
+            sql += " AND guild_id = ?"
+            params.append(guild_id)
+        count, amount = conn.execute(sql, params).fetchone()
+        return count, float(amount or 0)
+    finally:
+        conn.close()
+
+
+def archive_settled_events(retention_days: int, guild_id: int | None = None,
+                           batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """分批归档 retention_days 天前的已结算流水，返回 {'events', 'amount', 'batches', 'seconds'}。
+
+    每批一个短事务，避免长时间持有写锁；guild_id 为 None 时处理所有服务器。
+    """
+    started = time.perf_counter()
+    cutoff = _cutoff(retention_days)
+    # 与写入进程并存时等待其释放写锁
+    conn = sqltrace.connect(DATABASE_PATH, timeout=30)
+    moved = 0
+    amount = 0.0
+    batches = 0
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE_PATH,))
+        columns = _ensure_archive_schema(conn)
+        column_list = ", ".join(columns)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+        select = "SELECT id FROM main.referral_events WHERE settled = 1 AND joined_at < ?"
+        params = [cutoff]
+        if guild_id is not None:
+            select += " AND guild_id = ?"
+            params.append(guild_id)
+        select += " ORDER BY id LIMIT ?"
+        while True:
+            try:
+                conn.execute("DELETE FROM temp.archive_batch")
+                count = conn.execute(f"INSERT INTO temp.archive_batch {select}", (*params, batch_size)).rowcount
+                if count <= 0:
+                    conn.rollback()
+                    break
+                batch_amount = conn.execute(
+                    "SELECT COALESCE(SUM(commission_amount), 0) FROM main.referral_events WHERE id IN (SELECT id FROM temp.archive_batch)"
+                ).fetchone()[0]
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.referral_events ({column_list}) "
+                    f"SELECT {column_list} FROM main.referral_events WHERE id IN (SELECT id FROM temp.archive_batch)"
+                )
+                conn.execute(
+                    '''INSERT INTO main.referral_rollups (guild_id, inviter_id, month, level, renewal, event_count, commission_total)
+                       SELECT guild_id, inviter_id, substr(joined_at, 1, 7), COALESCE(level, 1), COALESCE(renewal, 0),
+                              COUNT(*), COALESCE(SUM(commission_amount), 0)
+                       FROM main.referral_events WHERE id IN (SELECT id FROM temp.archive_batch)
+                       GROUP BY guild_id, inviter_id, substr(joined_at, 1, 7), COALESCE(level, 1), COALESCE(renewal, 0)
+                       ON CONFLICT (guild_id, inviter_id, month, level, renewal) DO UPDATE SET
+                           event_count = event_count + excluded.event_count,
+                           commission_total = commission_total + excluded.commission_total'''
+                )
+                conn.execute(
+                    '''INSERT OR IGNORE INTO main.archived_member_roles (guild_id, new_member_id, role_id)
+                       SELECT guild_id, new_member_id, role_id FROM main.referral_events
+                       WHERE id IN (SELECT id FROM temp.archive_batch) AND role_id IS NOT NULL'''
+                )
+                # 余额对账尚未累计到的流水被移走时，该服务器下次对账需全量重建（含汇总行）
+                conn.execute(
+                    '''DELETE FROM main.balance_reconcile_state WHERE guild_id IN (
+                           SELECT e.guild_id FROM main.referral_events e
+                           JOIN main.balance_reconcile_state s ON s.guild_id = e.guild_id
+                           WHERE e.id IN (SELECT id FROM temp.archive_batch) AND e.id > s.events_hwm)'''
+                )
+                conn.execute("DELETE FROM main.referral_events WHERE id IN (SELECT id FROM temp.archive_batch)")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            moved += count
+            amount += float(batch_amount or 0)
+            batches += 1
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    if moved:
+        logging.info(f"Archived {moved} settled referral events ({amount:.2f} USDT) older than {cutoff} "
+                     f"to {ARCHIVE_DATABASE_PATH} in {batches} batches ({elapsed:.2f}s).")
+    return {'events': moved, 'amount': amount, 'batches': batches, 'seconds': elapsed}
+
+
+def archived_upgrade_history(guild_id: int):
+    """归档库中的直接邀请升级事件 (id, inviter_id, new_member_id, role_id)，供 simulator.py 合并历史。"""
+    try:
+        conn = sqlite3.connect(f"file:{ARCHIVE_DATABASE_PATH}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return []
+    try:
+        return conn.execute(
+            '''SELECT id, inviter_id, new_member_id, role_id FROM referral_events
+               WHERE guild_id = ? AND role_id IS NOT NULL AND COALESCE(level, 1) = 1 AND COALESCE(renewal, 0) = 0''',
+            (guild_id,)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # 尚未归档过（无表）
+        return []
+    finally:
+        conn.close()
+
+
+def compact():
+    """归档后回收热库空间：VACUUM 重写文件（期间持有独占锁，建议在低峰手动执行）。"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def run_periodically(retention_days: int, interval_hours: float):
+    """阻塞循环（写入进程的后台线程中使用）。"""
+    while True:
+        try:
+            archive_settled_events(retention_days)
+        except Exception as exc:
+            logging.error(f"Archiving settled referral events failed: {exc}")
+        time.sleep(interval_hours * 3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="归档早于保留期的已结算佣金流水")
+    parser.add_argument('--days', type=int, required=True, help="保留天数：早于该天数的已结算流水会被归档")
+    parser.add_argument('--guild', type=int, default=None, help="只处理指定服务器")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="只统计可归档的流水")
+    parser.add_argument('--vacuum', action='store_true', help="归档后 VACUUM 热库以回收空间")
+    args = parser.parse_args()
+    if args.dry_run:
+        count, amount = pending_summary(args.days, args.guild)
+        print(f"{count} settled events ({amount:.2f} USDT) older than {args.days} days would be archived.")
+        return
+    # 确保热库已建表/迁移（汇总表由 Database 负责创建）
+    from database import Database
+    with Database():
+        pass
+    result = archive_settled_events(args.days, args.guild, args.batch_size)
+    print(f"Archived {result['events']} events ({result['amount']:.2f} USDT) in {result['batches']} batches "
+          f"({result['seconds']:.2f}s) to {ARCHIVE_DATABASE_PATH}.")
+    if args.vacuum:
+        compact()
+        print("Hot database compacted.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""在线备份：用 SQLite backup API 在后台线程中分步复制数据库，不停机、不阻塞写入。
+
+主库由 Database 初始化为 WAL 模式：源连接在整个备份期间持有一个读事务，既不阻塞写入者，也保证快照一致、
+不会因并发写入而反复重启复制。非 WAL 的库（如旧版归档库）持有读事务会阻塞所有写入，因此不开启读事务，
+由 backup API 在并发写入后自动重新复制。每步只复制 BACKUP_PAGES_PER_STEP 页，步间让出 BACKUP_STEP_SLEEP_MS 毫秒。复制到临时文件后执行
+PRAGMA integrity_check，通过才改名为正式快照，再按 BACKUP_KEEP 轮换旧快照。
+最近一次结果写入备份目录下的 last_backup.json，供 /backup_status 查看（多进程或重启后同样可读）。
+
+    python backup.py
+"""
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from config import (
+    ARCHIVE_DATABASE_PATH,
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_MS,
+    DATABASE_PATH,
+)
+import metrics
+
+STATUS_FILE = os.path.join(BACKUP_DIR, 'last_backup.json')
+
+_lock = threading.Lock()
+
+
+def is_running() -> bool:
+    return _lock.locked()
+
+
+def _snapshot_prefix(path: str) -> str:
+    return os.path.join(BACKUP_DIR, os.path.splitext(os.path.basename(path))[0])
+
+
+def _rotate(path: str):
+    snapshots = sorted(glob.glob(f"{_snapshot_prefix(path)}-*.db"))
+    for old in snapshots[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        try:
+            os.remove(old)
+        except OSError as exc:
+            logging.error(f"Failed to remove old backup {old}: {exc}")
+
+
+def backup_file(path: str, stamp: str) -> dict:
+    """备份单个数据库文件，返回 {'file', 'bytes', 'pages', 'steps', 'seconds', 'integrity'}；完整性检查失败时抛出 RuntimeError。"""
+    started = time.perf_counter()
+    target = f"{_snapshot_prefix(path)}-{stamp}.db"
+    partial = target + '.partial'
+    steps = 0
+    pause = BACKUP_STEP_SLEEP_MS / 1000.0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None)
+    dest = sqlite3.connect(partial)
+    try:
+        # 仅 WAL 模式下用读事务固定快照：并发写入不会使复制重启，也不会被阻塞；
+        # 回滚日志模式下读事务会阻塞写入者直到备份结束
+        wal = source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+        if wal:
+            source.execute('BEGIN')
+        pages = source.execute('PRAGMA page_count').fetchone()[0]
+        source.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        if wal:
+            source.execute('COMMIT')
+        integrity = dest.execute('PRAGMA integrity_check').fetchone()[0]
+    except Exception:
+        dest.close()
+        os.remove(partial)
+        raise
+    finally:
+        dest.close()
+        source.close()
+    if integrity != 'ok':
+        os.remove(partial)
+        raise RuntimeError(f"integrity check failed for backup of {path}: {integrity}")
+    os.replace(partial, target)
+    _rotate(path)
+    return {
+        'file': target,
+        'bytes': os.path.getsize(target),
+        'pages': pages,
+        'steps': steps,
+        'seconds': time.perf_counter() - started,
+        'integrity': integrity,
+    }
+
+
+def run_backup() -> dict:
+    """备份主库（及已存在的归档库），记录并返回结果；已有备份在进行时抛出 RuntimeError。"""
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("backup already running")
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        started = time.perf_counter()
+        status = {'started_at': started_at, 'ok': False, 'files': []}
+        try:
+            for path in (DATABASE_PATH, ARCHIVE_DATABASE_PATH):
+                if path and os.path.exists(path):
+                    status['files'].append(backup_file(path, stamp))
+            status['ok'] = True
+        except Exception as exc:
+            status['error'] = str(exc)
+            logging.error(f"Database backup failed: {exc}")
+        status['seconds'] = time.perf_counter() - started
+        metrics.inc('backups_total', result='ok' if status['ok'] else 'failed')
+        metrics.observe('backup_duration_seconds', status['seconds'])
+        if status['ok']:
+            total = sum(item['bytes'] for item in status['files'])
+            logging.info(f"Backed up {len(status['files'])} database(s), {total / 1024 / 1024:.1f} MiB in {status['seconds']:.2f}s.")
+        with open(STATUS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False, indent=2)
+        return status
+    finally:
+        _lock.release()
+
+
+def last_status() -> dict | None:
+    try:
+        with open(STATUS_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_snapshots() -> list[str]:
+    return sorted(glob.glob(f"{_snapshot_prefix(DATABASE_PATH)}-*.db"))
+
+
+if __name__ == '__main__':
+    result = run_backup()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,225 @@
+"""离线基准测试：在临时 SQLite 文件上用合成服务器驱动真实处理函数，报告吞吐与延迟分位数。
+
+合成服务器包含当前等级配置中的付费角色、持有邀请链接的邀请者，以及带有角色等级和佣金流水的受邀成员历史。
+场景覆盖 on_member_join、on_member_update、on_interaction 的三个按钮分支，以及 /userstats、/settle 的回调。
+
+    python benchmark.py --members 2000 --iterations 200
+    python benchmark.py --json > baseline.json
+    python benchmark.py --baseline baseline.json --max-regression 20   # p99 回退超过 20% 时以退出码 1 结束
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SCENARIOS = (
+    'join',
+    'upgrade',
+    'button.check_records',
+    'button.check_commission',
+    'button.invite_friend',
+    'slash.userstats',
+    'slash.userstats_list',
+    'slash.settle',
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试：合成服务器 + 真实处理函数")
+    parser.add_argument('--members', type=int, default=1000, help="受邀成员历史数量")
+    parser.add_argument('--inviters', type=int, default=50, help="邀请者数量")
+    parser.add_argument('--iterations', type=int, default=100, help="每个场景的执行次数")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument('--rest-latency', type=float, default=0.0, help="模拟每次 REST 调用的延迟（秒）")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', default=None, help="SQLite 文件路径（默认使用临时文件，结束后删除）")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果（可作为 --baseline）")
+    parser.add_argument('--baseline', default=None, help="与之前 --json 输出的结果比较 p99")
+    parser.add_argument('--max-regression', type=float, default=25.0, help="允许的 p99 回退百分比")
+    return parser.parse_args(argv)
+
+
+def seed_history(guild, inviters, members: int, rng: random.Random):
+    """批量写入受邀成员：随机等级、邀请关系与对应的佣金流水（单连接、关闭同步以加快准备）。"""
+    import levels as level_config
+    from database import Database
+
+    levels = [level for level in level_config.current().levels if level.role_ids]
+    now = datetime.now(timezone.utc)
+    with Database(guild.id) as db:
+        db.conn.execute('PRAGMA synchronous=OFF')
+        for i in range(members):
+            inviter = rng.choice(inviters)
+            joined_at = now - timedelta(minutes=members - i)
+            tier = rng.randrange(len(levels) + 1)
+            roles = [guild.get_role(levels[t].role_ids[0]) for t in range(tier)]
+            member = guild.add_member(guild.id + 10_000 + i, roles=roles, joined_at=joined_at)
+            when = joined_at.strftime('%Y-%m-%d %H:%M:%S')
+            db.add_or_update_user(member.id, member.name, inviter.id, when, roles[-1].id if roles else None)
+            db.add_referral_event(inviter.id, 'seed', member.id, when, 0.0)
+            previous = 0.0
+            for t in range(tier):
+                amount = round((levels[t].price - previous) * levels[t].commission / 100.0, 2)
+                previous = levels[t].price
+                db.add_referral_event(inviter.id, 'seed', member.id, when, amount, levels[t].role_ids[0])
+                db.adjust_reward_balance(inviter.id, amount)
+
+
+async def run_scenarios(args) -> dict:
+    import bot
+    import metrics
+    import levels
+    from config import ALLOWED_CHANNEL_IDS, SLASH_ALLOWED_USER_ID_SET
+    from fake_gateway import build_guild
+    from fakes import FakeInteraction, FakeRest
+
+    rng = random.Random(args.seed)
+    rest = FakeRest(latency=args.rest_latency)
+    guild = build_guild(1 << 22, args.inviters, rng, rest=rest)
+    inviters = [m for m in guild.members]
+    seed_history(guild, inviters, args.members, rng)
+    admin_id = next(iter(SLASH_ALLOWED_USER_ID_SET), guild.id + 9_999)
+    admin = guild.add_member(admin_id, name='bench-admin', administrator=True)
+    channel = guild.get_channel(ALLOWED_CHANNEL_IDS[0])
+    tiers = [guild.get_role(level.role_ids[0]) for level in levels.current().levels if level.role_ids]
+    await bot._prime_guild(guild)
+    # 逐次测量按钮处理本身：关闭点击冷却，否则同一邀请者的连续点击会被直接拒绝
+    bot.component_router.cooldown = 0
+
+    next_member_id = guild.id + 1_000_000
+    joined = []
+
+    async def join():
+        nonlocal next_member_id
+        next_member_id += 1
+        invite = rng.choice(list(guild._invites.values()))
+        member = guild.add_member(next_member_id)
+        guild.use_invite(invite.code)
+        await bot.on_member_join(member)
+        joined.append(member)
+
+    async def upgrade():
+        candidates = [m for m in joined if len(m.roles) < len(tiers)]
+        if not candidates:
+            await join()
+            return
+        member = rng.choice(candidates)
+        before = member.snapshot()
+        member.roles.append(tiers[len(member.roles)])
+        await bot.on_member_update(before, member)
+
+    def button(custom_id):
+        async def run():
+            await bot.on_interaction(FakeInteraction(rng.choice(inviters), channel, custom_id))
+        return run
+
+    async def userstats():
+        await bot.slash_userstats.callback(FakeInteraction(admin, channel), user=rng.choice(inviters))
+
+    async def userstats_list():
+        await bot.slash_userstats.callback(FakeInteraction(admin, channel), user=None)
+
+    async def settle():
+        await bot.slash_settle.callback(FakeInteraction(admin, channel), user=rng.choice(inviters), amount=0.01)
+
+    runners = {
+        'join': join,
+        'upgrade': upgrade,
+        'button.check_records': button('check_records'),
+        'button.check_commission': button('check_commission'),
+        'button.invite_friend': button('invite_friend'),
+        'slash.userstats': userstats,
+        'slash.userstats_list': userstats_list,
+        'slash.settle': settle,
+    }
+    results = {}
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        runner = runners[name]
+        samples = []
+        rest_before = rest.total_calls
+        db_before = sum(h.count for h in metrics.histograms.get('db_latency_seconds', {}).values())
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            await runner()
+            samples.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        db_calls = sum(h.count for h in metrics.histograms.get('db_latency_seconds', {}).values()) - db_before
+        results[name] = {
+            'n': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': metrics.percentile(samples, 50) * 1000,
+            'p95_ms': metrics.percentile(samples, 95) * 1000,
+            'p99_ms': metrics.percentile(samples, 99) * 1000,
+            'max_ms': max(samples) * 1000 if samples else 0.0,
+            'rest_per_op': (rest.total_calls - rest_before) / len(samples) if samples else 0.0,
+            'db_per_op': db_calls / len(samples) if samples else 0.0,
+        }
+    return results
+
+
+def format_report(results: dict, args) -> str:
+    lines = [
+        f"members={args.members} inviters={args.inviters} iterations={args.iterations} rest_latency={args.rest_latency}s",
+        f"{'scenario':<26}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'rest/op':>9}{'db/op':>8}",
+    ]
+    for name, r in results.items():
+        lines.append(
+            f"{name:<26}{r['throughput']:>9.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+            f"{r['max_ms']:>9.2f}{r['rest_per_op']:>9.1f}{r['db_per_op']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """返回 p99 相对基线回退超过 max_regression% 的场景说明。"""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or not base.get('p99_ms'):
+            continue
+        change = (r['p99_ms'] - base['p99_ms']) / base['p99_ms'] * 100.0
+        if change > max_regression:
+            regressions.append(f"{name}: p99 {base['p99_ms']:.2f}ms -> {r['p99_ms']:.2f}ms (+{change:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    unknown = set(s.strip() for s in args.scenarios.split(',') if s.strip()) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    db_path = args.db
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(prefix='commission-bench-', suffix='.db')
+        os.close(fd)
+    # 必须在导入 config 之前设置：基准测试只使用本地临时库，不经过写入进程
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ.pop('DB_WRITER_ADDRESS', None)
+    try:
+        results = asyncio.run(run_scenarios(args))
+    finally:
+        if args.db is None:
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_report(results, args))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
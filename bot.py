@@ -2,6 +2,15 @@ import discord
 from discord.ext import commands
 from discord.ui import Button, View
 import logging
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from discord import app_commands
@@ -22,15 +31,46 @@ from config import (
     MONTHLY_FEE_PRICE,
     ANNUAL_FEE_PRICE,
     PARTNER_FEE_PRICE,
-    MONTHLY_FEE_ROLE_ID_SET,
-    ANNUAL_FEE_ROLE_ID_SET,
-    PARTNER_ROLE_ID_SET,
-    LEVELS_CONFIG,
-    ROLE_TO_LEVEL_MAP,
-    ALL_PAID_ROLE_ID_SET,
     SLASH_ALLOWED_USER_ID_SET,
+    RECONCILE_ON_STARTUP,
+    STARTUP_CONCURRENCY,
+    DEFAULT_GUILD_ID,
+    USE_AUTO_SHARDING,
+    SHARD_COUNT,
+    SHARD_IDS,
+    SQL_TRACE,
+    LOOP_WATCHDOG,
+    PROFILE_MAX_SECONDS,
+    LEVELS_CONFIG_FILE,
+    UPLINE_COMMISSION_PERCENTS,
+    UPLINE_MIN_TIER,
+    RENEWAL_GRACE_HOURS,
+    DB_WRITER_ADDRESS,
+    ARCHIVE_RETENTION_DAYS,
+    ARCHIVE_INTERVAL_HOURS,
+    BACKUP_INTERVAL_HOURS,
+    BALANCE_RECONCILE_INTERVAL_MINUTES,
+    LEVELS_RELOAD_INTERVAL,
+    FRAUD_DETECTION,
+    FRAUD_HOLD_COMMISSIONS,
 )
 from database import Database
+import metrics
+import sqltrace
+import loop_watchdog
+import profiler
+import capture
+import levels
+import simulator
+import scheduler
+import archive
+import backup
+import export
+import ledger
+import fraud
+import components
+import panel_cache
+import reports
 
 
 # 创建 Bot 实例
@@ -38,17 +78,51 @@ intents = discord.Intents.default()
 intents.members = True  # 启用成员相关事件
 intents.message_content = True  # 启用获取消息内容
 
-bot = commands.Bot(
+bot_kwargs = dict(
     command_prefix="!",
     intents=intents,
     proxy=PROXY_URL,
+    # 斜杠指令耗时统计（/perfstats）
+    tree_cls=metrics.MetricsCommandTree,
 )
+if USE_AUTO_SHARDING or SHARD_IDS:
+    # 大量服务器时将成员加入/更新等网关事件分摊到多个分片；多进程模式下每个进程只连接分配到的分片
+    if SHARD_COUNT:
+        bot_kwargs["shard_count"] = SHARD_COUNT
+    if SHARD_IDS:
+        bot_kwargs["shard_ids"] = SHARD_IDS
+    bot = commands.AutoShardedBot(**bot_kwargs)
+else:
+    bot = commands.Bot(**bot_kwargs)
 invite_cache = {}
 
+# 高频事件（加入、按钮点击等）使用独立 logger，便于按 LOG_SAMPLE_RATES 采样
+event_log = logging.getLogger('commission.events')
+
 LOCAL_TZ = ZoneInfo("Asia/Shanghai")
 
-# 付费角色ID合集，便于批量处理
-PAID_ROLE_ID_SET = ALL_PAID_ROLE_ID_SET
+# 刷邀请检测的滑动窗口（仅内存，见 fraud.py）
+fraud_detector = fraud.Detector()
+
+# 面板按钮路由：按 custom_id 分发，并对同一用户的同一操作做单飞与冷却（见 components.py）
+component_router = components.ComponentRouter()
+
+# “查看佣金”“查看记录”的渲染结果缓存，相关数据变化时显式失效（见 panel_cache.py）
+panels = panel_cache.PanelCache()
+
+# 重型报表在工作进程中执行，同一种报表同时只运行一个（见 reports.py）
+report_service = reports.ReportService()
+
+
+def invalidate_member_panels(guild_id: int, member_id: int):
+    """成员本人及其邀请者的面板失效（成员角色或去留变化会改变邀请者“查看记录”中的内容）。"""
+    try:
+        with Database(guild_id) as db:
+            inviter_id = db.get_referrer_id_for_member(member_id)
+    except Exception as exc:
+        logging.error(f"Failed to look up inviter of {member_id} for panel invalidation: {exc}")
+        inviter_id = None
+    panels.invalidate(guild_id, member_id, inviter_id)
 
 async def get_channel_by_id(guild: discord.Guild | None, channel_id: int | None):
     """尝试通过 ID 获取频道或线程，先本地缓存再 fetch。"""
@@ -99,27 +173,26 @@ def resolve_member(guild: discord.Guild, query: str) -> discord.Member | None:
             return m
     return None
 
-def is_paid_role(role: discord.Role | None) -> bool:
+def is_paid_role(role: discord.Role | None, snapshot: levels.LevelSnapshot | None = None) -> bool:
     """通过角色ID判断是否为付费角色"""
     if not role:
         return False
-    role_id = role.id
-    # 检查是否在配置的等级中
-    return role_id in ROLE_TO_LEVEL_MAP
+    # 检查是否在当前（或调用方固定的）等级配置中
+    return role.id in (snapshot or levels.current()).role_to_level
 
-def role_tier(role: discord.Role | None) -> int:
+def role_tier(role: discord.Role | None, snapshot: levels.LevelSnapshot | None = None) -> int:
     """付费层级：普通=0，其他等级根据配置的tier值"""
     if not role:
         return 0
-    role_id = role.id
-    level = ROLE_TO_LEVEL_MAP.get(role_id)
+    level = (snapshot or levels.current()).level_for_role(role.id)
     return level.tier if level else 0
 
-def get_highest_paid_role(user_roles):
-    paid_roles = [r for r in (user_roles or []) if is_paid_role(r)]
+def get_highest_paid_role(user_roles, snapshot: levels.LevelSnapshot | None = None):
+    snapshot = snapshot or levels.current()
+    paid_roles = [r for r in (user_roles or []) if is_paid_role(r, snapshot)]
     if not paid_roles:
         return None
-    return max(paid_roles, key=role_tier)
+    return max(paid_roles, key=lambda r: role_tier(r, snapshot))
 
 def get_user_role_name(user_roles, guild: discord.Guild | None = None):
     role = get_highest_paid_role(user_roles)
@@ -148,27 +221,56 @@ def _chunk_text(text: str, limit: int = 1000) -> list[str]:
         chunks.append(buf)
     return chunks
 
-def commission_percent_for_inviter(member: discord.Member) -> int:
-    """通过角色ID获取邀请者的佣金比例"""
-    role = get_highest_paid_role(member.roles)
+def commission_percent_for_inviter(member: discord.Member | None, snapshot: levels.LevelSnapshot | None = None) -> int:
+    """通过角色ID获取邀请者的佣金比例（邀请者不在缓存中时按普通会员处理）"""
+    snapshot = snapshot or levels.current()
+    role = get_highest_paid_role(member.roles, snapshot) if member else None
     if role:
-        level = ROLE_TO_LEVEL_MAP.get(role.id)
+        level = snapshot.level_for_role(role.id)
         if level:
             return level.commission
     return BASIC_INVITE_COMMISSION if ALLOW_BASIC_INVITER else 0
 
-def price_for_role(role: discord.Role) -> float:
+def price_for_role(role: discord.Role, snapshot: levels.LevelSnapshot | None = None) -> float:
     """通过角色ID获取角色价格"""
     if not role:
         return 0.0
-    level = ROLE_TO_LEVEL_MAP.get(role.id)
+    level = (snapshot or levels.current()).level_for_role(role.id)
     return level.price if level else 0.0
 
+def upline_awards(guild: discord.Guild, db: Database, member_id: int, incremental_price: float,
+                  snapshot: levels.LevelSnapshot | None = None) -> list[tuple[int, int, float]]:
+    """按 UPLINE_COMMISSION_PERCENTS 计算第 2 级及以上上线的分成，返回 (上线ID, 层级, 金额) 列表。"""
+    if not UPLINE_COMMISSION_PERCENTS or incremental_price <= 0:
+        return []
+    return awards_for_upline(guild, member_id, db.get_upline(member_id, len(UPLINE_COMMISSION_PERCENTS) + 1),
+                             incremental_price, snapshot)
+
+def awards_for_upline(guild: discord.Guild, member_id: int, upline, incremental_price: float,
+                      snapshot: levels.LevelSnapshot | None = None) -> list[tuple[int, int, float]]:
+    """同 upline_awards，上线列表 (上线ID, 层级) 由调用方预先查询（只读取 Discord 缓存，不访问数据库）。"""
+    if not UPLINE_COMMISSION_PERCENTS or incremental_price <= 0:
+        return []
+    snapshot = snapshot or levels.current()
+    awards = []
+    for ancestor_id, depth in upline:
+        if depth < 2 or ancestor_id == member_id:
+            continue
+        if UPLINE_MIN_TIER > 0:
+            ancestor = guild.get_member(ancestor_id)
+            if ancestor is None or role_tier(get_highest_paid_role(ancestor.roles, snapshot), snapshot) < UPLINE_MIN_TIER:
+                continue
+        amount = round(incremental_price * (UPLINE_COMMISSION_PERCENTS[depth - 2] / 100.0), 2)
+        if amount > 0:
+            awards.append((ancestor_id, depth, amount))
+    return awards
+
 async def cache_guild_invites(guild: discord.Guild):
     try:
         invites = await guild.invites()
         invite_cache[guild.id] = {invite.code: invite.uses for invite in invites}
-        logging.debug(f"Invite cache refreshed for guild {guild.id}: {invite_cache[guild.id]}")
+        capture.record_invite_uses(guild.id, invites)
+        event_log.debug("Invite cache refreshed for guild %s: %s", guild.id, invite_cache[guild.id])
         return invites
     except discord.Forbidden:
         logging.warning(f"Missing permissions to fetch invites for guild {guild.id}. Invite tracking disabled.")
@@ -176,34 +278,311 @@ async def cache_guild_invites(guild: discord.Guild):
         logging.error(f"Failed to refresh invites for guild {guild.id}: {exc}")
     return []
 
-
-@bot.event
-async def on_ready():
-    logging.info(f"Logged in as {bot.user}")
-    for guild in bot.guilds:
-        invites = await cache_guild_invites(guild)
-        if invites:
-            logging.info(f"Invite cache primed for guild {guild.id} with {len(invites)} entries.")
-    # 启动时全库自拉自清理
+def _load_upgrade_state(guild_id: int):
+    with Database(guild_id) as db:
+        return db.get_referred_members(), db.get_rewarded_member_roles()
+
+def _load_uplines(guild_id: int, member_ids) -> dict[int, list]:
+    with Database(guild_id) as db:
+        return {member_id: db.get_upline(member_id, len(UPLINE_COMMISSION_PERCENTS) + 1) for member_id in member_ids}
+
+def _apply_missed_upgrades(guild_id: int, entries, role_updates):
+    with Database(guild_id) as db:
+        db.apply_missed_upgrades(entries, role_updates)
+
+async def reconcile_missed_upgrades(guild: discord.Guild, dry_run: bool = False) -> list[dict]:
+    """对账离线/断线期间漏发的升级佣金。
+
+    一次性比对所有受邀成员的实时最高付费角色与 users.role_id，对没有对应 referral_events
+    记录的升级计算增量佣金，并在单个事务中批量入账。dry_run=True 时只返回报告不写库。
+    数据库读写在线程中执行；事件循环上只读取成员角色缓存并计算。
+    """
+    report: list[dict] = []
+    # 整次对账固定使用同一版等级配置
+    snapshot = levels.current()
+    referred, rewarded_roles = await asyncio.to_thread(_load_upgrade_state, guild.id)
+    # 每个成员已计佣的最高层级
+    rewarded_tier: dict[int, int] = {}
+    for member_id, rewarded_role_id in rewarded_roles:
+        level = snapshot.level_for_role(rewarded_role_id)
+        if level and level.tier > rewarded_tier.get(member_id, 0):
+            rewarded_tier[member_id] = level.tier
+    tier_price = snapshot.tier_price
+
+    upgrades = []
+    role_updates = []
+    now_text = format_dt_local(datetime.now(ZoneInfo("UTC")))
+    for user_id, inviter_id, stored_role_id in referred:
+        member = guild.get_member(user_id)
+        if member is None:
+            continue
+        live_role = get_highest_paid_role(member.roles, snapshot)
+        if not live_role:
+            continue
+        live_tier = role_tier(live_role, snapshot)
+        stored_level = snapshot.level_for_role(stored_role_id)
+        stored_tier = stored_level.tier if stored_level else 0
+        if live_tier <= stored_tier:
+            continue
+        role_updates.append((live_role.id, user_id))
+        paid_tier = rewarded_tier.get(user_id, 0)
+        if paid_tier >= live_tier:
+            # 已在该层级或更高层级计过佣，仅同步角色
+            continue
+        # 增量基准取“库中角色”和“已计佣层级”中较高者，避免重复计费
+        base_price = max(stored_level.price if stored_level else 0.0, tier_price.get(paid_tier, 0.0))
+        incremental_price = max(price_for_role(live_role, snapshot) - base_price, 0.0)
+        percent = commission_percent_for_inviter(guild.get_member(inviter_id), snapshot)
+        if not percent or not incremental_price:
+            continue
+        upgrades.append((user_id, inviter_id, stored_role_id, live_role, incremental_price,
+                         round(incremental_price * (percent / 100.0), 2)))
+
+    # 多级分成所需的上线链一次查出
+    uplines = {}
+    if upgrades and UPLINE_COMMISSION_PERCENTS:
+        uplines = await asyncio.to_thread(_load_uplines, guild.id, [upgrade[0] for upgrade in upgrades])
+    entries = []
+    for user_id, inviter_id, stored_role_id, live_role, incremental_price, commission_amount in upgrades:
+        entries.append((inviter_id, user_id, now_text, commission_amount, live_role.id, snapshot.version, 1))
+        report.append({
+            "inviter_id": inviter_id,
+            "member_id": user_id,
+            "from_role_id": stored_role_id,
+            "to_role_id": live_role.id,
+            "to_role_name": live_role.name,
+            "amount": commission_amount,
+        })
+        for ancestor_id, depth, amount in awards_for_upline(guild, user_id, uplines.get(user_id, []),
+                                                            incremental_price, snapshot):
+            entries.append((ancestor_id, user_id, now_text, amount, live_role.id, snapshot.version, depth))
+            report.append({
+                "inviter_id": ancestor_id,
+                "member_id": user_id,
+                "from_role_id": stored_role_id,
+                "to_role_id": live_role.id,
+                "to_role_name": live_role.name,
+                "amount": amount,
+                "level": depth,
+            })
+
+    if dry_run:
+        logging.info(f"Upgrade reconciliation dry run for guild {guild.id}: {len(entries)} commissions owed.")
+    elif entries or role_updates:
+        await asyncio.to_thread(_apply_missed_upgrades, guild.id, entries, role_updates)
+        panels.clear(guild.id)
+    return report
+
+def _command_payload(cmd) -> dict:
+    """指令的 API 表示（兼容 discord.py 2.3 的无参 to_dict）。"""
     try:
+        return cmd.to_dict(bot.tree)
+    except TypeError:
+        return cmd.to_dict()
+
+def command_tree_fingerprint(guild: discord.abc.Snowflake | None = None) -> str:
+    """计算指定作用域指令树的稳定哈希（名称、选项、权限等完整 API 载荷）。"""
+    payload = sorted(
+        (_command_payload(cmd) for cmd in bot.tree.get_commands(guild=guild)),
+        key=lambda c: (c.get("type", 1), c.get("name", "")),
+    )
+    raw = json.dumps(
+        {"application_id": bot.application_id, "commands": payload},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def sync_command_tree(guild: discord.abc.Snowflake | None = None, force: bool = False) -> bool:
+    """仅在指令树指纹变化（或强制）时同步指定作用域，返回是否实际调用了同步接口。"""
+    scope = f"guild:{guild.id}" if guild else "global"
+    if guild is not None:
+        bot.tree.copy_global_to(guild=guild)
+    fingerprint = command_tree_fingerprint(guild)
+    if not force:
         with Database() as db:
-            db.purge_all_self_invites()
+            if db.get_command_sync_fingerprint(scope) == fingerprint:
+                logging.info(f"Slash commands unchanged for {scope}; sync skipped.")
+                return False
+    await bot.tree.sync(guild=guild)
+    with Database() as db:
+        db.set_command_sync_fingerprint(scope, fingerprint, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    logging.info(f"Slash commands synced for {scope}.")
+    return True
+
+
+# 启动分两段：setup_hook 只在进程内执行一次；on_ready 在每次（重新）就绪时执行幂等工作
+startup_timings: dict[str, float] = {}
+primed_guild_ids: set[int] = set()
+_synced_guild_ids: set[int] = set()
+_levels_watch_task: asyncio.Task | None = None
+_archive_task: asyncio.Task | None = None
+_backup_task: asyncio.Task | None = None
+_ledger_task: asyncio.Task | None = None
+
+@contextmanager
+def _timed_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+
+def _log_startup_timings(prefix: str):
+    parts = [f"{name}={elapsed * 1000:.0f}ms" for name, elapsed in startup_timings.items() if name.startswith(prefix)]
+    logging.info(f"Startup timings ({prefix.rstrip('.')}): {', '.join(parts) or 'n/a'}")
+
+async def _bounded(semaphore: asyncio.Semaphore, coro):
+    async with semaphore:
+        return await coro
+
+async def _prime_guild(guild: discord.Guild):
+    invites = await cache_guild_invites(guild)
+    capture.record_guild(guild, invites)
+    # 即使无权限读取邀请也视为已就绪，避免交互被永久挡住
+    primed_guild_ids.add(guild.id)
+    try:
+        load_membership_timers(guild)
+    except Exception as exc:
+        logging.error(f"Failed to load membership timers for guild {guild.id}: {exc}")
+    if invites:
+        logging.info(f"Invite cache primed for guild {guild.id} with {len(invites)} entries.")
+
+async def _sync_guild_commands(guild: discord.Guild):
+    try:
+        await sync_command_tree(guild)
+        _synced_guild_ids.add(guild.id)
     except Exception as exc:
-        logging.error(f"Failed to purge self-invites on startup: {exc}")
-    # 同步斜杠指令（先全局，再逐服复制并快速生效）
+        logging.error(f"Failed to sync slash commands for guild {guild.id}: {exc}")
+
+async def _archive_loop():
+    while True:
+        try:
+            await asyncio.to_thread(archive.archive_settled_events, ARCHIVE_RETENTION_DAYS)
+            panels.clear()
+        except Exception as exc:
+            logging.error(f"Archiving settled referral events failed: {exc}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+async def _backup_loop():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
+        try:
+            await asyncio.to_thread(backup.run_backup)
+        except Exception as exc:
+            logging.error(f"Scheduled database backup failed: {exc}")
+
+
+async def _balance_reconcile_loop():
+    # 每个服务器上一次的偏差用户数，变化时才告警
+    last_drifted: dict[int, int] = {}
+    while True:
+        try:
+            for guild_id in await asyncio.to_thread(ledger.guild_ids):
+                result = await asyncio.to_thread(ledger.reconcile, guild_id, False, limit=0)
+                if result['drifted_count'] != last_drifted.get(guild_id, 0):
+                    logging.warning(f"Balance drift in guild {guild_id}: {result['drifted_count']} users "
+                                    f"({result['drift_total']:+.2f} USDT), see /balance_drift.")
+                last_drifted[guild_id] = result['drifted_count']
+        except Exception as exc:
+            logging.error(f"Balance reconciliation failed: {exc}")
+        await asyncio.sleep(BALANCE_RECONCILE_INTERVAL_MINUTES * 60)
+
+
+def is_guild_ready(guild: discord.Guild | None) -> bool:
+    """邀请缓存是否已完成预热（私信等无 guild 的场景视为就绪）。"""
+    return guild is None or guild.id in primed_guild_ids
+
+
+@bot.event
+async def setup_hook():
+    global _levels_watch_task, _archive_task, _backup_task, _ledger_task
+    # 每个进程都统计自身的 REST 调用，并在配置了 METRICS_PORT 时导出指标
+    metrics.install_rest_instrumentation(bot.http)
     try:
-        await bot.tree.sync()
-        logging.info("Global slash commands synced.")
+        await metrics.start_http_server()
     except Exception as exc:
-        logging.error(f"Failed to sync global slash commands: {exc}")
-    # 将全局指令复制到各个公会并进行 guild 级同步（更快生效）
-    for guild in bot.guilds:
+        logging.error(f"Failed to start metrics endpoint: {exc}")
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
+    # 配置了 CAPTURE_FILE 时录制网关事件，供 replay.py 回放
+    capture.install(bot)
+    # 会员有效期定时器（各服务器的定时器在预热时载入）
+    membership_timers.start()
+    # 等级配置：以 LEVELS_CONFIG_FILE 为准（若配置），并在文件修改后自动热更新
+    levels.load_initial()
+    if LEVELS_CONFIG_FILE and _levels_watch_task is None:
+        _levels_watch_task = asyncio.create_task(levels.watch_file(LEVELS_RELOAD_INTERVAL))
+    # 多进程分片模式下全局性的一次性工作只由持有 0 号分片的进程执行
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        return
+    # 启动时全库自拉自清理（一次性）
+    with _timed_phase("setup.purge_self_invites"):
         try:
-            bot.tree.copy_global_to(guild=guild)
-            await bot.tree.sync(guild=guild)
-            logging.info(f"Guild slash commands synced for guild {guild.id}.")
+            with Database() as db:
+                db.purge_all_self_invites()
         except Exception as exc:
-            logging.error(f"Failed to sync slash commands for guild {guild.id}: {exc}")
+            logging.error(f"Failed to purge self-invites on startup: {exc}")
+    # 定时归档已结算的冷数据（多进程模式下由写入进程负责）
+    if ARCHIVE_RETENTION_DAYS > 0 and not DB_WRITER_ADDRESS and _archive_task is None:
+        _archive_task = asyncio.create_task(_archive_loop())
+    # 定时在线备份（只由一个进程执行）
+    if BACKUP_INTERVAL_HOURS > 0 and _backup_task is None:
+        _backup_task = asyncio.create_task(_backup_loop())
+    # 定时余额对账（增量，只汇总上次之后的新流水）
+    if BALANCE_RECONCILE_INTERVAL_MINUTES > 0 and _ledger_task is None:
+        _ledger_task = asyncio.create_task(_balance_reconcile_loop())
+    # 全局斜杠指令同步（一次性）；指令树指纹未变化时跳过
+    with _timed_phase("setup.global_command_sync"):
+        try:
+            await sync_command_tree()
+        except Exception as exc:
+            logging.error(f"Failed to sync global slash commands: {exc}")
+    _log_startup_timings("setup.")
+
+
+@bot.event
+async def on_ready():
+    logging.info(f"Logged in as {bot.user}")
+    guilds = list(bot.guilds)
+    # 单服部署升级到分区数据后，将迁移到默认分区的旧数据归属到唯一的服务器
+    if len(guilds) == 1 and guilds[0].id != DEFAULT_GUILD_ID:
+        try:
+            with Database(guilds[0].id) as db:
+                db.adopt_legacy_rows(DEFAULT_GUILD_ID)
+        except Exception as exc:
+            logging.error(f"Failed to adopt legacy rows for guild {guilds[0].id}: {exc}")
+    semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+    # 各服务器并发刷新邀请缓存（重连时邀请可能已变化，每次就绪都执行）
+    with _timed_phase("ready.invite_cache"):
+        await asyncio.gather(*(_bounded(semaphore, _prime_guild(guild)) for guild in guilds))
+    # 对账离线期间漏发的升级佣金
+    if RECONCILE_ON_STARTUP:
+        with _timed_phase("ready.reconcile"):
+            for guild in guilds:
+                try:
+                    report = await reconcile_missed_upgrades(guild)
+                    if report:
+                        total = sum(item["amount"] for item in report)
+                        logging.info(f"Reconciled {len(report)} missed upgrades in guild {guild.id}, total {total:.2f} USDT.")
+                except Exception as exc:
+                    logging.error(f"Failed to reconcile missed upgrades for guild {guild.id}: {exc}")
+    # 将全局指令复制到尚未同步过的公会并进行 guild 级同步（更快生效）
+    pending = [guild for guild in guilds if guild.id not in _synced_guild_ids]
+    with _timed_phase("ready.guild_command_sync"):
+        await asyncio.gather(*(_bounded(semaphore, _sync_guild_commands(guild)) for guild in pending))
+    _log_startup_timings("ready.")
+
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    metrics.finish_command(interaction)
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    await _prime_guild(guild)
+    await _sync_guild_commands(guild)
 
 
 # Slash: /bthlp
@@ -236,7 +615,7 @@ async def slash_bthlp(interaction: discord.Interaction):
     )
     # 动态生成佣金分配比例显示
     commission_lines = []
-    for level in LEVELS_CONFIG:
+    for level in levels.current().levels:
         commission_lines.append(f"{level.name} | {level.commission}% 佣金分成")
     commission_text = "```\n" + "\n".join(commission_lines) + "\n```" if commission_lines else "暂无配置"
 
@@ -255,6 +634,66 @@ async def slash_bthlp(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed, view=view)
 
 
+async def run_report(interaction: discord.Interaction, kind: str, params: dict):
+    """在报表进程中执行（见 reports.py），进度显示在已 defer 的原始响应中；忙、超时或失败时已回复并返回 None。"""
+    label = reports.REPORT_LABELS[kind]
+
+    async def progress(text):
+        await interaction.edit_original_response(content=f"⏳ {label}：{text}")
+
+    try:
+        return await report_service.run(kind, params, on_progress=progress, user_id=interaction.user.id)
+    except reports.ReportBusy as busy:
+        elapsed = time.monotonic() - busy.job['started']
+        await interaction.edit_original_response(
+            content=f"{label}正在生成中（由 <@{busy.job['user_id']}> 发起，已运行 {elapsed:.0f} 秒），请完成后再试。"
+        )
+    except reports.ReportTimeout:
+        logging.warning(f"Report {kind} in guild {interaction.guild_id} exceeded {report_service.time_budget:g}s, cancelled.")
+        await interaction.edit_original_response(
+            content=f"{label}超出时间预算（{report_service.time_budget:g} 秒），已取消。请缩小范围后重试。"
+        )
+    except Exception as exc:
+        logging.error(f"Report {kind} in guild {interaction.guild_id} failed: {exc}")
+        await interaction.edit_original_response(content=f"{label}失败：{exc}")
+    return None
+
+
+async def slash_userstats_list(interaction: discord.Interaction):
+    """累计佣金>0的用户列表：在报表进程中一次聚合，前若干名显示在 embed 中，完整列表以 CSV 附件提供。"""
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    result = await run_report(interaction, 'leaderboard', {'guild_id': interaction.guild_id})
+    if result is None:
+        return
+    rows = result['rows']
+    if not rows:
+        await interaction.edit_original_response(content="暂无累计佣金>0的用户。")
+        return
+    guild = interaction.guild
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('user_id', 'username', 'role', 'balance', 'total', 'settled', 'unsettled'))
+    lines = []
+    for uid, username, balance, role_id, total, settled in rows:
+        # 优先使用缓存中的实时角色名称（不逐个 fetch_member），回退到 DB 标记
+        member_obj = guild.get_member(uid) if guild else None
+        if member_obj:
+            paid = get_highest_paid_role(member_obj.roles)
+            role_name = paid.name if paid else "普通会员"
+        else:
+            role_name = "付费会员" if role_id else "普通会员"
+        unsettled = total - settled
+        writer.writerow((uid, username or '', role_name, round(balance, 2), round(total, 2), round(settled, 2),
+                         round(unsettled, 2)))
+        lines.append(f"**{role_name}** · <@{uid}> — 总:{total:.2f} / 已:{settled:.2f} / 待:{unsettled:.2f} USDT")
+    chunks = _chunk_text("\n".join(lines), limit=4000)
+    embed = discord.Embed(title="累计佣金用户列表", description=chunks[0], color=discord.Color.gold())
+    shown = chunks[0].count("\n") + 1
+    embed.set_footer(text=f"共 {len(rows)} 人" + (f"，显示前 {shown} 人，完整列表见附件" if shown < len(rows) else ""))
+    csv_file = discord.File(io.BytesIO(buffer.getvalue().encode('utf-8')), filename="userstats.csv")
+    await interaction.edit_original_response(content=None, embed=embed, attachments=[csv_file])
+
+
 # Slash: /userstats（仅管理员）
 @app_commands.default_permissions(administrator=True)
 @bot.tree.command(name="userstats", description="查看用户统计或列出累计佣金用户（管理员）")
@@ -268,33 +707,11 @@ async def slash_userstats(interaction: discord.Interaction, user: discord.Member
     if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
         return
+    if user is None:
+        await slash_userstats_list(interaction)
+        return
     try:
-        with Database() as db:
-            if user is None:
-                positive_users = db.get_positive_balance_users()
-                if not positive_users:
-                    await interaction.response.send_message("暂无累计佣金>0的用户。", ephemeral=True)
-                    return
-                lines = []
-                for uid, username, balance, role_id in positive_users:
-                    # 优先使用实时角色名称，回退到 DB 标记
-                    live_role_name = None
-                    member_obj = interaction.guild.get_member(uid) if interaction.guild else None
-                    if not member_obj and interaction.guild:
-                        try:
-                            member_obj = await interaction.guild.fetch_member(uid)
-                        except Exception:
-                            member_obj = None
-                    if member_obj:
-                        paid = get_highest_paid_role(member_obj.roles)
-                        live_role_name = paid.name if paid else "普通会员"
-                    role_name = live_role_name if live_role_name else ("付费会员" if role_id else "普通会员")
-                    mention = f"<@{uid}>"
-                    total, settled, unsettled = db.get_commission_stats(uid)
-                    lines.append(f"**{role_name}** · {mention} — 总:{total:.2f} / 已:{settled:.2f} / 待:{unsettled:.2f} USDT")
-                embed = discord.Embed(title="累计佣金用户列表", description="\n".join(lines), color=discord.Color.gold())
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-                return
+        with Database(interaction.guild_id) as db:
             # 单用户详情
             target = user
             user_row = db.get_user_by_id(target.id)
@@ -316,6 +733,14 @@ async def slash_userstats(interaction: discord.Interaction, user: discord.Member
             embed.add_field(name="📊 总佣金", value=f"{total:.2f} USDT", inline=False)
             embed.add_field(name="✅ 已结算", value=f"{settled:.2f} USDT", inline=False)
             embed.add_field(name="🕒 待结算", value=f"{unsettled:.2f} USDT", inline=False)
+            downline = db.get_downline_counts(target.id)
+            if downline:
+                earned = dict(db.get_commission_by_level(target.id))
+                embed.add_field(
+                    name="🌳 下线",
+                    value="\n".join(f"第{depth}级：{count} 人 · 佣金 {float(earned.get(depth, 0)):.2f} USDT" for depth, count in downline),
+                    inline=False,
+                )
             if invite_url:
                 embed.add_field(name="最新邀请链接", value=f"```{invite_url}```", inline=False)
             else:
@@ -325,7 +750,7 @@ async def slash_userstats(interaction: discord.Interaction, user: discord.Member
                 lines = []
                 recent_events = db.get_recent_referral_events(target.id, limit=10)
                 if recent_events:
-                    for nm_id, when_text, amount, settled_flag, role_id_val in recent_events:
+                    for nm_id, when_text, amount, settled_flag, role_id_val, level, renewal in recent_events:
                         # 仅展示升级入账事件：amount>0；排除自拉自
                         if amount and amount > 0 and nm_id != target.id:
                             mention = f"<@{nm_id}>"
@@ -343,7 +768,9 @@ async def slash_userstats(interaction: discord.Interaction, user: discord.Member
                                 role_disp = live_paid.name if live_paid else None
                             if role_disp is None:
                                 role_disp = role_obj.name if role_obj else "付费会员"
-                            lines.append(f"+ {amount:.2f} ·  {mention} · 升级: {role_disp} · 时间: {when_text}")
+                            level_disp = f" · 第{level}级分成" if level and level > 1 else ""
+                            action = "续费" if renewal else "升级"
+                            lines.append(f"+ {amount:.2f} ·  {mention} · {action}: {role_disp}{level_disp} · 时间: {when_text}")
                 # 在同一 Embed 中展示记录
                 embed.add_field(name="📜 佣金记录", value="\n".join(lines) if lines else "暂无佣金记录", inline=False)
             except Exception:
@@ -376,7 +803,8 @@ async def slash_remove_paid_roles(interaction: discord.Interaction, user: discor
         return
     try:
         member_roles = list(user.roles or [])
-        paid_roles = [r for r in member_roles if r.id in PAID_ROLE_ID_SET]
+        paid_role_ids = levels.current().paid_role_ids
+        paid_roles = [r for r in member_roles if r.id in paid_role_ids]
         if not paid_roles:
             await interaction.response.send_message(f"{user.mention} 没有可移除的付费身份。", ephemeral=True)
             return
@@ -395,13 +823,14 @@ async def slash_remove_paid_roles(interaction: discord.Interaction, user: discor
         await interaction.response.send_message(f"操作失败: {exc}", ephemeral=True)
 
 @bot.event
+@metrics.timed_handler()
 async def on_member_remove(member: discord.Member):
     """成员退群：标记其邀请链接失效，并尝试删除对应邀请。"""
+    invalidate_member_panels(member.guild.id, member.id)
     try:
-        with Database() as db:
+        with Database(member.guild.id) as db:
             # 标记 invites_v2 为 inactive
-            db.cursor.execute('''UPDATE invites_v2 SET active = 0 WHERE user_id = ?''', (member.id,))
-            db.conn.commit()
+            db.deactivate_invites_v2(member.id)
         # 尝试删除其名下的所有邀请（如果 inviter 记录为该用户）
         try:
             invites = await member.guild.invites()
@@ -433,7 +862,7 @@ async def slash_settle(interaction: discord.Interaction, user: discord.Member, a
         await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
         return
     try:
-        with Database() as db:
+        with Database(interaction.guild_id) as db:
             # 若未指定金额，则结算全部待结算
             total, settled, unsettled = db.get_commission_stats(user.id)
             to_settle = unsettled if amount is None else min(max(amount, 0.0), unsettled)
@@ -441,6 +870,7 @@ async def slash_settle(interaction: discord.Interaction, user: discord.Member, a
                 await interaction.response.send_message("无可结算金额。", ephemeral=True)
                 return
             settled_sum = db.settle_user_amount(user.id, to_settle)
+            panels.invalidate(interaction.guild_id, user.id)
             embed = discord.Embed(title="佣金结算完成", color=discord.Color.green())
             embed.add_field(name="用户", value=f"{user.mention} ({user})", inline=False)
             embed.add_field(name="结算金额", value=f"{settled_sum:.2f} USDT", inline=False)
@@ -450,6 +880,551 @@ async def slash_settle(interaction: discord.Interaction, user: discord.Member, a
         await interaction.response.send_message(f"结算失败: {exc}", ephemeral=True)
 
 
+# Slash: /reconcile（仅管理员）补发离线期间漏发的升级佣金
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="reconcile", description="对账并补发离线期间漏发的升级佣金（管理员）")
+@app_commands.describe(dry_run="仅预览不入账（默认是）")
+async def slash_reconcile(interaction: discord.Interaction, dry_run: bool = True):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        report = await reconcile_missed_upgrades(interaction.guild, dry_run=dry_run)
+        title = "漏发佣金对账（预览）" if dry_run else "漏发佣金对账（已入账）"
+        embed = discord.Embed(title=title, color=discord.Color.orange() if dry_run else discord.Color.green())
+        if report:
+            lines = [
+                f"<@{item['inviter_id']}> ← <@{item['member_id']}> · 升级: {item['to_role_name']}"
+                + (f" · 第{item['level']}级分成" if item.get('level') else "")
+                + f" · +{item['amount']:.2f}"
+                for item in report
+            ]
+            chunks = _chunk_text("\n".join(lines), limit=1000)
+            embed.add_field(name="待补发明细", value=chunks[0], inline=False)
+            if len(chunks) > 1:
+                embed.add_field(name="\u200b", value=f"……另有 {len(chunks) - 1} 段明细未展示", inline=False)
+            total = sum(item["amount"] for item in report)
+            embed.add_field(name="合计", value=f"{len(report)} 笔 / {total:.2f} USDT", inline=False)
+        else:
+            embed.description = "没有发现漏发的升级佣金。"
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    except Exception as exc:
+        logging.error(f"/reconcile failed: {exc}")
+        await interaction.followup.send(f"对账失败: {exc}", ephemeral=True)
+
+
+# Slash: /resync_commands（仅管理员）忽略指纹强制同步斜杠指令
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="resync_commands", description="强制重新同步斜杠指令（管理员）")
+async def slash_resync_commands(interaction: discord.Interaction):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    failed = []
+    for guild in [None, *bot.guilds]:
+        try:
+            await sync_command_tree(guild, force=True)
+        except Exception as exc:
+            scope = f"guild:{guild.id}" if guild else "global"
+            logging.error(f"Forced slash command sync failed for {scope}: {exc}")
+            failed.append(scope)
+    if failed:
+        await interaction.followup.send(f"部分同步失败：{', '.join(failed)}", ephemeral=True)
+    else:
+        await interaction.followup.send(f"已强制同步全局及 {len(bot.guilds)} 个服务器的斜杠指令。", ephemeral=True)
+
+
+# Slash: /archive_events（仅管理员）归档早于保留期的已结算佣金流水
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="archive_events", description="归档早于保留期的已结算佣金流水（管理员）")
+@app_commands.describe(days="保留天数（默认 ARCHIVE_RETENTION_DAYS）", dry_run="仅预览不归档（默认是）")
+async def slash_archive_events(interaction: discord.Interaction, days: app_commands.Range[int, 1, 3650] | None = None,
+                               dry_run: bool = True):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    days = days or ARCHIVE_RETENTION_DAYS
+    if days <= 0:
+        await interaction.response.send_message("请指定保留天数（未配置 ARCHIVE_RETENTION_DAYS）。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        if dry_run:
+            count, amount = await asyncio.to_thread(archive.pending_summary, days, interaction.guild_id)
+            message = f"{days} 天前的已结算流水共 {count} 条（{amount:.2f} USDT），执行时 dry_run 选“否”即可归档。"
+        else:
+            result = await asyncio.to_thread(archive.archive_settled_events, days, interaction.guild_id)
+            panels.clear(interaction.guild_id)
+            message = (f"已归档 {result['events']} 条已结算流水（{result['amount']:.2f} USDT），"
+                       f"共 {result['batches']} 批，用时 {result['seconds']:.2f} 秒。统计总额保持不变。")
+    except Exception as exc:
+        logging.error(f"/archive_events failed: {exc}")
+        message = f"归档失败：{exc}"
+    await interaction.followup.send(message, ephemeral=True)
+
+
+# Slash: /balance_drift（仅管理员）核对用户余额与佣金流水/结算记录
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="balance_drift", description="核对用户余额与佣金流水（管理员）")
+@app_commands.describe(full="忽略上次对账位置，全量重建（默认否）")
+async def slash_balance_drift(interaction: discord.Interaction, full: bool = False):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        result = await asyncio.to_thread(ledger.reconcile, interaction.guild_id, full, limit=5000)
+    except Exception as exc:
+        logging.error(f"/balance_drift failed: {exc}")
+        await interaction.followup.send(f"对账失败：{exc}", ephemeral=True)
+        return
+    count = result['drifted_count']
+    embed = discord.Embed(
+        title="余额对账",
+        description=(f"{'全量' if result['mode'] == 'full' else '增量'}对账：新增流水 {result['events']} 条、"
+                     f"结算记录 {result['payouts']} 条，用时 {result['seconds']:.2f} 秒"),
+        color=discord.Color.orange() if count else discord.Color.green(),
+    )
+    embed.add_field(name="偏差用户", value=f"{count} 人", inline=True)
+    embed.add_field(name="偏差合计", value=f"{result['drift_total']:+.2f} USDT", inline=True)
+    if count:
+        lines = [
+            f"<@{user_id}> 余额 {balance:.2f} / 应有 {credits - payouts:.2f}（{drift:+.2f}）"
+            for user_id, _, balance, credits, payouts, drift in result['drifted'][:10]
+        ]
+        embed.add_field(name="偏差最大", value="\n".join(lines), inline=False)
+        embed.set_footer(text="偏差 = 当前余额 - (累计佣金 - 累计结算)" + ("；附件仅含前 5000 人" if count > 5000 else ""))
+        csv_file = discord.File(io.BytesIO(ledger.drift_csv(result['drifted']).encode('utf-8')), filename="balance_drift.csv")
+        await interaction.followup.send(embed=embed, file=csv_file, ephemeral=True)
+        return
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+# Slash: /flagged_inviters（仅管理员）查看疑似刷邀请、待审核的邀请者
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="flagged_inviters", description="查看疑似刷邀请的邀请者（管理员）")
+async def slash_flagged_inviters(interaction: discord.Interaction):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    with Database(interaction.guild_id) as db:
+        rows = db.get_flagged_inviters(limit=20)
+    if not rows:
+        await interaction.response.send_message("当前没有待审核的邀请者。", ephemeral=True)
+        return
+    embed = discord.Embed(title="待审核的邀请者", color=discord.Color.red())
+    for user_id, username, _, details, flagged_at, hold, held_total in rows:
+        status = f"暂扣佣金 {held_total:.2f} USDT" if hold else "未暂扣佣金"
+        embed.add_field(
+            name=f"{username or user_id}（{flagged_at}）",
+            value=f"<@{user_id}> {details}\n{status}",
+            inline=False,
+        )
+    embed.set_footer(text="使用 /review_inviter 释放或没收暂扣的佣金")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# Slash: /review_inviter（仅管理员）审核被标记的邀请者：释放（暂扣佣金入账并解除标记）或没收暂扣佣金
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="review_inviter", description="审核被标记的邀请者（管理员）")
+@app_commands.describe(member="被标记的邀请者", action="审核结果")
+@app_commands.choices(
+    action=[
+        app_commands.Choice(name="释放（正常邀请，暂扣佣金入账）", value="release"),
+        app_commands.Choice(name="没收（确认刷邀请，暂扣佣金作废）", value="forfeit"),
+    ],
+)
+async def slash_review_inviter(interaction: discord.Interaction, member: discord.Member, action: str):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with Database(interaction.guild_id) as db:
+            if db.get_flag_status(member.id) != 'flagged':
+                await interaction.response.send_message(f"{member.mention} 当前不在待审核名单中。", ephemeral=True)
+                return
+            if action == "release":
+                amount = db.release_flagged_inviter(member.id, now)
+                fraud_detector.reset(interaction.guild_id, member.id)
+                message = f"已释放 {member.mention}，{amount:.2f} USDT 暂扣佣金已入账。"
+            else:
+                amount = db.forfeit_held_commissions(member.id, now)
+                message = f"已没收 {member.mention} 的暂扣佣金 {amount:.2f} USDT，该邀请者仍保持标记。"
+    except Exception as exc:
+        logging.error(f"/review_inviter failed: {exc}")
+        await interaction.response.send_message(f"审核失败：{exc}", ephemeral=True)
+        return
+    panels.invalidate(interaction.guild_id, member.id)
+    logging.info(f"Inviter {member.id} in guild {interaction.guild_id} reviewed by {interaction.user.id}: "
+                 f"{action}, {amount:.2f} USDT.")
+    await interaction.response.send_message(message, ephemeral=True)
+
+# Slash: /export_data（仅管理员）流式导出用户/佣金流水/结算记录并上传文件
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="export_data", description="导出用户、佣金流水或结算记录（管理员）")
+@app_commands.describe(
+    table="导出的数据",
+    fmt="文件格式（默认 CSV）",
+    since="起始日期（含），YYYY-MM-DD",
+    until="截止日期（不含），YYYY-MM-DD",
+    inviter="只导出该邀请者（结算记录为结算对象）",
+    settled="仅佣金流水：按是否已结算过滤",
+)
+@app_commands.choices(
+    table=[
+        app_commands.Choice(name="佣金流水", value="referral_events"),
+        app_commands.Choice(name="结算记录", value="payouts"),
+        app_commands.Choice(name="用户", value="users"),
+    ],
+    fmt=[
+        app_commands.Choice(name="CSV", value="csv"),
+        app_commands.Choice(name="JSONL", value="jsonl"),
+    ],
+)
+async def slash_export_data(interaction: discord.Interaction, table: str, fmt: str = "csv",
+                            since: str | None = None, until: str | None = None,
+                            inviter: discord.Member | None = None, settled: bool | None = None):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    try:
+        since = export.parse_time_bound(since) if since else None
+        until = export.parse_time_bound(until) if until else None
+    except ValueError:
+        await interaction.response.send_message("日期格式应为 YYYY-MM-DD。", ephemeral=True)
+        return
+    if settled is not None and table != "referral_events":
+        await interaction.response.send_message("只有佣金流水支持按结算状态过滤。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    # 报表进程写入临时文件，本进程只负责上传，导出大表时两边内存占用都保持平稳
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        result = await run_report(interaction, 'export', {
+            'table': table, 'guild_id': interaction.guild_id, 'path': path, 'fmt': fmt, 'since': since,
+            'until': until, 'inviter_id': inviter.id if inviter else None, 'settled': settled, 'include_archived': True,
+        })
+        if result is None:
+            return
+        size = result['size']
+        limit = getattr(interaction.guild, "filesize_limit", 25 * 1024 * 1024)
+        if size > limit:
+            await interaction.edit_original_response(
+                content=f"导出文件 {size / 1024 / 1024:.1f} MiB 超过上传上限 {limit / 1024 / 1024:.0f} MiB，"
+                        f"请缩小时间范围或使用 `python export.py {table}`。"
+            )
+            return
+        filename = export.export_filename(table, fmt, True, since, until)
+        logging.info(f"Exported {result['rows']} {table} rows ({size} bytes) for guild {interaction.guild_id} "
+                     f"in {result['seconds']:.2f}s.")
+        await interaction.edit_original_response(
+            content=f"已导出 {result['rows']} 行（gzip 压缩，{size / 1024:.1f} KiB）。",
+            attachments=[discord.File(path, filename=filename)],
+        )
+    except Exception as exc:
+        logging.error(f"/export_data failed: {exc}")
+        await interaction.edit_original_response(content=f"导出失败：{exc}")
+    finally:
+        os.remove(path)
+
+# Slash: /backup_status（仅管理员）查看最近一次在线备份，可立即执行一次
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="backup_status", description="查看数据库在线备份状态（管理员）")
+@app_commands.describe(run_now="立即执行一次备份（默认否）")
+async def slash_backup_status(interaction: discord.Interaction, run_now: bool = False):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    if run_now:
+        try:
+            await asyncio.to_thread(backup.run_backup)
+        except RuntimeError:
+            await interaction.followup.send("已有备份正在进行，请稍后再试。", ephemeral=True)
+            return
+    status = backup.last_status()
+    if not status:
+        await interaction.followup.send("尚未执行过备份。", ephemeral=True)
+        return
+    embed = discord.Embed(
+        title="数据库备份" + ("" if status.get("ok") else "（失败）"),
+        color=discord.Color.green() if status.get("ok") else discord.Color.red(),
+    )
+    embed.add_field(name="开始时间", value=status.get("started_at", "-"), inline=True)
+    embed.add_field(name="总耗时", value=f"{status.get('seconds', 0):.2f} 秒", inline=True)
+    if BACKUP_INTERVAL_HOURS > 0:
+        embed.add_field(name="自动备份", value=f"每 {BACKUP_INTERVAL_HOURS:g} 小时", inline=True)
+    lines = [
+        f"{item['file']} · {item['bytes'] / 1024 / 1024:.1f} MiB · {item['seconds']:.2f} 秒 · 完整性 {item['integrity']}"
+        for item in status.get("files", [])
+    ]
+    if status.get("error"):
+        lines.append(f"错误：{status['error']}")
+    embed.add_field(name="快照", value="\n".join(lines) or "无", inline=False)
+    embed.set_footer(text=f"保留快照 {len(backup.list_snapshots())} 份")
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+# Slash: /reload_levels（仅管理员）立即从 LEVELS_CONFIG_FILE 重新加载等级配置
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="reload_levels", description="热更新等级配置（管理员）")
+async def slash_reload_levels(interaction: discord.Interaction):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    if not LEVELS_CONFIG_FILE:
+        await interaction.response.send_message("未配置 LEVELS_CONFIG_FILE，等级配置来自环境变量，需重启生效。", ephemeral=True)
+        return
+    try:
+        changed, snapshot = levels.reload()
+    except Exception as exc:
+        logging.error(f"/reload_levels failed: {exc}")
+        await interaction.response.send_message(f"加载失败，仍使用版本 {levels.current().version}：{exc}", ephemeral=True)
+        return
+    lines = [f"{level.name} | tier {level.tier} | {level.commission}% | {level.price} USDT" for level in snapshot.levels]
+    embed = discord.Embed(
+        title="等级配置已更新" if changed else "等级配置无变化",
+        description=f"当前版本：`{snapshot.version}`（{snapshot.loaded_at}）",
+        color=discord.Color.green() if changed else discord.Color.light_grey(),
+    )
+    embed.add_field(name="等级", value="```\n" + "\n".join(lines) + "\n```", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# Slash: /perfstats（仅管理员）查看处理函数、数据库方法与 REST 调用的耗时统计
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="perfstats", description="查看性能统计（管理员）")
+@app_commands.describe(reset="查看后清空统计（默认否）")
+async def slash_perfstats(interaction: discord.Interaction, reset: bool = False):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    embed = discord.Embed(title="性能统计", color=discord.Color.blurple())
+    sections = [
+        ("处理函数（按累计耗时）", metrics.summary_rows("handler_latency_seconds", "handler")),
+        ("数据库方法（按累计耗时）", metrics.summary_rows("db_latency_seconds", "method")),
+        ("REST 路由（按 p99）", metrics.summary_rows("rest_latency_seconds", "route", sort_by="p99")),
+        ("REST 调用次数（按处理函数）", metrics.rest_calls_by_handler()),
+    ]
+    for title, rows in sections:
+        chunks = _chunk_text("\n".join(rows)) if rows else ["暂无数据"]
+        embed.add_field(name=title, value=chunks[0], inline=False)
+    acks = metrics.histograms.get("interaction_ack_seconds", {}).get(())
+    missed = metrics.counter_total("interaction_ack_missed_total")
+    if acks:
+        ack_text = (f"共 {acks.count} 次，p50={acks.quantile(50) * 1000:.0f}ms，p99={acks.quantile(99) * 1000:.0f}ms，"
+                    f"超出 3 秒窗口 {missed} 次")
+    else:
+        ack_text = "暂无数据"
+    embed.add_field(name="交互首次响应", value=ack_text, inline=False)
+    clicks = {result: metrics.counter_total("component_clicks_total", result=result)
+              for result in ("executed", "coalesced", "rejected")}
+    if any(clicks.values()):
+        embed.add_field(name="按钮点击", value=(f"执行 {clicks['executed']} 次，合并重复点击 {clicks['coalesced']} 次，"
+                                            f"冷却中拒绝 {clicks['rejected']} 次"), inline=False)
+    cache_lines = []
+    for action, label in (("check_commission", "查看佣金"), ("check_records", "查看记录")):
+        hits = metrics.counter_total("panel_cache_requests_total", action=action, result="hit")
+        misses = metrics.counter_total("panel_cache_requests_total", action=action, result="miss")
+        if hits + misses:
+            cache_lines.append(f"{label}：命中率 {hits / (hits + misses):.0%}（{hits}/{hits + misses}）")
+    if cache_lines:
+        cache_lines.append(f"已缓存 {len(panels)} 个用户")
+        embed.add_field(name="面板缓存", value="\n".join(cache_lines), inline=False)
+    lag = metrics.histograms.get("loop_lag_seconds", {}).get(())
+    if lag:
+        lag_text = (f"p50={lag.quantile(50) * 1000:.1f}ms，p99={lag.quantile(99) * 1000:.1f}ms，"
+                    f"最大 {lag.max * 1000:.0f}ms，超阈值 {metrics.counter_total('loop_stalls_total')} 次")
+        embed.add_field(name="事件循环延迟", value=lag_text, inline=False)
+    errors = metrics.counter_total("handler_errors_total") + metrics.counter_total("db_errors_total")
+    embed.set_footer(text=f"异常次数：{errors}" + ("（已清空统计）" if reset else ""))
+    if reset:
+        metrics.reset()
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# Slash: /sqlstats（仅管理员）按语句形态查看 SQLite 耗时画像（需 SQL_TRACE=true）
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="sqlstats", description="查看 SQL 语句耗时画像（管理员）")
+@app_commands.describe(sort_by="排序方式", reset="查看后清空统计（默认否）")
+@app_commands.choices(sort_by=[
+    app_commands.Choice(name="累计耗时", value="total"),
+    app_commands.Choice(name="p99", value="p99"),
+    app_commands.Choice(name="调用次数", value="calls"),
+])
+async def slash_sqlstats(interaction: discord.Interaction, sort_by: str = "total", reset: bool = False):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    if not SQL_TRACE:
+        await interaction.response.send_message("未启用 SQL 追踪，请在 .env 中设置 SQL_TRACE=true 后重启。", ephemeral=True)
+        return
+    rows = sqltrace.summary_rows(limit=10, sort_by=sort_by)
+    embed = discord.Embed(title="SQL 语句耗时画像", color=discord.Color.blurple())
+    if rows:
+        for index, row in enumerate(rows, 1):
+            head, _, shape = row.partition("\n")
+            embed.add_field(name=f"{index}. {head}", value=f"```sql\n{shape.strip()[:1000]}\n```", inline=False)
+    else:
+        embed.description = "暂无数据"
+    footer = "慢查询阈值 {:.0f}ms，明细见慢查询日志".format(sqltrace.SQL_SLOW_MS)
+    embed.set_footer(text=footer + ("（已清空统计）" if reset else ""))
+    if reset:
+        sqltrace.reset()
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# Slash: /profile（仅管理员）在不中断服务的情况下采集 N 秒 cProfile
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="profile", description="采集运行中的性能剖析（管理员）")
+@app_commands.describe(seconds="采集时长（秒）", sort_by="排序方式")
+@app_commands.choices(sort_by=[
+    app_commands.Choice(name="累计耗时", value="cumulative"),
+    app_commands.Choice(name="自身耗时", value="tottime"),
+    app_commands.Choice(name="调用次数", value="ncalls"),
+])
+async def slash_profile(interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 600] = 10,
+                        sort_by: str = "cumulative"):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    if profiler.is_running():
+        await interaction.response.send_message("已有性能剖析正在进行，请稍后再试。", ephemeral=True)
+        return
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        path, rows, total = await profiler.capture(seconds, sort_by=sort_by)
+    except RuntimeError:
+        await interaction.followup.send("已有性能剖析正在进行，请稍后再试。", ephemeral=True)
+        return
+    except Exception as exc:
+        logging.error(f"Profile capture failed: {exc}")
+        await interaction.followup.send(f"性能剖析失败: {exc}", ephemeral=True)
+        return
+    logging.info(f"Profile capture of {seconds}s saved to {path}.")
+    embed = discord.Embed(
+        title=f"性能剖析（{seconds} 秒）",
+        description=f"事件循环线程内记录的总耗时 {total * 1000:.0f}ms（含 select 空闲等待）\n完整结果：`{path}`",
+        color=discord.Color.blurple(),
+    )
+    header = f"{'累计':>10} {'自身':>10} {'调用':>7} 函数"
+    chunks = _chunk_text("\n".join(rows), limit=1000 - len(header) - 8) if rows else ["暂无数据"]
+    embed.add_field(name="热点函数", value=f"```\n{header}\n{chunks[0]}\n```", inline=False)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+
+# Slash: /simulate_plans（仅管理员）用历史升级记录模拟候选佣金方案
+@app_commands.default_permissions(administrator=True)
+@bot.tree.command(name="simulate_plans", description="用历史记录模拟候选佣金方案（管理员）")
+@app_commands.describe(plans="方案 JSON 文件（格式见 README）")
+async def slash_simulate_plans(interaction: discord.Interaction, plans: discord.Attachment):
+    # 白名单：若已配置，仅允许名单内用户使用
+    if SLASH_ALLOWED_USER_ID_SET and interaction.user.id not in SLASH_ALLOWED_USER_ID_SET:
+        await interaction.response.send_message("该命令仅限指定用户使用。", ephemeral=True)
+        return
+    # 运行时权限兜底校验
+    if not getattr(interaction.user, "guild_permissions", None) or not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("只有管理员可以使用该命令。", ephemeral=True)
+        return
+    if plans.size > 1024 * 1024:
+        await interaction.response.send_message("方案文件过大（上限 1MB）。", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        plans_text = (await plans.read()).decode('utf-8')
+        # 先在本进程校验，格式错误无需启动报表进程
+        simulator.load_plans(plans_text)
+    except Exception as exc:
+        await interaction.edit_original_response(content=f"方案文件无效：{exc}")
+        return
+    # 加载历史与计算在报表进程中进行；当前生效的配置（可能已热更新）随任务传入作为对照
+    snapshot = levels.current()
+    result = await run_report(interaction, 'simulation', {
+        'guild_id': interaction.guild_id, 'plans_text': plans_text,
+        'current_levels': snapshot.to_json(), 'current_version': snapshot.version,
+    })
+    if result is None:
+        return
+    timings = result['timings']
+    logging.info(f"Simulated {result['plans']} plans over {result['events']} upgrade events in guild {interaction.guild_id} "
+                 f"(load {timings['load_seconds']:.2f}s, evaluate {timings['evaluate_seconds']:.3f}s).")
+    embed = discord.Embed(
+        title="佣金方案模拟",
+        description=f"升级事件 {result['events']} 条，邀请者 {result['inviters']} 人；Δ 为相对实际已产生佣金的差额（USDT）",
+        color=discord.Color.blurple(),
+    )
+    chunks = _chunk_text("\n".join(result['table']), limit=1000 - 8)
+    for index, chunk in enumerate(chunks[:5]):
+        embed.add_field(name="对比" if index == 0 else "\u200b", value=f"```\n{chunk}\n```", inline=False)
+    csv_file = discord.File(io.BytesIO(result['csv'].encode('utf-8')), filename="simulation.csv")
+    await interaction.edit_original_response(content=None, embed=embed, attachments=[csv_file])
+
+
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def settle(ctx, member: discord.Member, amount: float):
@@ -458,13 +1433,14 @@ async def settle(ctx, member: discord.Member, amount: float):
         await ctx.send("结算金额必须大于 0。")
         return
     try:
-        with Database() as db:
+        with Database(ctx.guild.id if ctx.guild else None) as db:
             user = db.get_user_by_id(member.id)
             current_balance = float(user[4] if user else 0)
             if amount > current_balance:
                 await ctx.send(f"结算失败：金额超过当前余额（当前 {current_balance} USDT）。")
                 return
             new_balance = db.adjust_reward_balance(member.id, -amount)
+            panels.invalidate(db.guild_id, member.id)
             embed = discord.Embed(title="佣金结算完成", color=discord.Color.green())
             embed.add_field(name="用户", value=f"{member.mention} ({member})", inline=False)
             embed.add_field(name="结算金额", value=f"{amount} USDT", inline=False)
@@ -475,9 +1451,288 @@ async def settle(ctx, member: discord.Member, amount: float):
         await ctx.send(f"结算失败: {exc}")
 
 
+async def _reply(interaction: discord.Interaction, message: dict):
+    """发送一条 ephemeral 回复：尚未响应时直接响应，否则走 followup。"""
+    if not interaction.response.is_done():
+        await interaction.response.send_message(**message, ephemeral=True)
+    else:
+        await interaction.followup.send(**message, ephemeral=True)
+
+
+@component_router.register('check_records')
+async def render_check_records(interaction: discord.Interaction) -> list[dict]:
+    """“查看记录”按钮：面板可能来自缓存，查询时间在每次发送时填入（复制首条 embed，不改动缓存）。"""
+    messages = await _render_check_records(interaction)
+    embed = messages[0]['embed'].copy()
+    query_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    embed.set_footer(text=f"{embed.footer.text} \n查询时间：{query_time}")
+    return [{**messages[0], 'embed': embed}, *messages[1:]]
+
+
+@panels.cached('check_records')
+async def _render_check_records(interaction: discord.Interaction) -> list[dict]:
+    """角色、邀请者、加入时间与邀请的成员（长列表分多条消息）。"""
+    with Database(interaction.guild_id) as db:
+        user_id = interaction.user.id
+        user_data = db.get_user_by_id(user_id)
+        role_name = get_user_role_name(interaction.user.roles, interaction.guild)
+
+        embed = discord.Embed(title="📊 查看记录", color=discord.Color.blue())
+        embed.add_field(name=":bust_in_silhouette: 角色", value=f"**{role_name or '普通会员'}**", inline=False)
+
+        if user_data and user_data[2]:
+            referrer_id = user_data[2]
+            embed.add_field(name=":bust_in_silhouette: 邀请者", value=f"<@{referrer_id}>", inline=False)
+        else:
+            embed.add_field(name=":bust_in_silhouette: 邀请者", value="暂无", inline=False)
+
+        if user_data and user_data[3]:
+            join_date = user_data[3]
+            embed.add_field(name=":date: 加入时间", value=join_date, inline=False)
+        else:
+            # 兜底使用 Discord 的 joined_at（本地时区）
+            if getattr(interaction.user, "joined_at", None):
+                embed.add_field(name=":date: 加入时间", value=format_dt_local(interaction.user.joined_at), inline=False)
+            else:
+                embed.add_field(name=":date: 加入时间", value="暂无", inline=False)
+
+        referred_users = db.get_referred_users(user_id)
+        # 过滤掉自拉自的记录
+        filtered_referred = [ru for ru in (referred_users or []) if ru[0] != user_id]
+        invited_count = len(filtered_referred)
+        if filtered_referred:
+            lines = []
+            for idx, referred_user in enumerate(filtered_referred, start=1):
+                referred_user_id = referred_user[0]
+                referred_username = referred_user[1] or ""
+                join_text = referred_user[2] or ""
+                # 显示为 mm-dd HH:MM
+                try:
+                    dt = datetime.strptime(join_text, "%Y-%m-%d %H:%M:%S")
+                    join_display = dt.strftime("%m-%d %H:%M")
+                except Exception:
+                    join_display = join_text
+                # 优先取当前在线成员的实际付费角色名称
+                cur_member = interaction.guild.get_member(referred_user_id) if interaction.guild else None
+                if cur_member:
+                    live_paid = get_highest_paid_role(cur_member.roles)
+                    r_role_name = live_paid.name if live_paid else "普通会员"
+                else:
+                    # 若未缓存，再尝试 fetch_member
+                    fetch_member_obj = None
+                    if interaction.guild:
+                        try:
+                            fetch_member_obj = await interaction.guild.fetch_member(referred_user_id)
+                        except Exception:
+                            fetch_member_obj = None
+                    if fetch_member_obj:
+                        live_paid = get_highest_paid_role(fetch_member_obj.roles)
+                        r_role_name = live_paid.name if live_paid else "普通会员"
+                    else:
+                        r_role_id = referred_user[3]
+                        role_obj = interaction.guild.get_role(r_role_id) if r_role_id and interaction.guild else None
+                        r_role_name = role_obj.name if role_obj else "普通会员"
+                name_part = f"{referred_username}\n" if referred_username else ""
+                lines.append(f"{idx}. <@{referred_user_id}> ({referred_user_id}) - {join_display}\n└ 用户组: {r_role_name}")
+            all_text = "\n".join(lines)
+            chunks = _chunk_text(all_text, limit=1000)
+            embed.add_field(name=":busts_in_silhouette: 你邀请的成员", value=chunks[0], inline=False)
+        else:
+            embed.add_field(name=":busts_in_silhouette: 你邀请的成员", value="暂无", inline=False)
+
+        embed.set_footer(text="提示: 当你邀请的成员升级用户组时,你将获得佣金奖励!")
+        messages = [{'embed': embed}]
+        # 追加长列表的后续分块
+        if filtered_referred:
+            all_text = "\n".join(lines)
+            chunks = _chunk_text(all_text, limit=1000)
+            if len(chunks) > 1:
+                for extra in chunks[1:]:
+                    extra_embed = discord.Embed(title="邀请系统 · 你邀请的成员(续)", color=discord.Color.blue())
+                    extra_embed.add_field(name=":busts_in_silhouette: 你邀请的成员(续)", value=extra, inline=False)
+                    messages.append({'embed': extra_embed})
+        event_log.info("Button '查看记录' clicked by %s successfully.", interaction.user.name)
+        event_log.debug("User %s has invited %s members.", user_id, invited_count)
+        return messages
+
+
+@component_router.register('check_commission')
+@panels.cached('check_commission')
+async def render_check_commission(interaction: discord.Interaction) -> list[dict]:
+    """“查看佣金”按钮：佣金比例、累计/待结算/已结算与最近的佣金记录。"""
+    with Database(interaction.guild_id) as db:
+        user_id = interaction.user.id
+        allowed_role = get_highest_paid_role(interaction.user.roles)
+        role_name = allowed_role.name if allowed_role else "普通会员"
+        # 佣金比例：付费角色取其配置；普通会员在允许时取 BASIC_INVITE_COMMISSION，否则为 0
+        role_commission = commission_percent_for_inviter(interaction.user)
+        role_price = price_for_role(allowed_role) if allowed_role else 0
+        # 统计口径：总=历史事件总和；已=settled=1 事件总和；待=总-已
+        total, settled, unsettled = db.get_commission_stats(user_id)
+        embed = discord.Embed(
+            title="💰 我的佣金",
+            description=(f"**{role_name}** | 佣金比例: {role_commission}%"),
+            color=discord.Color.gold()
+        )
+        stats = (
+            f"累计佣金: {total:.2f} USDT\n"
+            f"待结算: {unsettled:.2f} USDT\n"
+            f"已结算: {settled:.2f} USDT"
+        )
+        embed.add_field(name="📊 佣金统计", value=stats, inline=False)
+        # 佣金记录：仅显示入账事件（升级触发）；不显示结算流水；并为没有升级记录的受邀成员补 +0
+        lines = []
+        try:
+            recent_events = db.get_recent_referral_events(user_id, limit=10)
+            if recent_events:
+                for nm_id, when_text, amount, settled_flag, role_id_val, level, renewal in recent_events:
+                    # 仅展示升级入账事件：amount>0；排除自拉自
+                    if amount and amount > 0 and nm_id != user_id:
+                        mention = f"<@{nm_id}>"
+                        role_obj = interaction.guild.get_role(role_id_val) if role_id_val and interaction.guild else None
+                        role_disp = None
+                        if not role_obj and interaction.guild:
+                            member_obj = interaction.guild.get_member(nm_id)
+                            if not member_obj:
+                                try:
+                                    member_obj = await interaction.guild.fetch_member(nm_id)
+                                except Exception:
+                                    member_obj = None
+                            live_paid = get_highest_paid_role(member_obj.roles) if member_obj else None
+                            role_disp = live_paid.name if live_paid else None
+                        if role_disp is None:
+                            role_disp = role_obj.name if role_obj else "付费会员"
+                        level_disp = f" · 第{level}级分成" if level and level > 1 else ""
+                        action = "续费" if renewal else "升级"
+                        lines.append(f"+ {amount:.2f} ·  {mention} · {action}: {role_disp}{level_disp} · 时间: {when_text}")
+        except Exception:
+            pass
+        if lines:
+            chunks = _chunk_text("\n".join(lines), limit=1000)
+            embed.add_field(name="📜 佣金记录", value=chunks[0], inline=False)
+        else:
+            embed.add_field(name="📜 佣金记录", value="暂无佣金记录", inline=False)
+        embed.set_footer(text="💡 提示: 当你邀请的成员升级用户组时,你将获得佣金奖励!")
+
+        messages = [{'embed': embed}]
+        # 佣金记录追加分块
+        if lines:
+            chunks = _chunk_text("\n".join(lines), limit=1000)
+            if len(chunks) > 1:
+                for extra in chunks[1:]:
+                    extra_embed = discord.Embed(title="邀请系统 · 佣金记录(续)", color=discord.Color.gold())
+                    extra_embed.add_field(name="📜 佣金记录(续)", value=extra, inline=False)
+                    messages.append({'embed': extra_embed})
+        event_log.info("Button '查看佣金' clicked by %s successfully.", interaction.user.name)
+        event_log.debug(
+            "Commission query for user %s: role=%s, commission=%s, price=%s, total=%s, settled=%s, unsettled=%s",
+            user_id, allowed_role.id if allowed_role else 'none', role_commission, role_price, total, settled, unsettled
+        )
+        return messages
+
+
+@component_router.register('invite_friend')
+async def render_invite_friend(interaction: discord.Interaction) -> list[dict]:
+    """“邀请好友”按钮：复用有效的邀请链接，失效或不存在时创建一次。"""
+    with Database(interaction.guild_id) as db:
+        user_id = interaction.user.id
+        # 获取完整的成员信息（包含所有角色）
+        member = interaction.guild.get_member(user_id) if interaction.guild else None
+        if not member and interaction.guild:
+            try:
+                member = await interaction.guild.fetch_member(user_id)
+            except Exception:
+                member = interaction.user
+        else:
+            member = member or interaction.user
+
+        # 计算角色与佣金、邀请统计
+        allowed_role = get_highest_paid_role(member.roles)
+        role_name = allowed_role.name if allowed_role else "普通会员"
+
+        # 调试日志：输出用户的所有角色ID和配置的角色ID集合（仅在 DEBUG 开启时构造）
+        if event_log.isEnabledFor(logging.DEBUG):
+            event_log.debug("User %s roles: %s", user_id, [r.id for r in member.roles])
+            event_log.debug("Configured paid role IDs: %s", set(levels.current().paid_role_ids))
+
+        # 开关：普通会员邀请资格
+        if (allowed_role is None) and (not ALLOW_BASIC_INVITER):
+            return [{'content': "当前未开放普通会员邀请资格。"}]
+        role_commission = commission_percent_for_inviter(member)
+        referred_users = db.get_referred_users(user_id)
+        invited_count = len(referred_users) if referred_users else 0
+
+        # 选择用于创建邀请的频道：ENV 指定 > ALLOWED_CHANNELS[0] > 当前频道
+        target_channel = None
+        if INVITE_CHANNEL_ID:
+            target_channel = interaction.guild.get_channel(INVITE_CHANNEL_ID)
+        if target_channel is None and ALLOWED_CHANNEL_IDS:
+            target_channel = interaction.guild.get_channel(ALLOWED_CHANNEL_IDS[0])
+        if target_channel is None:
+            target_channel = interaction.channel
+
+        # 先从 invites_v2 取最新，否则从 invites 取；仅在无效/不存在时创建
+        # 优先使用机器人生成并存放在 invites 表中的“永久”链接
+        existing_url = None
+        row = db.get_invite_link_by_user(user_id)
+        if row and row[0]:
+            existing_url = row[0]
+        else:
+            latest_v2 = db.get_latest_invite_v2(user_id)
+            if latest_v2:
+                existing_url = latest_v2[1]
+
+        valid_url = None
+        if existing_url:
+            code = existing_url.rsplit('/', 1)[-1]
+            try:
+                await interaction.guild.fetch_invite(code)
+                valid_url = existing_url
+            except discord.NotFound:
+                # 只有确认为不存在才重建
+                pass
+            except Exception:
+                # 权限等其他错误一律信任已有链接，避免每次都重建
+                valid_url = existing_url
+
+        if valid_url is None:
+            # 未找到或已失效：只创建一次，并更新 DB
+            new_invite = await target_channel.create_invite(max_age=0, max_uses=0, unique=True)
+            try:
+                await interaction.guild.fetch_invite(new_invite.code)
+            except Exception:
+                pass
+            valid_url = new_invite.url
+            db.set_invite_link(user_id, valid_url)
+            try:
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                db.add_invite_v2(user_id, new_invite.code, valid_url, target_channel.id, now)
+            except Exception:
+                pass
+            if interaction.guild:
+                await cache_guild_invites(interaction.guild)
+
+        embed = discord.Embed(
+            title="邀请好友",
+            description=f"**{role_name}**，您的邀请佣金分成是 {role_commission}%",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="邀请链接", value=f"```{valid_url}```", inline=False)
+        embed.add_field(name="邀请统计", value=f"已邀请人数：{invited_count}", inline=False)
+        embed.add_field(name="佣金分成", value=f"您将获得 {role_commission}% 的邀请佣金", inline=False)
+        embed.set_footer(text="分享链接邀请好友加入服务器获得持续返佣，邀请的好友开通和续费会员，全部都有佣金提成！")
+        event_log.info(
+            "Button '邀请好友' clicked by %s successfully. Link delivered (reused if valid).", interaction.user.name
+        )
+        return [{'embed': embed}]
+
+
 @bot.event
+# 按钮交互按 custom_id 分别统计；斜杠指令由 MetricsCommandTree 统计
+@metrics.timed_handler(lambda interaction: f"button.{(interaction.data or {}).get('custom_id')}"
+                       if interaction.type == discord.InteractionType.component else None)
 async def on_interaction(interaction):
-    logging.debug(f"Interaction received: {interaction.data}")
+    event_log.debug("Interaction received: %s", interaction.data)
 
     # 仅处理组件交互（按钮等），忽略斜杠指令以避免误判 custom_id
     try:
@@ -495,290 +1750,37 @@ async def on_interaction(interaction):
         pass
 
     if interaction.channel.id not in ALLOWED_CHANNEL_IDS:
-        logging.debug(f"Wrong channel ID: {interaction.channel.id}.")
+        event_log.debug("Wrong channel ID: %s.", interaction.channel.id)
         await interaction.followup.send("此频道不允许交互！", ephemeral=True)
         return
 
+    # 启动预热未完成时（邀请缓存尚未就绪）友好提示，避免基于不完整缓存生成/统计邀请
+    if not is_guild_ready(interaction.guild):
+        await interaction.followup.send("机器人正在启动，请稍后再试。", ephemeral=True)
+        return
+
     if 'custom_id' not in interaction.data:
         logging.error(f"No custom_id in interaction data for user {interaction.user.name}.")
         await interaction.followup.send("交互数据缺少 custom_id，无法继续操作！", ephemeral=True)
         return
 
     button_id = interaction.data['custom_id']
-    logging.debug(f"Button custom_id: {button_id}")
-
-    try:
-        with Database() as db:
-            if button_id == 'check_records':
-                user_id = interaction.user.id
-                user_data = db.get_user_by_id(user_id)
-                role_name = get_user_role_name(interaction.user.roles, interaction.guild)
-
-                embed = discord.Embed(title="📊 查看记录", color=discord.Color.blue())
-                embed.add_field(name=":bust_in_silhouette: 角色", value=f"**{role_name or '普通会员'}**", inline=False)
-
-                if user_data and user_data[2]:
-                    referrer_id = user_data[2]
-                    embed.add_field(name=":bust_in_silhouette: 邀请者", value=f"<@{referrer_id}>", inline=False)
-                else:
-                    embed.add_field(name=":bust_in_silhouette: 邀请者", value="暂无", inline=False)
-
-                if user_data and user_data[3]:
-                    join_date = user_data[3]
-                    embed.add_field(name=":date: 加入时间", value=join_date, inline=False)
-                else:
-                    # 兜底使用 Discord 的 joined_at（本地时区）
-                    if getattr(interaction.user, "joined_at", None):
-                        embed.add_field(name=":date: 加入时间", value=format_dt_local(interaction.user.joined_at), inline=False)
-                    else:
-                        embed.add_field(name=":date: 加入时间", value="暂无", inline=False)
-
-                referred_users = db.get_referred_users(user_id)
-                # 过滤掉自拉自的记录
-                filtered_referred = [ru for ru in (referred_users or []) if ru[0] != user_id]
-                invited_count = len(filtered_referred)
-                if filtered_referred:
-                    lines = []
-                    for idx, referred_user in enumerate(filtered_referred, start=1):
-                        referred_user_id = referred_user[0]
-                        referred_username = referred_user[1] or ""
-                        join_text = referred_user[2] or ""
-                        # 显示为 mm-dd HH:MM
-                        try:
-                            dt = datetime.strptime(join_text, "%Y-%m-%d %H:%M:%S")
-                            join_display = dt.strftime("%m-%d %H:%M")
-                        except Exception:
-                            join_display = join_text
-                        # 优先取当前在线成员的实际付费角色名称
-                        cur_member = interaction.guild.get_member(referred_user_id) if interaction.guild else None
-                        if cur_member:
-                            live_paid = get_highest_paid_role(cur_member.roles)
-                            r_role_name = live_paid.name if live_paid else "普通会员"
-                        else:
-                            # 若未缓存，再尝试 fetch_member
-                            fetch_member_obj = None
-                            if interaction.guild:
-                                try:
-                                    fetch_member_obj = await interaction.guild.fetch_member(referred_user_id)
-                                except Exception:
-                                    fetch_member_obj = None
-                            if fetch_member_obj:
-                                live_paid = get_highest_paid_role(fetch_member_obj.roles)
-                                r_role_name = live_paid.name if live_paid else "普通会员"
-                            else:
-                                r_role_id = referred_user[3]
-                                role_obj = interaction.guild.get_role(r_role_id) if r_role_id and interaction.guild else None
-                                r_role_name = role_obj.name if role_obj else "普通会员"
-                        name_part = f"{referred_username}\n" if referred_username else ""
-                        lines.append(f"{idx}. <@{referred_user_id}> ({referred_user_id}) - {join_display}\n└ 用户组: {r_role_name}")
-                    all_text = "\n".join(lines)
-                    chunks = _chunk_text(all_text, limit=1000)
-                    embed.add_field(name=":busts_in_silhouette: 你邀请的成员", value=chunks[0], inline=False)
-                else:
-                    embed.add_field(name=":busts_in_silhouette: 你邀请的成员", value="暂无", inline=False)
-
-                query_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                embed.set_footer(text=f"提示: 当你邀请的成员升级用户组时,你将获得佣金奖励! \n查询时间：{query_time}")
-                sent_via_response = False
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
-                    sent_via_response = True
-                else:
-                    await interaction.followup.send(embed=embed, ephemeral=True)
-                # 追加长列表的后续分块
-                if filtered_referred:
-                    all_text = "\n".join(lines)
-                    chunks = _chunk_text(all_text, limit=1000)
-                    if len(chunks) > 1:
-                        for extra in chunks[1:]:
-                            extra_embed = discord.Embed(title="邀请系统 · 你邀请的成员(续)", color=discord.Color.blue())
-                            extra_embed.add_field(name=":busts_in_silhouette: 你邀请的成员(续)", value=extra, inline=False)
-                            await interaction.followup.send(embed=extra_embed, ephemeral=True)
-                logging.info(f"Button '查看记录' clicked by {interaction.user.name} successfully.")
-                logging.debug(f"User {user_id} has invited {invited_count} members.")
-
-            elif button_id == 'check_commission':
-                user_id = interaction.user.id
-                user_data = db.get_user_by_id(user_id)
-                allowed_role = get_highest_paid_role(interaction.user.roles)
-                role_name = allowed_role.name if allowed_role else "普通会员"
-                # 佣金比例：付费角色取其配置；普通会员在允许时取 BASIC_INVITE_COMMISSION，否则为 0
-                role_commission = commission_percent_for_inviter(interaction.user)
-                role_price = price_for_role(allowed_role) if allowed_role else 0
-                # 统计口径：总=历史事件总和；已=settled=1 事件总和；待=总-已
-                total, settled, unsettled = db.get_commission_stats(user_id)
-                embed = discord.Embed(
-                    title="💰 我的佣金",
-                    description=(f"**{role_name}** | 佣金比例: {role_commission}%"),
-                    color=discord.Color.gold()
-                )
-                stats = (
-                    f"累计佣金: {total:.2f} USDT\n"
-                    f"待结算: {unsettled:.2f} USDT\n"
-                    f"已结算: {settled:.2f} USDT"
-                )
-                embed.add_field(name="📊 佣金统计", value=stats, inline=False)
-                # 佣金记录：仅显示入账事件（升级触发）；不显示结算流水；并为没有升级记录的受邀成员补 +0
-                lines = []
-                try:
-                    recent_events = db.get_recent_referral_events(user_id, limit=10)
-                    if recent_events:
-                        for nm_id, when_text, amount, settled_flag, role_id_val in recent_events:
-                            # 仅展示升级入账事件：amount>0；排除自拉自
-                            if amount and amount > 0 and nm_id != user_id:
-                                mention = f"<@{nm_id}>"
-                                role_obj = interaction.guild.get_role(role_id_val) if role_id_val and interaction.guild else None
-                                role_disp = None
-                                if not role_obj and interaction.guild:
-                                    member_obj = interaction.guild.get_member(nm_id)
-                                    if not member_obj:
-                                        try:
-                                            member_obj = await interaction.guild.fetch_member(nm_id)
-                                        except Exception:
-                                            member_obj = None
-                                    live_paid = get_highest_paid_role(member_obj.roles) if member_obj else None
-                                    role_disp = live_paid.name if live_paid else None
-                                if role_disp is None:
-                                    role_disp = role_obj.name if role_obj else "付费会员"
-                                lines.append(f"+ {amount:.2f} ·  {mention} · 升级: {role_disp} · 时间: {when_text}")
-                except Exception:
-                    pass
-                if lines:
-                    chunks = _chunk_text("\n".join(lines), limit=1000)
-                    embed.add_field(name="📜 佣金记录", value=chunks[0], inline=False)
-                else:
-                    embed.add_field(name="📜 佣金记录", value="暂无佣金记录", inline=False)
-                embed.set_footer(text="💡 提示: 当你邀请的成员升级用户组时,你将获得佣金奖励!")
-
-                sent_via_response = False
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
-                    sent_via_response = True
-                else:
-                    await interaction.followup.send(embed=embed, ephemeral=True)
-                # 佣金记录追加分块
-                if lines:
-                    chunks = _chunk_text("\n".join(lines), limit=1000)
-                    if len(chunks) > 1:
-                        for extra in chunks[1:]:
-                            extra_embed = discord.Embed(title="邀请系统 · 佣金记录(续)", color=discord.Color.gold())
-                            extra_embed.add_field(name="📜 佣金记录(续)", value=extra, inline=False)
-                            await interaction.followup.send(embed=extra_embed, ephemeral=True)
-                logging.info(f"Button '查看佣金' clicked by {interaction.user.name} successfully.")
-                logging.debug(
-                    f"Commission query for user {user_id}: role={allowed_role.id if allowed_role else 'none'}, "
-                    f"commission={role_commission}, price={role_price}, total={total}, settled={settled}, unsettled={unsettled}"
-                )
-
-            elif button_id == 'invite_friend':
-                user_id = interaction.user.id
-                # 获取完整的成员信息（包含所有角色）
-                member = interaction.guild.get_member(user_id) if interaction.guild else None
-                if not member and interaction.guild:
-                    try:
-                        member = await interaction.guild.fetch_member(user_id)
-                    except Exception:
-                        member = interaction.user
-                else:
-                    member = member or interaction.user
-                
-                # 计算角色与佣金、邀请统计
-                allowed_role = get_highest_paid_role(member.roles)
-                role_name = allowed_role.name if allowed_role else "普通会员"
-                
-                # 调试日志：输出用户的所有角色ID和配置的角色ID集合
-                user_role_ids = [r.id for r in member.roles]
-                logging.debug(f"User {user_id} roles: {user_role_ids}")
-                logging.debug(f"Configured paid role IDs: {ALL_PAID_ROLE_ID_SET}")
-                
-                # 开关：普通会员邀请资格
-                if (allowed_role is None) and (not ALLOW_BASIC_INVITER):
-                    if not interaction.response.is_done():
-                        await interaction.response.send_message("当前未开放普通会员邀请资格。", ephemeral=True)
-                    else:
-                        await interaction.followup.send("当前未开放普通会员邀请资格。", ephemeral=True)
-                    return
-                role_commission = commission_percent_for_inviter(member)
-                referred_users = db.get_referred_users(user_id)
-                invited_count = len(referred_users) if referred_users else 0
-
-                # 选择用于创建邀请的频道：ENV 指定 > ALLOWED_CHANNELS[0] > 当前频道
-                target_channel = None
-                if INVITE_CHANNEL_ID:
-                    target_channel = interaction.guild.get_channel(INVITE_CHANNEL_ID)
-                if target_channel is None and ALLOWED_CHANNEL_IDS:
-                    target_channel = interaction.guild.get_channel(ALLOWED_CHANNEL_IDS[0])
-                if target_channel is None:
-                    target_channel = interaction.channel
-
-                # 先从 invites_v2 取最新，否则从 invites 取；仅在无效/不存在时创建
-                # 优先使用机器人生成并存放在 invites 表中的“永久”链接
-                existing_url = None
-                row = db.get_invite_link_by_user(user_id)
-                if row and row[0]:
-                    existing_url = row[0]
-                else:
-                    latest_v2 = db.get_latest_invite_v2(user_id)
-                    if latest_v2:
-                        existing_url = latest_v2[1]
-
-                valid_url = None
-                if existing_url:
-                    code = existing_url.rsplit('/', 1)[-1]
-                    try:
-                        await interaction.guild.fetch_invite(code)
-                        valid_url = existing_url
-                    except discord.NotFound:
-                        # 只有确认为不存在才重建
-                        pass
-                    except Exception:
-                        # 权限等其他错误一律信任已有链接，避免每次都重建
-                        valid_url = existing_url
-
-                if valid_url is None:
-                    # 未找到或已失效：只创建一次，并更新 DB
-                    new_invite = await target_channel.create_invite(max_age=0, max_uses=0, unique=True)
-                    try:
-                        await interaction.guild.fetch_invite(new_invite.code)
-                    except Exception:
-                        pass
-                    valid_url = new_invite.url
-                    db.set_invite_link(user_id, valid_url)
-                    try:
-                        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        db.add_invite_v2(user_id, new_invite.code, valid_url, target_channel.id, now)
-                    except Exception:
-                        pass
-                    if interaction.guild:
-                        await cache_guild_invites(interaction.guild)
+    event_log.debug("Button custom_id: %s", button_id)
 
-                embed = discord.Embed(
-                    title="邀请好友",
-                    description=f"**{role_name}**，您的邀请佣金分成是 {role_commission}%",
-                    color=discord.Color.green()
-                )
-                embed.add_field(name="邀请链接", value=f"```{valid_url}```", inline=False)
-                embed.add_field(name="邀请统计", value=f"已邀请人数：{invited_count}", inline=False)
-                embed.add_field(name="佣金分成", value=f"您将获得 {role_commission}% 的邀请佣金", inline=False)
-                embed.set_footer(text="分享链接邀请好友加入服务器获得持续返佣，邀请的好友开通和续费会员，全部都有佣金提成！")
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
-                else:
-                    await interaction.followup.send(embed=embed, ephemeral=True)
-                logging.info(
-                    f"Button '邀请好友' clicked by {interaction.user.name} successfully. Link delivered (reused if valid)."
-                )
-
-            elif button_id == 'noop':
-                pass
-
-            else:
-                logging.error(f"Unknown custom_id: {button_id} for user {interaction.user.name}.")
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("无效的操作！", ephemeral=True)
-                else:
-                    await interaction.followup.send("无效的操作！", ephemeral=True)
+    if button_id == 'noop':
+        return
+    if button_id not in component_router:
+        logging.error(f"Unknown custom_id: {button_id} for user {interaction.user.name}.")
+        await _reply(interaction, {'content': "无效的操作！"})
+        return
 
+    try:
+        # 同一用户同一按钮执行中的重复点击合并为一次执行，完成后的短时间内再次点击直接拒绝
+        outcome, messages = await component_router.dispatch(interaction, button_id)
+        if outcome != 'executed':
+            event_log.info("Button %s clicked by %s %s.", button_id, interaction.user.name, outcome)
+        for message in messages:
+            await _reply(interaction, message)
     except Exception as exc:
         logging.error(f"Error processing interaction for user {interaction.user.name}: {exc}")
         if not interaction.response.is_done():
@@ -791,10 +1793,39 @@ async def on_interaction(interaction):
         logging.error(f"Interaction failed for user {interaction.user.name}.")
 
 
+def check_referral_abuse(member: discord.Member, inviter_user_id: int, invite_code: str | None):
+    """将本次加入计入邀请者的滑动窗口；触发规则时持久化标记（可选暂扣其后续佣金）。"""
+    reasons, stats = fraud_detector.observe(
+        member.guild.id, inviter_user_id, getattr(member, 'created_at', None), invite_code
+    )
+    if not reasons:
+        return
+    details = fraud.describe(reasons, stats)
+    try:
+        with Database(member.guild.id) as db:
+            flagged = db.flag_inviter(
+                inviter_user_id, ",".join(reasons), details, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                hold=FRAUD_HOLD_COMMISSIONS
+            )
+    except Exception as exc:
+        logging.error(f"Failed to flag inviter {inviter_user_id}: {exc}")
+        return
+    if flagged:
+        for reason in reasons:
+            metrics.inc('fraud_flags_total', reason=reason)
+        logging.warning(f"Flagged inviter {inviter_user_id} in guild {member.guild.id} for review "
+                        f"({','.join(reasons)}): {stats['joins']} joins, {stats['young']} new accounts "
+                        f"in {stats['window_minutes']:g} min, code {invite_code} used {stats['code_joins']} times"
+                        f"{'; commissions held' if FRAUD_HOLD_COMMISSIONS else ''}.")
+
+
 @bot.event
+@metrics.timed_handler()
 async def on_member_join(member: discord.Member):
-    logging.info(f"Member {member} joined guild {member.guild.id}.")
+    event_log.info("Member %s joined guild %s.", member, member.guild.id)
 
+    if not is_guild_ready(member.guild):
+        logging.warning(f"Member {member.id} joined guild {member.guild.id} before invite cache was primed; inviter may be unresolved.")
     previous_invites = invite_cache.get(member.guild.id, {}).copy()
     current_invites = await cache_guild_invites(member.guild)
     used_invite = None
@@ -810,7 +1841,7 @@ async def on_member_join(member: discord.Member):
         if used_invite:
             invite_code = used_invite.code
             try:
-                with Database() as db:
+                with Database(member.guild.id) as db:
                     # 优先用我们记录的 code→inviter 归属（适用于机器人代创建链接）
                     mapped_uid = db.get_inviter_by_code(invite_code)
                     if mapped_uid:
@@ -839,13 +1870,13 @@ async def on_member_join(member: discord.Member):
             except Exception as exc:
                 logging.error(f"Failed inviter attribution via code mapping: {exc}")
             if inviter_user_id:
-                logging.info(f"Detected inviter {inviter_user_id} for new member {member} with invite code {invite_code}.")
+                event_log.info("Detected inviter %s for new member %s with invite code %s.", inviter_user_id, member, invite_code)
         else:
-            logging.debug(
-                f"No matching invite usage found for member {member}. Previous cache size: {len(previous_invites)}."
+            event_log.debug(
+                "No matching invite usage found for member %s. Previous cache size: %s.", member, len(previous_invites)
             )
     else:
-        logging.debug(f"Invite cache unavailable for guild {member.guild.id}; inviter cannot be resolved.")
+        event_log.debug("Invite cache unavailable for guild %s; inviter cannot be resolved.", member.guild.id)
 
     # 以北京时间记录加入时间（优先使用 Discord 提供的 joined_at）
     if getattr(member, "joined_at", None):
@@ -857,7 +1888,7 @@ async def on_member_join(member: discord.Member):
     role_id = primary_role.id if primary_role else None
 
     try:
-        with Database() as db:
+        with Database(member.guild.id) as db:
             db.add_or_update_user(
                 user_id=member.id,
                 username=str(member),
@@ -871,6 +1902,11 @@ async def on_member_join(member: discord.Member):
             # 不在加入时计佣。佣金在 on_member_update（角色升级）事件里发放。
     except Exception as exc:
         logging.error(f"Failed to store member {member} in database: {exc}")
+    # 邀请者的“查看记录”多了一位成员；重新加入的成员本人数据也已更新
+    panels.invalidate(member.guild.id, member.id, inviter_user_id)
+
+    if FRAUD_DETECTION and inviter_user_id and inviter_user_id != member.id:
+        check_referral_abuse(member, inviter_user_id, used_invite.code if used_invite else None)
 
     # 使用邀请通知频道
     notification_channel = await get_channel_by_id(member.guild, INVITE_NOTIFICATION_CHANNEL_ID)
@@ -904,34 +1940,165 @@ async def on_member_join(member: discord.Member):
 
     try:
         await notification_channel.send(embed=embed)
-        logging.info(f"Sent welcome notification for {member}.")
-        logging.debug(f"Welcome embed sent for member {member.id}")
+        event_log.info("Sent welcome notification for %s.", member)
+        event_log.debug("Welcome embed sent for member %s", member.id)
     except Exception as exc:
         logging.error(f"Failed to send welcome notification for {member}: {exc}")
 
 
+async def send_commission_notice(guild: discord.Guild, inviter_id: int, member: discord.Member, title: str,
+                                 change_text: str, amount: float, now_text: str, awards=()):
+    """发送佣金奖励通知到指定频道（awards 为上线分成 (上线ID, 层级, 金额) 列表）。"""
+    try:
+        notify_channel = await get_channel_by_id(guild, COMMISSION_NOTIFICATION_CHANNEL_ID)
+        if notify_channel:
+            inviter_mention = f"<@{inviter_id}>"
+            embed = discord.Embed(title=title, color=discord.Color.gold())
+            embed.description = f"恭喜 {inviter_mention} 获得了 {amount} USDT 的佣金!"
+            embed.add_field(name="👤 被邀请者", value=member.mention, inline=False)
+            embed.add_field(name="🔄 角色变更", value=change_text, inline=False)
+            embed.add_field(name="💵 佣金金额", value=f"{amount} USDT", inline=False)
+            if awards:
+                embed.add_field(
+                    name="🔗 上线分成",
+                    value="\n".join(f"第{depth}级 <@{uid}>：{value} USDT" for uid, depth, value in awards),
+                    inline=False,
+                )
+            embed.add_field(name="获得时间", value=now_text, inline=False)
+            await notify_channel.send(embed=embed)
+    except Exception as exc:
+        logging.error(f"Failed to send commission notification: {exc}")
+
+
+# 会员有效期与续费：每个受邀付费成员一个持久化定时器（membership_timers），全部由一个调度任务按到期时间触发
+def track_membership(db: Database, member_id: int, role: discord.Role, snapshot: levels.LevelSnapshot,
+                     start: float | None = None):
+    """付费角色开通/升级后开始新的有效期；永久等级（period_days=0）不跟踪。"""
+    level = snapshot.level_for_role(role.id)
+    if not level or not level.period_days:
+        db.delete_membership_timer(member_id)
+        membership_timers.cancel((db.guild_id, member_id))
+        return
+    start = start or time.time()
+    expires_at = start + level.period_days * 86400
+    db.set_membership_timer(member_id, role.id, start, expires_at)
+    membership_timers.schedule((db.guild_id, member_id), expires_at)
+
+
+def is_renewal(db: Database, member_id: int, role: discord.Role, snapshot: levels.LevelSnapshot) -> bool:
+    """已为该角色计过佣的成员重新获得角色时，若上一期已到期（宽限中或已过期）则为续费，否则视为角色被临时移除后恢复。"""
+    level = snapshot.level_for_role(role.id)
+    if not level or not level.period_days:
+        return False
+    timer = db.get_membership_timer(member_id)
+    if not timer:
+        # 未跟踪过有效期（如启用续费前的老会员）不按续费处理
+        return False
+    _, _, expires_at, _, state = timer
+    return state in ('grace', 'lapsed') or expires_at <= time.time()
+
+
+async def pay_renewal(guild: discord.Guild, db: Database, member: discord.Member, role: discord.Role, inviter_id: int,
+                      snapshot: levels.LevelSnapshot, period_start: float | None = None):
+    """按角色全价为邀请者（及上线）发放续费佣金，并在同一事务中开始新的有效期。"""
+    level = snapshot.level_for_role(role.id)
+    percent = commission_percent_for_inviter(guild.get_member(inviter_id), snapshot)
+    amount = round(level.price * (percent / 100.0), 2)
+    payouts = [(inviter_id, 1, amount)] if amount > 0 else []
+    awards = upline_awards(guild, db, member.id, level.price, snapshot)
+    payouts.extend((uid, depth, value) for uid, depth, value in awards)
+    start = period_start or time.time()
+    expires_at = start + level.period_days * 86400
+    now_text = format_dt_local(datetime.now(ZoneInfo("UTC")))
+    db.apply_renewal(member.id, role.id, now_text, snapshot.version, payouts, start, expires_at)
+    panels.invalidate(guild.id, *(uid for uid, _, _ in payouts))
+    membership_timers.schedule((db.guild_id, member.id), expires_at)
+    logging.info(f"Renewal of role {role.id} by member {member.id}: paid {amount} to inviter {inviter_id}"
+                 f"{' and ' + str(len(awards)) + ' uplines' if awards else ''} (levels {snapshot.version}).")
+    if amount > 0:
+        await send_commission_notice(guild, inviter_id, member, "💰 续费佣金", f"{role.name} 续费", amount, now_text, awards)
+
+
+async def handle_membership_timer(key):
+    """定时器到期：有效期结束时仍持有角色则进入宽限期；宽限期结束仍持有角色视为已续费；角色已移除则记为过期。"""
+    guild_id, user_id = key
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        return
+    snapshot = levels.current()
+    with Database(guild_id) as db:
+        timer = db.get_membership_timer(user_id)
+        if not timer or timer[4] == 'lapsed':
+            return
+        role_id, _, expires_at, due_at, state = timer
+        if due_at > time.time() + 1:
+            # 内存中的调度已过时（如有效期被续上），按库中时间重新调度
+            membership_timers.schedule(key, due_at)
+            return
+        level = snapshot.level_for_role(role_id)
+        if not level or not level.period_days:
+            # 等级配置已改为永久或已移除，不再跟踪
+            db.delete_membership_timer(user_id)
+            return
+        member = guild.get_member(user_id)
+        role = guild.get_role(role_id)
+        if member is None or role is None or role not in member.roles:
+            db.set_membership_timer_state(user_id, 'lapsed', expires_at)
+            logging.info(f"Membership of role {role_id} for member {user_id} in guild {guild_id} lapsed.")
+            return
+        if state == 'active':
+            grace_until = expires_at + RENEWAL_GRACE_HOURS * 3600
+            db.set_membership_timer_state(user_id, 'grace', grace_until)
+            membership_timers.schedule(key, grace_until)
+            return
+        # 宽限期结束仍持有角色：支付系统已续费（未移除角色），新一期从上一期到期时开始
+        inviter_id = db.get_referrer_id_for_member(user_id)
+        if not inviter_id or inviter_id == user_id:
+            track_membership(db, user_id, role, snapshot, start=expires_at)
+            return
+        await pay_renewal(guild, db, member, role, inviter_id, snapshot, period_start=expires_at)
+
+
+membership_timers = scheduler.TimerScheduler(handle_membership_timer, name='membership')
+
+
+def load_membership_timers(guild: discord.Guild):
+    with Database(guild.id) as db:
+        pending = db.get_pending_membership_timers()
+    for user_id, due_at in pending:
+        membership_timers.schedule((guild.id, user_id), due_at)
+    if pending:
+        logging.info(f"Loaded {len(pending)} membership timers for guild {guild.id}.")
+
+
 @bot.event
+@metrics.timed_handler()
 async def on_member_update(before: discord.Member, after: discord.Member):
     """当成员角色发生变化时，如果新增了允许的角色，则为其邀请者发放佣金（防重复）。"""
+    # 整个事件固定使用同一版等级配置（热更新时正在处理的事件不受影响）
+    snapshot = levels.current()
     try:
         # 计算升级前后的最高付费层级（支持多级升级：普通->月->年->合伙）
         before_roles = list(getattr(before, 'roles', []) or [])
         after_roles = list(getattr(after, 'roles', []) or [])
-        before_highest = get_highest_paid_role(before_roles)
-        after_highest = get_highest_paid_role(after_roles)
+        if {r.id for r in before_roles} != {r.id for r in after_roles}:
+            # 角色变化：本人面板中的角色/佣金比例与邀请者“查看记录”中的用户组都会改变；邀请者的新佣金也由此覆盖
+            invalidate_member_panels(after.guild.id, after.id)
+        before_highest = get_highest_paid_role(before_roles, snapshot)
+        after_highest = get_highest_paid_role(after_roles, snapshot)
         # 若升级后无付费角色或层级未上升，则不发放
         if not after_highest:
             return
-        if role_tier(after_highest) <= role_tier(before_highest):
+        if role_tier(after_highest, snapshot) <= role_tier(before_highest, snapshot):
             return
         # 以升级后的最高层级作为本次计佣的目标角色
         new_role = after_highest
-        new_price = price_for_role(new_role) if new_role else 0.0
-        prev_price = price_for_role(before_highest) if before_highest else 0.0
+        new_price = price_for_role(new_role, snapshot) if new_role else 0.0
+        prev_price = price_for_role(before_highest, snapshot) if before_highest else 0.0
         incremental_price = max(new_price - prev_price, 0.0)
         if incremental_price <= 0:
             return
-        with Database() as db:
+        with Database(after.guild.id) as db:
             # 找邀请者
             # 先清理受邀者自身可能存在的自拉自历史
             db.purge_self_invites_for_user(after.id)
@@ -941,54 +2108,66 @@ async def on_member_update(before: discord.Member, after: discord.Member):
             # 自拉自不计佣
             if inviter_id == after.id:
                 return
-            # 防重复：同一成员在同一层级不重复发放（允许更高层级再次发放）
+            # 防重复：同一成员在同一层级不重复发放（允许更高层级再次发放）；上一期已到期后重新获得角色按续费计佣
             if db.has_reward_for_member_role(after.id, new_role.id):
+                if is_renewal(db, after.id, new_role, snapshot):
+                    await pay_renewal(after.guild, db, after, new_role, inviter_id, snapshot)
                 return
+            # 开始跟踪新角色的有效期
+            try:
+                track_membership(db, after.id, new_role, snapshot)
+            except Exception as exc:
+                logging.error(f"Failed to track membership period for {after.id}: {exc}")
 
             # 获取邀请者的佣金比例
-            inviter_member = after.guild.get_member(inviter_id)
-            percent = commission_percent_for_inviter(inviter_member) if inviter_member else (BASIC_INVITE_COMMISSION if ALLOW_BASIC_INVITER else 0)
+            percent = commission_percent_for_inviter(after.guild.get_member(inviter_id), snapshot)
 
             # 新身份的价格（基于角色名称关键字）
             if not percent or not incremental_price:
                 return
 
             commission_amount = round(incremental_price * (percent / 100.0), 2)
-            # 入账 + 记录事件（invite_code 无法可靠获取，填 None；时间取当前北京时间），记录升级到的角色ID
-            db.adjust_reward_balance(inviter_id, commission_amount)
+            # 入账 + 记录事件（invite_code 无法可靠获取，填 None；时间取当前北京时间），记录升级到的角色ID；
+            # 被标记待审核且启用暂扣的邀请者只记流水，不入余额
+            held = db.is_commission_held(inviter_id)
+            if not held:
+                db.adjust_reward_balance(inviter_id, commission_amount)
             now_text = format_dt_local(datetime.now(ZoneInfo("UTC")))
             try:
-                db.add_referral_event(inviter_id, None, after.id, now_text, commission_amount, role_id=new_role.id)
+                db.add_referral_event(inviter_id, None, after.id, now_text, commission_amount, role_id=new_role.id,
+                                      config_version=snapshot.version, held=held)
             except Exception as exc:
                 logging.error(f"Failed to add referral event on role upgrade: {exc}")
+            panels.invalidate(after.guild.id, inviter_id)
             # 同步受邀者当前角色到 users.role_id，便于记录与展示
             try:
                 db.update_user_role(after.id, new_role.id)
             except Exception as exc:
                 logging.error(f"Failed to update user role in DB: {exc}")
-            logging.info(f"Awarded commission {commission_amount} to inviter {inviter_id} for member {after.id} role upgrade {new_role.id}.")
-
-            # 发送佣金奖励通知到指定频道
+            logging.info(f"Awarded commission {commission_amount} to inviter {inviter_id} for member {after.id} role upgrade {new_role.id} (levels {snapshot.version})"
+                         + (", held pending review." if held else "."))
+            # 多级上线分成（第 2 级起，按闭包表一次取出所有上线）
+            awards = []
             try:
-                notify_channel = await get_channel_by_id(after.guild, COMMISSION_NOTIFICATION_CHANNEL_ID)
-                if notify_channel:
-                    inviter_mention = f"<@{inviter_id}>"
-                    invited_mention = after.mention
-                    old_name = (before_highest.name if before_highest else "普通")
-                    new_name = new_role.name if new_role else "普通会员"
-                    embed = discord.Embed(title="💰 佣金奖励", color=discord.Color.gold())
-                    embed.description = f"恭喜 {inviter_mention} 获得了 {commission_amount} USDT 的佣金!"
-                    embed.add_field(name="👤 被邀请者", value=invited_mention, inline=False)
-                    embed.add_field(name="🔄 角色变更", value=f"{old_name} → {new_name}", inline=False)
-                    embed.add_field(name="💵 佣金金额", value=f"{commission_amount} USDT", inline=False)
-                    embed.add_field(name="获得时间", value=now_text, inline=False)
-                    await notify_channel.send(embed=embed)
+                awards = upline_awards(after.guild, db, after.id, incremental_price, snapshot)
+                db.add_upline_commissions(after.id, now_text, new_role.id, snapshot.version, awards)
+                panels.invalidate(after.guild.id, *(uid for uid, _, _ in awards))
+                if awards:
+                    logging.info(f"Awarded upline commissions for member {after.id} role upgrade {new_role.id}: "
+                                 + ", ".join(f"{uid}@L{depth}={amount}" for uid, depth, amount in awards))
             except Exception as exc:
-                logging.error(f"Failed to send commission notification: {exc}")
+                awards = []
+                logging.error(f"Failed to award upline commissions: {exc}")
+
+            # 发送佣金奖励通知到指定频道
+            old_name = (before_highest.name if before_highest else "普通")
+            await send_commission_notice(after.guild, inviter_id, after, "💰 佣金奖励", f"{old_name} → {new_role.name}",
+                                         commission_amount, now_text, awards)
     except Exception as exc:
         logging.error(f"on_member_update failed: {exc}")
 
 # 运行 Bot
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    # 日志已由 config.py 配置，不让 discord.py 再挂同步的控制台处理器
+    bot.run(DISCORD_TOKEN, log_handler=None)
 
@@ -0,0 +1,152 @@
+"""网关事件录制（CAPTURE_FILE 非空时启用），供 replay.py 回放。
+
+录制成员加入/更新/退出、邀请创建/删除与按钮交互，以及两类重建现场所需的快照：服务器预热时的角色、频道、邀请与
+邀请者（guild），和每次刷新邀请缓存后变化的邀请使用次数（invite_uses，回放时据此判断加入者使用了哪条邀请）。
+每行一个紧凑 JSON 对象，字段：t=时间戳，e=事件类型，g=服务器ID；由后台线程追加写入，不阻塞事件循环。
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+import discord
+
+from config import CAPTURE_FILE
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_thread = None
+# 每个服务器上次录制的邀请使用次数，只录制变化的部分
+_last_uses: dict[int, dict[str, int]] = {}
+
+
+def _writer():
+    with open(CAPTURE_FILE, 'a', encoding='utf-8') as f:
+        while True:
+            line = _queue.get()
+            if line is None:
+                break
+            f.write(line)
+            f.write('\n')
+            # 尽量批量写入：队列已空时再刷盘
+            if _queue.empty():
+                f.flush()
+
+
+def _stop():
+    if _thread is not None:
+        _queue.put(None)
+        _thread.join(timeout=5)
+
+
+def record(event: str, guild_id: int, **fields):
+    if not CAPTURE_FILE:
+        return
+    payload = {'t': round(time.time(), 3), 'e': event, 'g': guild_id, **fields}
+    _queue.put(json.dumps(payload, ensure_ascii=False, separators=(',', ':')))
+
+
+def member_snapshot(member) -> list:
+    """[id, name, 角色ID列表, joined_at 时间戳]"""
+    joined_at = getattr(member, 'joined_at', None)
+    return [
+        member.id,
+        str(member),
+        [role.id for role in getattr(member, 'roles', []) if role.id != member.guild.id],
+        round(joined_at.timestamp(), 3) if joined_at else None,
+    ]
+
+
+def record_guild(guild, invites):
+    """服务器快照：角色、频道、邀请（含使用次数）及邀请者。"""
+    if not CAPTURE_FILE:
+        return
+    inviters = {}
+    for invite in invites:
+        member = guild.get_member(invite.inviter.id) if invite.inviter else None
+        if member is not None:
+            inviters[member.id] = member_snapshot(member)
+    record(
+        'guild', guild.id,
+        name=guild.name,
+        roles=[[role.id, role.name] for role in getattr(guild, 'roles', [])],
+        channels=[channel.id for channel in getattr(guild, 'channels', [])],
+        invites=[
+            [invite.code, invite.inviter.id if invite.inviter else None,
+             invite.channel.id if invite.channel else None, invite.uses]
+            for invite in invites
+        ],
+        inviters=list(inviters.values()),
+    )
+    _last_uses[guild.id] = {invite.code: invite.uses for invite in invites}
+
+
+def record_invite_uses(guild_id: int, invites):
+    if not CAPTURE_FILE or guild_id not in _last_uses:
+        # 尚未录制服务器快照（预热中），由随后的 guild 记录覆盖
+        return
+    current = {invite.code: invite.uses for invite in invites}
+    previous = _last_uses.get(guild_id, {})
+    changed = {code: uses for code, uses in current.items() if previous.get(code) != uses}
+    removed = [code for code in previous if code not in current]
+    _last_uses[guild_id] = current
+    if changed or removed:
+        record('invite_uses', guild_id, uses=changed, removed=removed)
+
+
+async def _on_member_join(member):
+    record('member_join', member.guild.id, m=member_snapshot(member))
+
+
+async def _on_member_update(before, after):
+    before_roles = [role.id for role in before.roles]
+    after_roles = [role.id for role in after.roles]
+    if before_roles != after_roles:
+        record('member_update', after.guild.id, m=member_snapshot(after), before=before_roles)
+
+
+async def _on_member_remove(member):
+    record('member_remove', member.guild.id, m=member_snapshot(member))
+
+
+async def _on_invite_create(invite):
+    if invite.guild is None:
+        return
+    record('invite_create', invite.guild.id, code=invite.code,
+           inviter=invite.inviter.id if invite.inviter else None,
+           channel=invite.channel.id if invite.channel else None)
+
+
+async def _on_invite_delete(invite):
+    if invite.guild is None:
+        return
+    record('invite_delete', invite.guild.id, code=invite.code)
+
+
+async def _on_interaction(interaction):
+    if interaction.type != discord.InteractionType.component or interaction.guild is None:
+        return
+    record('interaction', interaction.guild.id, m=member_snapshot(interaction.user),
+           channel=interaction.channel.id if interaction.channel else None,
+           custom_id=(interaction.data or {}).get('custom_id'))
+
+
+def install(bot):
+    """注册录制监听器（与 bot.py 中的 @bot.event 处理函数并行触发）并启动写入线程。"""
+    global _thread
+    if not CAPTURE_FILE or _thread is not None:
+        return
+    _thread = threading.Thread(target=_writer, name='event-capture', daemon=True)
+    _thread.start()
+    atexit.register(_stop)
+    for name, listener in (
+        ('on_member_join', _on_member_join),
+        ('on_member_update', _on_member_update),
+        ('on_member_remove', _on_member_remove),
+        ('on_invite_create', _on_invite_create),
+        ('on_invite_delete', _on_invite_delete),
+        ('on_interaction', _on_interaction),
+    ):
+        bot.add_listener(listener, name)
+    logging.info(f"Capturing gateway events to {CAPTURE_FILE}.")
@@ -0,0 +1,65 @@
+"""组件交互路由：按 custom_id 把按钮点击分发给注册的处理函数，并按 (服务器, 用户, 操作) 做单飞与冷却。
+
+- 单飞：同一用户的同一操作正在执行时，再次点击不会重复查询数据库或调用 Discord（如重复创建邀请链接），
+  而是等待同一次执行的结果，再用各自的交互回复
+- 冷却：一次执行成功完成后 COMPONENT_COOLDOWN_SECONDS 秒内的再次点击直接拒绝并提示稍后再试；执行失败不计冷却
+处理函数只生成回复内容（每条消息为 followup.send 的参数字典），不直接发送：ephemeral 回复只能发给各自的交互。
+执行以独立任务运行，首个点击的处理被取消时，等待同一结果的其他点击不受影响。
+"""
+import asyncio
+import time
+
+from config import COMPONENT_COOLDOWN_SECONDS
+import metrics
+
+
+class ComponentRouter:
+    def __init__(self, cooldown: float = COMPONENT_COOLDOWN_SECONDS):
+        self.cooldown = cooldown
+        self._handlers = {}
+        self._inflight: dict[tuple[int, int, str], asyncio.Future] = {}
+        self._completed: dict[tuple[int, int, str], float] = {}
+        self._next_prune = 0.0
+
+    def register(self, custom_id: str):
+        """装饰器：注册 custom_id 的处理函数 async def handler(interaction) -> list[dict]。"""
+        def decorator(func):
+            self._handlers[custom_id] = func
+            return func
+        return decorator
+
+    def __contains__(self, custom_id) -> bool:
+        return custom_id in self._handlers
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def dispatch(self, interaction, custom_id: str) -> tuple[str, list[dict]]:
+        """执行（或合并、拒绝）一次点击，返回 (结果, 待发送的消息列表)；结果为 executed / coalesced / rejected。"""
+        key = (interaction.guild_id, interaction.user.id, custom_id)
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.inc('component_clicks_total', action=custom_id, result='coalesced')
+            return 'coalesced', await asyncio.shield(task)
+        now = time.monotonic()
+        completed = self._completed.get(key)
+        if completed is not None and now - completed < self.cooldown:
+            metrics.inc('component_clicks_total', action=custom_id, result='rejected')
+            remaining = max(1, round(self.cooldown - (now - completed)))
+            return 'rejected', [{'content': f"操作过于频繁，请 {remaining} 秒后再试。"}]
+        task = asyncio.ensure_future(self._handlers[custom_id](interaction))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        metrics.inc('component_clicks_total', action=custom_id, result='executed')
+        return 'executed', await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        now = time.monotonic()
+        if not task.cancelled() and task.exception() is None:
+            self._completed[key] = now
+        if now >= self._next_prune:
+            horizon = now - self.cooldown
+            for stale in [k for k, at in self._completed.items() if at <= horizon]:
+                del self._completed[stale]
+            self._next_prune = now + max(self.cooldown, 60.0)
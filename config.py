@@ -1,8 +1,11 @@
 import os
+import atexit
 import logging
 import json
+import queue
+import random
 from dotenv import load_dotenv
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from typing import List, Dict, Any
 
 # 加载 .env 文件中的变量（务必在读取任何环境变量之前调用）
@@ -12,6 +15,17 @@ load_dotenv()
 ALLOW_BASIC_INVITER = os.getenv('ALLOW_BASIC_INVITER', 'true').lower() in ('1', 'true', 'yes')
 BASIC_INVITE_COMMISSION = float(os.getenv('BASIC_INVITE_COMMISSION', '0'))
 
+# 多级上线分成：逗号分隔的百分比，依次对应第 2、3…级上线（直接邀请者为第 1 级，比例仍按等级配置）
+# 例如 "5,2" 表示邀请者的邀请者得差价的 5%，再上一级得 2%；留空则只给直接邀请者计佣
+UPLINE_COMMISSION_PERCENTS: list[float] = [
+    float(x) for x in os.getenv('UPLINE_COMMISSION_PERCENTS', '').split(',') if x.strip()
+]
+# 上线获得分成所需的最低付费层级（0 表示不限，普通会员也可获得）
+UPLINE_MIN_TIER = int(os.getenv('UPLINE_MIN_TIER', '0'))
+
+# 续费检测：会员到期后仍保留角色超过该宽限时长（小时）视为已续费并发放续费佣金；到期前角色被移除则视为过期
+RENEWAL_GRACE_HOURS = float(os.getenv('RENEWAL_GRACE_HOURS', '48'))
+
 # 获取 Discord Token 和数据库路径
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DATABASE_PATH = os.getenv('DATABASE_PATH')
@@ -30,12 +44,14 @@ PARTNER_FEE_PRICE = float(os.getenv('PARTNER_FEE_PRICE', '0'))  # 合伙人价
 
 # 等级配置数据结构
 class LevelConfig:
-    def __init__(self, name: str, tier: int, role_ids: List[int], commission: int, price: float):
+    def __init__(self, name: str, tier: int, role_ids: List[int], commission: int, price: float, period_days: int = 0):
         self.name = name
         self.tier = tier
         self.role_ids = role_ids
         self.commission = commission
         self.price = price
+        # 会员有效期（天），0 表示永久（不跟踪到期与续费）
+        self.period_days = period_days
 
 # 解析等级配置
 def parse_levels_config(config_str: str) -> List[LevelConfig]:
@@ -60,7 +76,8 @@ def parse_levels_config(config_str: str) -> List[LevelConfig]:
                 tier=int(level_data['tier']),
                 role_ids=role_ids,
                 commission=int(level_data['commission']),
-                price=float(level_data['price'])
+                price=float(level_data['price']),
+                period_days=int(level_data.get('period_days', 0) or 0)
             )
             levels.append(level)
 
@@ -130,6 +147,10 @@ ALL_PAID_ROLE_ID_SET: set[int] = set()
 for level in LEVELS_CONFIG:
     ALL_PAID_ROLE_ID_SET.update(level.role_ids)
 
+# 可热更新的等级配置文件（JSON，格式同 LEVELS_CONFIG）；设置后以文件为准，修改后按间隔自动加载
+LEVELS_CONFIG_FILE = os.getenv('LEVELS_CONFIG_FILE', '').strip()
+LEVELS_RELOAD_INTERVAL = float(os.getenv('LEVELS_RELOAD_INTERVAL', '10'))
+
 # 读取 ALLOWED_CHANNEL_ID，确保它不是 None
 ALLOWED_CHANNEL_IDS = os.getenv('ALLOWED_CHANNEL_ID')
 
@@ -170,6 +191,93 @@ else:
     COMMISSION_NOTIFICATION_CHANNEL_ID = NOTIFICATION_CHANNEL_ID
     logging.info(f"COMMISSION_NOTIFICATION_CHANNEL_ID not set, using NOTIFICATION_CHANNEL_ID: {COMMISSION_NOTIFICATION_CHANNEL_ID}")
 
+# 多服务器部署：所有业务数据按 guild_id 分区。旧版（无 guild_id）数据迁移时归入 DEFAULT_GUILD_ID，
+# 未设置（0）且 Bot 只在一个服务器时，启动后自动归属到该服务器
+DEFAULT_GUILD_ID = int(os.getenv('DEFAULT_GUILD_ID', '0'))
+
+# 分片：是否以 AutoShardedBot 运行，以及可选的固定分片数（留空由 Discord 推荐）
+USE_AUTO_SHARDING = os.getenv('USE_AUTO_SHARDING', 'false').lower() in ('1', 'true', 'yes')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+# 多进程分片（由 launcher.py 设置）：本进程负责的分片ID列表
+SHARD_IDS = [int(x.strip()) for x in os.getenv('SHARD_IDS', '').split(',') if x.strip()]
+
+# 单写入者数据库进程地址（host:port 或 Unix socket 路径）。设置后本进程只读打开数据库，写操作转交写入进程
+DB_WRITER_ADDRESS = os.getenv('DB_WRITER_ADDRESS', '').strip() or None
+DB_WRITER_AUTHKEY = os.getenv('DB_WRITER_AUTHKEY', 'commission-bot')
+
+# 冷数据归档：早于保留期的已结算佣金流水移入归档库，热库只保留按邀请者/月份汇总的行（见 archive.py）
+# 保留天数为 0 时不自动归档，仍可通过 /archive_events 或 python archive.py 手动执行
+ARCHIVE_DATABASE_PATH = os.getenv('ARCHIVE_DATABASE_PATH', '').strip() or (
+    os.path.splitext(DATABASE_PATH)[0] + '_archive.db' if DATABASE_PATH else 'archive.db'
+)
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', '0'))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))
+ARCHIVE_BATCH_SIZE = max(100, int(os.getenv('ARCHIVE_BATCH_SIZE', '5000')))
+
+# 在线备份（见 backup.py）：间隔为 0 时不自动备份，仍可通过 /backup_status 或 python backup.py 手动执行
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '0'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+# 每步复制的页数与步间暂停（毫秒），控制备份对磁盘与写入的影响
+BACKUP_PAGES_PER_STEP = max(1, int(os.getenv('BACKUP_PAGES_PER_STEP', '256')))
+BACKUP_STEP_SLEEP_MS = float(os.getenv('BACKUP_STEP_SLEEP_MS', '5'))
+
+# 余额对账（见 ledger.py）：按高水位增量核对 users.reward_balance = 累计佣金 - 累计结算；间隔为 0 时不自动执行
+BALANCE_RECONCILE_INTERVAL_MINUTES = float(os.getenv('BALANCE_RECONCILE_INTERVAL_MINUTES', '0'))
+# 余额与应有余额相差超过该值（USDT）视为偏差
+BALANCE_DRIFT_TOLERANCE = float(os.getenv('BALANCE_DRIFT_TOLERANCE', '0.01'))
+
+# 刷邀请检测（见 fraud.py）：按邀请者统计滑动窗口内的加入速率与新账号占比，以及单个邀请码的短时突增
+FRAUD_DETECTION = os.getenv('FRAUD_DETECTION', 'true').lower() in ('1', 'true', 'yes')
+FRAUD_WINDOW_MINUTES = max(1.0, float(os.getenv('FRAUD_WINDOW_MINUTES', '60')))
+# 窗口内同一邀请者带来的加入人数上限
+FRAUD_MAX_JOINS_PER_WINDOW = max(1, int(os.getenv('FRAUD_MAX_JOINS_PER_WINDOW', '20')))
+# 账号注册不足该天数视为新账号；窗口内至少 FRAUD_MIN_JOINS 人且新账号占比达到该比例时标记
+FRAUD_NEW_ACCOUNT_DAYS = float(os.getenv('FRAUD_NEW_ACCOUNT_DAYS', '7'))
+FRAUD_NEW_ACCOUNT_RATIO = float(os.getenv('FRAUD_NEW_ACCOUNT_RATIO', '0.6'))
+FRAUD_MIN_JOINS = max(1, int(os.getenv('FRAUD_MIN_JOINS', '5')))
+# 单个邀请码在 FRAUD_BURST_SECONDS 秒内被使用达到 FRAUD_BURST_JOINS 次时标记
+FRAUD_BURST_SECONDS = max(1.0, float(os.getenv('FRAUD_BURST_SECONDS', '120')))
+FRAUD_BURST_JOINS = max(2, int(os.getenv('FRAUD_BURST_JOINS', '5')))
+# 被标记的邀请者此后产生的佣金是否暂扣（记流水但不入余额、不可结算），直至管理员审核
+FRAUD_HOLD_COMMISSIONS = os.getenv('FRAUD_HOLD_COMMISSIONS', 'false').lower() in ('1', 'true', 'yes')
+
+# 面板按钮：同一用户的同一操作完成后，该秒数内的再次点击直接拒绝（执行中的重复点击合并为一次，见 components.py）
+COMPONENT_COOLDOWN_SECONDS = max(0.0, float(os.getenv('COMPONENT_COOLDOWN_SECONDS', '2')))
+# “查看佣金”“查看记录”的渲染缓存（见 panel_cache.py）：最多缓存的用户数（0 为不缓存）与兜底过期时间（秒，0 为不过期）
+PANEL_CACHE_SIZE = max(0, int(os.getenv('PANEL_CACHE_SIZE', '5000')))
+PANEL_CACHE_TTL_SECONDS = max(0.0, float(os.getenv('PANEL_CACHE_TTL_SECONDS', '600')))
+# 重型管理员报表（排行榜、导出、方案模拟，见 reports.py）：同时运行的工作进程数、单个任务的时间预算（秒），
+# 以及进度消息的最小编辑间隔（秒）
+REPORT_MAX_WORKERS = max(1, int(os.getenv('REPORT_MAX_WORKERS', '2')))
+REPORT_TIME_BUDGET_SECONDS = max(1.0, float(os.getenv('REPORT_TIME_BUDGET_SECONDS', '300')))
+REPORT_PROGRESS_INTERVAL = max(0.0, float(os.getenv('REPORT_PROGRESS_INTERVAL', '1.5')))
+
+# 启动时是否对账离线期间漏发的升级佣金
+RECONCILE_ON_STARTUP = os.getenv('RECONCILE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
+# 启动/重连时按服务器并发执行预热任务的上限
+STARTUP_CONCURRENCY = max(1, int(os.getenv('STARTUP_CONCURRENCY', '5')))
+
+# Prometheus 指标端点（/metrics）；端口为 0 时不启动，仅可通过 /perfstats 查看
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0') or 0)
+
+# SQLite 慢查询追踪（默认关闭）：按语句形态统计耗时，超过 SQL_SLOW_MS 的语句连同查询计划写入 SQL_SLOW_LOG
+SQL_TRACE = os.getenv('SQL_TRACE', 'false').lower() in ('1', 'true', 'yes')
+SQL_SLOW_MS = float(os.getenv('SQL_SLOW_MS', '50'))
+SQL_SLOW_LOG = os.getenv('SQL_SLOW_LOG', 'logs/slow_queries.log')
+
+# 事件循环卡顿看门狗：调度延迟超过阈值时记录阻塞循环的调用栈
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', 'true').lower() in ('1', 'true', 'yes')
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '200'))
+
+# /profile 单次采集的最长秒数（限制 cProfile 的额外开销）
+PROFILE_MAX_SECONDS = max(1, int(os.getenv('PROFILE_MAX_SECONDS', '60')))
+
+# 网关事件录制文件（JSON Lines，追加写入）；留空不录制。录制结果可用 replay.py 回放
+CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')
+
 # 公告中使用的服务器名称
 GUILD_DISPLAY_NAME = os.getenv('GUILD_DISPLAY_NAME', '')
 
@@ -188,7 +296,61 @@ log_dir = os.path.dirname(LOG_FILE)
 if log_dir:
     os.makedirs(log_dir, exist_ok=True)
 
-# 构建日志器
+# 结构化输出与采样（可选）
+LOG_JSON = os.getenv('LOG_JSON', 'false').lower() in ('1', 'true', 'yes')
+# 按 logger 名称采样高频日志，如 "commission.events=0.1,commission.db=0.01"；WARNING 及以上始终保留
+LOG_SAMPLE_RATES: Dict[str, float] = {}
+for item in os.getenv('LOG_SAMPLE_RATES', '').split(','):
+    name, sep, rate = item.partition('=')
+    if sep and name.strip():
+        try:
+            LOG_SAMPLE_RATES[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logging.warning(f"Invalid LOG_SAMPLE_RATES entry: {item!r}")
+
+
+class JsonFormatter(logging.Formatter):
+    """每行一个 JSON 对象的结构化日志格式。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称（最长前缀匹配）随机采样，在入队前丢弃，避免高频日志占用事件循环。"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            match = ''
+            for prefix, value in self.rates.items():
+                if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > len(match):
+                    match, rate = prefix, value
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+# 构建日志器：根 logger 只挂一个 QueueHandler（入队即返回），文件/控制台写入由后台线程的 QueueListener 完成
 root_logger = logging.getLogger()
 root_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 
@@ -196,16 +358,32 @@ root_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 for h in list(root_logger.handlers):
     root_logger.removeHandler(h)
 
-fmt = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+fmt = JsonFormatter() if LOG_JSON else logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
+# 报表工作进程（及其 forkserver，见 reports.py）不打开日志文件：日志记录经结果队列交给 Bot 进程写出，
+# 避免多个进程写同一个滚动日志
+REPORT_WORKER = os.getenv('COMMISSION_REPORT_WORKER') == '1'
+
+if not REPORT_WORKER:
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(fmt)
+    output_handlers: List[logging.Handler] = [file_handler]
+
+    if LOG_TO_CONSOLE:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(fmt)
+        output_handlers.append(console_handler)
 
-file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
-file_handler.setFormatter(fmt)
-root_logger.addHandler(file_handler)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    if LOG_SAMPLE_RATES:
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    root_logger.addHandler(queue_handler)
 
-if LOG_TO_CONSOLE:
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(fmt)
-    root_logger.addHandler(console_handler)
+    log_listener = QueueListener(log_queue, *output_handlers, respect_handler_level=True)
+    log_listener.start()
+    # 进程退出时停止监听线程并刷出队列中剩余的日志
+    atexit.register(log_listener.stop)
 
 # 降低第三方库日志噪声
 logging.getLogger('discord').setLevel(logging.INFO)
@@ -1,35 +1,125 @@
 import sqlite3
 import logging
+import metrics
+import sqltrace
 from config import (
     DATABASE_PATH,
+    DEFAULT_GUILD_ID,
+    DB_WRITER_ADDRESS,
+    DB_WRITER_AUTHKEY,
 )
 
+# 每次读写都会触发的高频日志使用独立 logger，便于按 LOG_SAMPLE_RATES 采样
+db_log = logging.getLogger('commission.db')
 
+# 已完成建表/迁移的数据库文件（每个进程只需执行一次）
+_initialized_paths: set[str] = set()
+
+# 按服务器分区的数据表：(表名, 旧表是否以 user_id 为主键需要重建)
+_PARTITIONED_TABLES = (
+    ('users', True),
+    ('invites', True),
+    ('invites_v2', False),
+    ('referral_events', False),
+    ('payouts', False),
+    ('referral_closure', False),
+    ('membership_timers', False),
+    ('referral_rollups', False),
+    ('archived_member_roles', False),
+    ('flagged_inviters', False),
+)
+
+# 由 users.referred_by 回填邀请关系闭包表（深度上限防止异常数据中的环）；
+# 参数 (guild_id, guild_id)，guild_id 为 None 时处理所有服务器
+CLOSURE_BACKFILL_SQL = '''
+    WITH RECURSIVE chain (guild_id, ancestor_id, descendant_id, depth) AS (
+        SELECT guild_id, referred_by, user_id, 1 FROM users
+        WHERE (? IS NULL OR guild_id = ?) AND referred_by IS NOT NULL AND referred_by != user_id
+        UNION ALL
+        SELECT c.guild_id, u.referred_by, c.descendant_id, c.depth + 1 FROM chain c
+        JOIN users u ON u.guild_id = c.guild_id AND u.user_id = c.ancestor_id
+        WHERE u.referred_by IS NOT NULL AND u.referred_by != u.user_id
+          AND u.referred_by != c.descendant_id AND c.depth < 64
+    )
+    INSERT OR IGNORE INTO referral_closure (guild_id, ancestor_id, descendant_id, depth)
+    SELECT guild_id, ancestor_id, descendant_id, MIN(depth) FROM chain
+    GROUP BY guild_id, ancestor_id, descendant_id'''
+
+# 多进程模式下与写入进程的连接（每个进程一个）
+_writer_client = None
+
+
+def run_write_ops(cursor, ops):
+    """在给定游标上顺序执行一组写操作，返回每条操作的 (lastrowid, rowcount)。
+    ops 中每项为 (sql, params) 或 (sql, seq_of_params, True)（executemany）。
+    """
+    results = []
+    for op in ops:
+        if len(op) == 3 and op[2]:
+            cursor.executemany(op[0], op[1])
+        else:
+            cursor.execute(op[0], op[1])
+        results.append((cursor.lastrowid, cursor.rowcount))
+    return results
+
+
+def get_writer_client():
+    global _writer_client
+    if _writer_client is None:
+        from db_writer import WriterClient
+        _writer_client = WriterClient(DB_WRITER_ADDRESS, DB_WRITER_AUTHKEY)
+    return _writer_client
+
+
+@metrics.timed_methods('db')
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_PATH)
+    def __init__(self, guild_id: int | None = None, read_only: bool = False):
+        # 所有业务数据按 guild_id 分区；未指定时使用 DEFAULT_GUILD_ID（单服部署/私信场景）
+        self.guild_id = guild_id if guild_id is not None else DEFAULT_GUILD_ID
+        # 配置了写入进程时：本进程只开只读 WAL 连接，所有写操作批量发给写入进程（建表/迁移也由其负责）
+        self.remote_writes = bool(DB_WRITER_ADDRESS)
+        # read_only：只读查询（如报表工作进程），不建表/迁移，写操作会失败
+        self.read_only = read_only
+        if self.remote_writes or read_only:
+            self.conn = sqltrace.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)
+        else:
+            self.conn = sqltrace.connect(DATABASE_PATH)
         self.cursor = self.conn.cursor()
-        logging.debug(f"Opening database connection to {DATABASE_PATH}.")
+        db_log.debug("Opening database connection to %s.", DATABASE_PATH)
+        if not self.remote_writes and not read_only and DATABASE_PATH not in _initialized_paths:
+            self._init_schema()
+            _initialized_paths.add(DATABASE_PATH)
+
+    def _init_schema(self):
+        # WAL：读事务（在线备份、报表、对账比对）不阻塞写入；该设置持久保存在库文件中
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        # 迁移：旧版无 guild_id 的表先补分区列（users/invites 需要重建主键）
+        self._migrate_guild_partitioning()
 
         # 创建 users 表
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
             username TEXT,
             referred_by INTEGER,
             join_date TEXT,
             reward_balance REAL,
-            role_id INTEGER
+            role_id INTEGER,
+            PRIMARY KEY (guild_id, user_id)
         )''')
 
         # 创建 invites 表，存储每个用户的邀请链接
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS invites (
-            user_id INTEGER PRIMARY KEY,
-            invite_link TEXT
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            invite_link TEXT,
+            PRIMARY KEY (guild_id, user_id)
         )''')
 
         # 新增 v2 多邀请链接表（非覆盖旧表，便于逐步迁移）
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS invites_v2 (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
             user_id INTEGER,
             code TEXT,
             url TEXT,
@@ -44,6 +134,7 @@ class Database:
         # 邀请事件流水（用于累计、结算、统计）
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS referral_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
             inviter_id INTEGER,
             invite_code TEXT,
             new_member_id INTEGER,
@@ -56,12 +147,27 @@ class Database:
         # 结算记录表
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS payouts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
             user_id INTEGER,
             amount REAL,
             created_at TEXT,
             note TEXT
         )''')
 
+        # 斜杠指令同步状态：按作用域（global / guild:<id>）记录上次同步的指令树指纹
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS command_sync_state (
+            scope TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            synced_at TEXT
+        )''')
+
+        # 旧数据归属：记录默认分区的旧数据已整体归属到哪个服务器（只执行一次）
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS legacy_adoptions (
+            legacy_guild_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            adopted_at TEXT
+        )''')
+
         self.conn.commit()
         logging.info("Database initialized with users and invites tables.")
 
@@ -75,6 +181,186 @@ class Database:
         except Exception:
             pass
 
+        # 迁移：为 referral_events 增加 config_version 字段，记录计佣时使用的等级配置版本
+        self.cursor.execute("PRAGMA table_info(referral_events)")
+        if 'config_version' not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('''ALTER TABLE referral_events ADD COLUMN config_version TEXT''')
+
+        # 迁移：为 referral_events 增加 level 字段（1 = 直接邀请者，2+ = 上线分成）
+        self.cursor.execute("PRAGMA table_info(referral_events)")
+        if 'level' not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('''ALTER TABLE referral_events ADD COLUMN level INTEGER DEFAULT 1''')
+
+        # 迁移：为 referral_events 增加 renewal 字段（1 = 续费佣金）
+        self.cursor.execute("PRAGMA table_info(referral_events)")
+        if 'renewal' not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('''ALTER TABLE referral_events ADD COLUMN renewal INTEGER DEFAULT 0''')
+
+        # 迁移：为 referral_events 增加 split_from 字段（局部结算拆出的余数事件记录最初被拆分的事件 id）
+        self.cursor.execute("PRAGMA table_info(referral_events)")
+        if 'split_from' not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('''ALTER TABLE referral_events ADD COLUMN split_from INTEGER''')
+
+        # 迁移：为 referral_events 增加 held 字段（0 = 正常入账，1 = 邀请者被标记而暂扣，2 = 暂扣后被没收）
+        self.cursor.execute("PRAGMA table_info(referral_events)")
+        if 'held' not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('''ALTER TABLE referral_events ADD COLUMN held INTEGER DEFAULT 0''')
+
+        # 疑似刷邀请的邀请者（fraud.py 检测）：status 为 flagged（待审核）/ cleared（已释放）；
+        # hold = 1 时该邀请者新产生的佣金暂扣（记流水但不入余额），审核后释放或没收
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS flagged_inviters (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reasons TEXT,
+            details TEXT,
+            flagged_at TEXT,
+            hold INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'flagged',
+            reviewed_at TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        )''')
+
+        # 会员有效期定时器：每个成员一行，记录当前付费角色的本期开始/到期时间（时间戳）与下次检查时间；
+        # state: active（有效期内）/ grace（已到期，等待宽限期结束判断是否续费）/ lapsed（已过期）
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS membership_timers (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            role_id INTEGER,
+            period_start REAL,
+            expires_at REAL,
+            due_at REAL,
+            state TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        )''')
+
+        # 归档汇总（archive.py）：已移入归档库的已结算流水按 (邀请者, 月份, 层级, 是否续费) 汇总，
+        # 统计查询合并汇总行与热表，保证总额不变
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS referral_rollups (
+            guild_id INTEGER NOT NULL,
+            inviter_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            renewal INTEGER NOT NULL,
+            event_count INTEGER NOT NULL,
+            commission_total REAL NOT NULL,
+            PRIMARY KEY (guild_id, inviter_id, month, level, renewal)
+        )''')
+        # 已归档流水中出现过的 (成员, 角色)：升级/续费防重复判断仍需看到这些记录
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS archived_member_roles (
+            guild_id INTEGER NOT NULL,
+            new_member_id INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, new_member_id, role_id)
+        )''')
+
+        # 余额对账（ledger.py）：按流水与结算记录累计的每个用户应有余额，以及各服务器已累计到的流水/结算 id（高水位）
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS balance_ledger (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            credits REAL NOT NULL DEFAULT 0,
+            payouts REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS balance_reconcile_state (
+            guild_id INTEGER PRIMARY KEY,
+            events_hwm INTEGER NOT NULL,
+            payouts_hwm INTEGER NOT NULL,
+            reconciled_at TEXT
+        )''')
+
+        # 邀请关系闭包表：每对 (上线, 下线) 一行，depth=1 为直接邀请；
+        # 查询任意深度的上线/下线都只需一次索引查询，无需逐级递归 users.referred_by
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'referral_closure'")
+        closure_exists = self.cursor.fetchone() is not None
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS referral_closure (
+            guild_id INTEGER NOT NULL,
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, ancestor_id, descendant_id)
+        )''')
+        if not closure_exists:
+            # 首次建表：由现有 users.referred_by 一次性回填
+            self.cursor.execute(CLOSURE_BACKFILL_SQL, (None, None))
+            if self.cursor.rowcount:
+                logging.info(f"Backfilled {self.cursor.rowcount} referral closure rows from users.referred_by.")
+
+        # 等级配置版本：版本号 -> 当时的等级 JSON，便于追溯历史佣金的计算依据
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS level_config_versions (
+            version TEXT PRIMARY KEY,
+            levels_json TEXT,
+            source TEXT,
+            loaded_at TEXT
+        )''')
+        self.conn.commit()
+
+        # 复合索引：均以 guild_id 开头，保证每个分区内的查询走索引
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_users_guild_referred ON users (guild_id, referred_by)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_users_guild_balance ON users (guild_id, reward_balance)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_invites_v2_guild_user ON invites_v2 (guild_id, user_id)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_invites_v2_guild_code ON invites_v2 (guild_id, code)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_events_guild_inviter ON referral_events (guild_id, inviter_id, settled)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_events_guild_member ON referral_events (guild_id, new_member_id, role_id)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_payouts_guild_user ON payouts (guild_id, user_id)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_closure_guild_descendant ON referral_closure (guild_id, descendant_id, depth)''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS idx_timers_guild_state ON membership_timers (guild_id, state, due_at)''')
+        self.conn.commit()
+
+    def _migrate_guild_partitioning(self):
+        """旧库迁移：为各业务表补 guild_id，历史数据归入 DEFAULT_GUILD_ID。"""
+        for table, rebuild in _PARTITIONED_TABLES:
+            self.cursor.execute(f"PRAGMA table_info({table})")
+            cols = [row[1] for row in self.cursor.fetchall()]
+            if not cols or 'guild_id' in cols:
+                continue
+            if rebuild:
+                # 主键由 user_id 变为 (guild_id, user_id)，SQLite 只能重建表
+                legacy = f"{table}_legacy"
+                self.cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+                col_list = ", ".join(cols)
+                if table == 'users':
+                    self.cursor.execute('''CREATE TABLE users (
+                        guild_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        username TEXT,
+                        referred_by INTEGER,
+                        join_date TEXT,
+                        reward_balance REAL,
+                        role_id INTEGER,
+                        PRIMARY KEY (guild_id, user_id)
+                    )''')
+                else:
+                    self.cursor.execute('''CREATE TABLE invites (
+                        guild_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        invite_link TEXT,
+                        PRIMARY KEY (guild_id, user_id)
+                    )''')
+                self.cursor.execute(
+                    f"INSERT INTO {table} (guild_id, {col_list}) SELECT ?, {col_list} FROM {legacy}",
+                    (DEFAULT_GUILD_ID,)
+                )
+                self.cursor.execute(f"DROP TABLE {legacy}")
+            else:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN guild_id INTEGER")
+                self.cursor.execute(f"UPDATE {table} SET guild_id = ? WHERE guild_id IS NULL", (DEFAULT_GUILD_ID,))
+            logging.info(f"Migrated table {table} to guild partitioning (legacy rows -> guild {DEFAULT_GUILD_ID}).")
+        self.conn.commit()
+
+    def _write(self, ops):
+        """以单事务执行一组写操作；多进程模式下转交写入进程。"""
+        if self.read_only:
+            raise sqlite3.OperationalError("attempt to write through a read-only Database")
+        if self.remote_writes:
+            return get_writer_client().submit(ops)
+        try:
+            results = run_write_ops(self.cursor, ops)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return results
+
     def __enter__(self):
         return self
 
@@ -82,70 +368,154 @@ class Database:
         self.close()
 
     def add_or_update_user(self, user_id, username=None, referred_by=None, join_date=None, role_id=None):
-        """创建或更新用户信息，保留已存在的余额数据。"""
-        existing_user = self.get_user_by_id(user_id)
-
-        if existing_user:
-            current_username = username or existing_user[1]
-            current_referred_by = referred_by if referred_by is not None else existing_user[2]
-            current_join_date = join_date or existing_user[3]
-            current_role_id = role_id if role_id is not None else existing_user[5]
+        """创建或更新用户信息，保留已存在的余额数据（未提供的字段保留原值）。
+        提供 referred_by 时在同一事务中维护邀请关系闭包表；成员经其他人的邀请重新加入时以新邀请者为准，
+        用户及其下线与原上线的闭包关系先被移除再按新邀请者重建。
+        """
+        ops = []
+        if referred_by is not None and referred_by != user_id:
+            ops.append(self._closure_unlink_op(user_id, referred_by))
+        ops.append((
+            '''INSERT INTO users (guild_id, user_id, username, referred_by, join_date, reward_balance, role_id)
+               VALUES (?, ?, ?, ?, ?, 0, ?)
+               ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                   username = COALESCE(NULLIF(excluded.username, ''), users.username),
+                   referred_by = COALESCE(excluded.referred_by, users.referred_by),
+                   join_date = COALESCE(NULLIF(excluded.join_date, ''), users.join_date),
+                   role_id = COALESCE(excluded.role_id, users.role_id)''',
+            (self.guild_id, user_id, username, referred_by, join_date, role_id)
+        ))
+        if referred_by is not None and referred_by != user_id:
+            ops.extend(self._closure_link_ops(user_id))
+        self._write(ops)
+        db_log.info("User %s stored in the database.", username or user_id)
 
-            self.cursor.execute(
-                '''UPDATE users SET username = ?, referred_by = ?, join_date = ?, role_id = ? WHERE user_id = ?''',
-                (current_username, current_referred_by, current_join_date, current_role_id, user_id)
-            )
-            logging.info(f"User {current_username} updated in the database.")
-        else:
-            self.cursor.execute(
-                '''INSERT INTO users (user_id, username, referred_by, join_date, reward_balance, role_id)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (user_id, username, referred_by, join_date, 0, role_id)
-            )
-            logging.info(f"User {username} added to the database.")
+    def _closure_unlink_op(self, user_id, referred_by):
+        """邀请者变更时（已存库的 referred_by 与新值不同）：删除用户及其下线与用户原有上线之间的闭包行。"""
+        return (
+            '''DELETE FROM referral_closure
+               WHERE guild_id = ?
+                 AND ancestor_id IN (SELECT ancestor_id FROM referral_closure WHERE guild_id = ? AND descendant_id = ?)
+                 AND (descendant_id = ? OR descendant_id IN (
+                     SELECT descendant_id FROM referral_closure WHERE guild_id = ? AND ancestor_id = ?))
+                 AND EXISTS (SELECT 1 FROM users WHERE guild_id = ? AND user_id = ?
+                             AND referred_by IS NOT NULL AND referred_by != ?)''',
+            (self.guild_id, self.guild_id, user_id, user_id, self.guild_id, user_id, self.guild_id, user_id, referred_by)
+        )
 
-        self.conn.commit()
-        logging.debug(f"Database commit completed for user {user_id}.")
+    def _closure_link_ops(self, user_id):
+        """按 users.referred_by（已存库的值）把用户及其已有下线挂到邀请者的所有上线之下。"""
+        return [
+            # 用户自身：直接邀请者（depth=1）及其所有上线（depth+1）
+            (
+                '''INSERT OR IGNORE INTO referral_closure (guild_id, ancestor_id, descendant_id, depth)
+                   SELECT guild_id, referred_by, user_id, 1 FROM users
+                   WHERE guild_id = ? AND user_id = ? AND referred_by IS NOT NULL AND referred_by != user_id
+                   UNION ALL
+                   SELECT c.guild_id, c.ancestor_id, u.user_id, c.depth + 1 FROM users u
+                   JOIN referral_closure c ON c.guild_id = u.guild_id AND c.descendant_id = u.referred_by
+                   WHERE u.guild_id = ? AND u.user_id = ? AND u.referred_by != u.user_id AND c.ancestor_id != u.user_id''',
+                (self.guild_id, user_id, self.guild_id, user_id)
+            ),
+            # 用户在此之前已有的下线：同样挂到用户的所有上线之下
+            (
+                '''INSERT OR IGNORE INTO referral_closure (guild_id, ancestor_id, descendant_id, depth)
+                   SELECT up.guild_id, up.ancestor_id, down.descendant_id, up.depth + down.depth
+                   FROM referral_closure up
+                   JOIN referral_closure down ON down.guild_id = up.guild_id AND down.ancestor_id = up.descendant_id
+                   WHERE up.guild_id = ? AND up.descendant_id = ? AND up.ancestor_id != down.descendant_id''',
+                (self.guild_id, user_id)
+            ),
+        ]
 
     def get_user_by_id(self, user_id):
-        logging.debug(f"Fetching user {user_id} from database.")
-        self.cursor.execute('''SELECT * FROM users WHERE user_id = ?''', (user_id,))
+        """返回 (user_id, username, referred_by, join_date, reward_balance, role_id)。"""
+        db_log.debug("Fetching user %s from database.", user_id)
+        self.cursor.execute(
+            '''SELECT user_id, username, referred_by, join_date, reward_balance, role_id FROM users
+               WHERE guild_id = ? AND user_id = ?''',
+            (self.guild_id, user_id)
+        )
         return self.cursor.fetchone()
 
     def get_invite_link_by_user(self, user_id):
-        logging.debug(f"Fetching invite link for user {user_id}.")
-        self.cursor.execute('''SELECT invite_link FROM invites WHERE user_id = ?''', (user_id,))
+        db_log.debug("Fetching invite link for user %s.", user_id)
+        self.cursor.execute('''SELECT invite_link FROM invites WHERE guild_id = ? AND user_id = ?''', (self.guild_id, user_id))
         return self.cursor.fetchone()
 
     def set_invite_link(self, user_id, invite_link):
-        self.cursor.execute('''INSERT OR REPLACE INTO invites (user_id, invite_link) VALUES (?, ?)''', (user_id, invite_link))
-        self.conn.commit()
-        logging.info(f"Invite link for user {user_id} updated/created.")
-        logging.debug(f"Invite link stored: {invite_link}.")
+        self._write([(
+            '''INSERT OR REPLACE INTO invites (guild_id, user_id, invite_link) VALUES (?, ?, ?)''',
+            (self.guild_id, user_id, invite_link)
+        )])
+        db_log.info("Invite link for user %s updated/created.", user_id)
+        db_log.debug("Invite link stored: %s.", invite_link)
 
     # v2 邀请
     def add_invite_v2(self, user_id: int, code: str, url: str, channel_id: int, created_at: str,
                        expires_at: str = None, max_uses: int = 0, uses: int = 0, active: int = 1):
-        self.cursor.execute(
-            '''INSERT INTO invites_v2 (user_id, code, url, channel_id, created_at, expires_at, max_uses, uses, active)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (user_id, code, url, channel_id, created_at, expires_at, max_uses, uses, active)
-        )
-        self.conn.commit()
+        self._write([(
+            '''INSERT INTO invites_v2 (guild_id, user_id, code, url, channel_id, created_at, expires_at, max_uses, uses, active)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (self.guild_id, user_id, code, url, channel_id, created_at, expires_at, max_uses, uses, active)
+        )])
 
     def get_latest_invite_v2(self, user_id: int):
-        self.cursor.execute('''SELECT code, url, channel_id, created_at FROM invites_v2 WHERE user_id = ? ORDER BY id DESC LIMIT 1''', (user_id,))
+        self.cursor.execute(
+            '''SELECT code, url, channel_id, created_at FROM invites_v2 WHERE guild_id = ? AND user_id = ? ORDER BY id DESC LIMIT 1''',
+            (self.guild_id, user_id)
+        )
         return self.cursor.fetchone()
 
     def get_inviter_by_code(self, code: str):
         """根据邀请码 code 反查邀请者 user_id（按最新一条记录）。"""
-        self.cursor.execute('''SELECT user_id FROM invites_v2 WHERE code = ? ORDER BY id DESC LIMIT 1''', (code,))
+        self.cursor.execute(
+            '''SELECT user_id FROM invites_v2 WHERE guild_id = ? AND code = ? ORDER BY id DESC LIMIT 1''',
+            (self.guild_id, code)
+        )
         row = self.cursor.fetchone()
         return row[0] if row else None
 
+    def deactivate_invites_v2(self, user_id: int):
+        """将用户名下的 v2 邀请标记为失效（成员退群时调用）。"""
+        self._write([('''UPDATE invites_v2 SET active = 0 WHERE guild_id = ? AND user_id = ?''', (self.guild_id, user_id))])
+
     def get_referred_users(self, referrer_id):
         """获取指定用户邀请的所有成员"""
-        self.cursor.execute('''SELECT user_id, username, join_date, role_id FROM users WHERE referred_by = ? ORDER BY join_date DESC''', (referrer_id,))
+        self.cursor.execute(
+            '''SELECT user_id, username, join_date, role_id FROM users WHERE guild_id = ? AND referred_by = ? ORDER BY join_date DESC''',
+            (self.guild_id, referrer_id)
+        )
+        return self.cursor.fetchall()
+
+    def get_upline(self, user_id: int, max_depth: int):
+        """用户的上线 (ancestor_id, depth)，depth 从 1（直接邀请者）到 max_depth，按由近及远排序。"""
+        self.cursor.execute(
+            '''SELECT ancestor_id, depth FROM referral_closure
+               WHERE guild_id = ? AND descendant_id = ? AND depth <= ? ORDER BY depth''',
+            (self.guild_id, user_id, max_depth)
+        )
+        return self.cursor.fetchall()
+
+    def get_downline_counts(self, user_id: int):
+        """用户各级下线人数 (depth, count)。"""
+        self.cursor.execute(
+            '''SELECT depth, COUNT(*) FROM referral_closure WHERE guild_id = ? AND ancestor_id = ? GROUP BY depth ORDER BY depth''',
+            (self.guild_id, user_id)
+        )
+        return self.cursor.fetchall()
+
+    def get_commission_by_level(self, user_id: int):
+        """用户按邀请层级汇总的佣金 (level, total)。"""
+        self.cursor.execute(
+            '''SELECT level, SUM(amount) FROM (
+                   SELECT COALESCE(level, 1) AS level, commission_amount AS amount FROM referral_events
+                   WHERE guild_id = ? AND inviter_id = ? AND COALESCE(held, 0) = 0
+                   UNION ALL
+                   SELECT level, commission_total FROM referral_rollups WHERE guild_id = ? AND inviter_id = ?
+               ) GROUP BY level ORDER BY level''',
+            (self.guild_id, user_id, self.guild_id, user_id)
+        )
         return self.cursor.fetchall()
 
     def get_referrer_info(self, user_id):
@@ -159,100 +529,318 @@ class Database:
 
     def get_referrer_id_for_member(self, user_id: int):
         """获取成员的邀请者 user_id（来自 users.referred_by）。"""
-        self.cursor.execute('''SELECT referred_by FROM users WHERE user_id = ?''', (user_id,))
+        self.cursor.execute('''SELECT referred_by FROM users WHERE guild_id = ? AND user_id = ?''', (self.guild_id, user_id))
         row = self.cursor.fetchone()
         return row[0] if row else None
 
     def update_user_role(self, user_id: int, role_id: int | None):
         """更新用户在 users 表中的当前角色ID。"""
-        self.cursor.execute('''UPDATE users SET role_id = ? WHERE user_id = ?''', (role_id, user_id))
-        self.conn.commit()
+        self._write([('''UPDATE users SET role_id = ? WHERE guild_id = ? AND user_id = ?''', (role_id, self.guild_id, user_id))])
 
     def adjust_reward_balance(self, user_id: int, delta: float) -> float:
-        """调整用户余额（可正可负），返回调整后的余额。若用户不存在则创建用户后再调整。"""
-        user = self.get_user_by_id(user_id)
-        if not user:
+        """调整用户余额（可正可负，最低为 0），返回调整后的余额。若用户不存在则创建用户后再调整。"""
+        self._write([
             # 初始化用户以确保有余额字段
-            self.add_or_update_user(user_id=user_id, username=None)
-            user = self.get_user_by_id(user_id)
-        current_balance = float(user[4] or 0)
-        new_balance = current_balance + float(delta)
-        if new_balance < 0:
-            new_balance = 0.0
-        self.cursor.execute('''UPDATE users SET reward_balance = ? WHERE user_id = ?''', (new_balance, user_id))
-        self.conn.commit()
-        logging.info(f"User {user_id} balance adjusted by {delta}, new balance={new_balance}.")
+            ('''INSERT OR IGNORE INTO users (guild_id, user_id, reward_balance) VALUES (?, ?, 0)''', (self.guild_id, user_id)),
+            (
+                '''UPDATE users SET reward_balance = MAX(COALESCE(reward_balance, 0) + ?, 0) WHERE guild_id = ? AND user_id = ?''',
+                (float(delta), self.guild_id, user_id)
+            ),
+        ])
+        user = self.get_user_by_id(user_id)
+        new_balance = float(user[4] or 0) if user else 0.0
+        db_log.info("User %s balance adjusted by %s, new balance=%s.", user_id, delta, new_balance)
         return new_balance
 
     def get_positive_balance_users(self):
         """获取所有余额>0的用户，返回 (user_id, username, reward_balance, role_id) 列表，按余额降序。"""
         self.cursor.execute(
-            '''SELECT user_id, username, reward_balance, role_id FROM users WHERE reward_balance > 0 ORDER BY reward_balance DESC'''
+            '''SELECT user_id, username, reward_balance, role_id FROM users
+               WHERE guild_id = ? AND reward_balance > 0 ORDER BY reward_balance DESC''',
+            (self.guild_id,)
         )
         return self.cursor.fetchall()
 
     # 邀请事件与结算
-    def add_referral_event(self, inviter_id: int, invite_code: str, new_member_id: int, joined_at: str, commission_amount: float, role_id: int | None = None):
-        self.cursor.execute(
-            '''INSERT INTO referral_events (inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, role_id)
-               VALUES (?, ?, ?, ?, ?, 0, ?)''',
-            (inviter_id, invite_code, new_member_id, joined_at, commission_amount, role_id)
-        )
-        self.conn.commit()
+    def add_referral_event(self, inviter_id: int, invite_code: str, new_member_id: int, joined_at: str, commission_amount: float,
+                           role_id: int | None = None, config_version: str | None = None, held: bool = False):
+        """记录佣金流水（held=True 时为暂扣流水，调用方不应入账余额）。"""
+        self._write([(
+            '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, role_id, config_version, held)
+               VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?)''',
+            (self.guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, role_id, config_version, int(held))
+        )])
+
+    def add_upline_commissions(self, new_member_id: int, joined_at: str, role_id: int, config_version: str | None, awards):
+        """单事务为上线入账分成。awards: (ancestor_id, depth, commission_amount) 列表。"""
+        if not awards:
+            return
+        held = self.get_held_inviter_ids([ancestor_id for ancestor_id, _, _ in awards])
+        self._write([
+            (
+                '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, role_id, config_version, level, held)
+                   VALUES (?, ?, NULL, ?, ?, ?, 0, ?, ?, ?, ?)''',
+                [(self.guild_id, ancestor_id, new_member_id, joined_at, amount, role_id, config_version, depth, int(ancestor_id in held))
+                 for ancestor_id, depth, amount in awards], True
+            ),
+            (
+                '''INSERT OR IGNORE INTO users (guild_id, user_id, reward_balance) VALUES (?, ?, 0)''',
+                [(self.guild_id, ancestor_id) for ancestor_id, _, _ in awards], True
+            ),
+            (
+                '''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) + ? WHERE guild_id = ? AND user_id = ?''',
+                [(amount, self.guild_id, ancestor_id) for ancestor_id, _, amount in awards if ancestor_id not in held], True
+            ),
+        ])
 
     def has_reward_for_member(self, new_member_id: int) -> bool:
         """检查该新成员是否已经产生过佣金事件，防止重复计佣。"""
-        self.cursor.execute('''SELECT 1 FROM referral_events WHERE new_member_id = ? LIMIT 1''', (new_member_id,))
+        self.cursor.execute(
+            '''SELECT 1 FROM referral_events WHERE guild_id = ? AND new_member_id = ?
+               UNION ALL
+               SELECT 1 FROM archived_member_roles WHERE guild_id = ? AND new_member_id = ? LIMIT 1''',
+            (self.guild_id, new_member_id, self.guild_id, new_member_id)
+        )
         return self.cursor.fetchone() is not None
 
     def has_reward_for_member_role(self, new_member_id: int, role_id: int) -> bool:
         """检查该新成员在指定角色层级是否已经产生过佣金事件（用于分段升级计佣防重复）。"""
         try:
             self.cursor.execute(
-                '''SELECT 1 FROM referral_events WHERE new_member_id = ? AND role_id = ? LIMIT 1''',
-                (new_member_id, role_id)
+                '''SELECT 1 FROM referral_events WHERE guild_id = ? AND new_member_id = ? AND role_id = ?
+                   UNION ALL
+                   SELECT 1 FROM archived_member_roles WHERE guild_id = ? AND new_member_id = ? AND role_id = ? LIMIT 1''',
+                (self.guild_id, new_member_id, role_id, self.guild_id, new_member_id, role_id)
             )
             return self.cursor.fetchone() is not None
         except Exception:
             return False
 
+    # 会员有效期与续费
+    def get_membership_timer(self, user_id: int):
+        """返回 (role_id, period_start, expires_at, due_at, state)。"""
+        self.cursor.execute(
+            '''SELECT role_id, period_start, expires_at, due_at, state FROM membership_timers WHERE guild_id = ? AND user_id = ?''',
+            (self.guild_id, user_id)
+        )
+        return self.cursor.fetchone()
+
+    def get_pending_membership_timers(self):
+        """所有待触发的定时器 (user_id, due_at)，启动时载入调度器。"""
+        self.cursor.execute(
+            '''SELECT user_id, due_at FROM membership_timers WHERE guild_id = ? AND state IN ('active', 'grace')''',
+            (self.guild_id,)
+        )
+        return self.cursor.fetchall()
+
+    def set_membership_timer(self, user_id: int, role_id: int, period_start: float, expires_at: float,
+                             due_at: float | None = None, state: str = 'active'):
+        self._write([(
+            '''INSERT OR REPLACE INTO membership_timers (guild_id, user_id, role_id, period_start, expires_at, due_at, state)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (self.guild_id, user_id, role_id, period_start, expires_at, expires_at if due_at is None else due_at, state)
+        )])
+
+    def set_membership_timer_state(self, user_id: int, state: str, due_at: float):
+        self._write([(
+            '''UPDATE membership_timers SET state = ?, due_at = ? WHERE guild_id = ? AND user_id = ?''',
+            (state, due_at, self.guild_id, user_id)
+        )])
+
+    def delete_membership_timer(self, user_id: int):
+        self._write([('''DELETE FROM membership_timers WHERE guild_id = ? AND user_id = ?''', (self.guild_id, user_id))])
+
+    def apply_renewal(self, new_member_id: int, role_id: int, joined_at: str, config_version: str | None, payouts,
+                      period_start: float, expires_at: float):
+        """单事务：记录续费佣金（payouts: (inviter_id, level, amount) 列表）、入账，并开始新的有效期。"""
+        ops = []
+        if payouts:
+            held = self.get_held_inviter_ids([inviter_id for inviter_id, _, _ in payouts])
+            ops.extend([
+                (
+                    '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, role_id, config_version, level, renewal, held)
+                       VALUES (?, ?, NULL, ?, ?, ?, 0, ?, ?, ?, 1, ?)''',
+                    [(self.guild_id, inviter_id, new_member_id, joined_at, amount, role_id, config_version, level, int(inviter_id in held))
+                     for inviter_id, level, amount in payouts], True
+                ),
+                (
+                    '''INSERT OR IGNORE INTO users (guild_id, user_id, reward_balance) VALUES (?, ?, 0)''',
+                    [(self.guild_id, inviter_id) for inviter_id, _, _ in payouts], True
+                ),
+                (
+                    '''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) + ? WHERE guild_id = ? AND user_id = ?''',
+                    [(amount, self.guild_id, inviter_id) for inviter_id, _, amount in payouts if inviter_id not in held], True
+                ),
+            ])
+        ops.append((
+            '''INSERT OR REPLACE INTO membership_timers (guild_id, user_id, role_id, period_start, expires_at, due_at, state)
+               VALUES (?, ?, ?, ?, ?, ?, 'active')''',
+            (self.guild_id, new_member_id, role_id, period_start, expires_at, expires_at)
+        ))
+        self._write(ops)
+
+    # 离线期间漏发升级佣金的对账
+    def get_referred_members(self):
+        """获取所有有邀请者的成员（排除自拉自），返回 (user_id, referred_by, role_id) 列表。"""
+        self.cursor.execute(
+            '''SELECT user_id, referred_by, role_id FROM users
+               WHERE guild_id = ? AND referred_by IS NOT NULL AND referred_by != user_id''',
+            (self.guild_id,)
+        )
+        return self.cursor.fetchall()
+
+    def get_rewarded_member_roles(self):
+        """一次性取出所有已产生佣金事件的 (new_member_id, role_id) 组合，供批量对账使用。"""
+        self.cursor.execute(
+            '''SELECT new_member_id, role_id FROM referral_events WHERE guild_id = ? AND role_id IS NOT NULL
+               UNION
+               SELECT new_member_id, role_id FROM archived_member_roles WHERE guild_id = ?''',
+            (self.guild_id, self.guild_id)
+        )
+        return self.cursor.fetchall()
+
+    def apply_missed_upgrades(self, entries, role_updates):
+        """单事务批量补发漏发的升级佣金。
+        - entries: (inviter_id, new_member_id, joined_at, commission_amount, role_id, config_version, level) 列表
+        - role_updates: (role_id, user_id) 列表，同步 users.role_id
+        """
+        # 按邀请者汇总后入账（邀请者可能尚未入库，先补建用户行）；被暂扣的邀请者只记流水
+        held = self.get_held_inviter_ids([entry[0] for entry in entries])
+        totals: dict[int, float] = {}
+        for inviter_id, _, _, amount, _, _, _ in entries:
+            if inviter_id not in held:
+                totals[inviter_id] = totals.get(inviter_id, 0.0) + float(amount)
+        self._write([
+            (
+                '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, role_id, config_version, level, held)
+                   VALUES (?, ?, NULL, ?, ?, ?, 0, ?, ?, ?, ?)''',
+                [(self.guild_id, *entry, int(entry[0] in held)) for entry in entries], True
+            ),
+            (
+                '''INSERT OR IGNORE INTO users (guild_id, user_id, reward_balance) VALUES (?, ?, 0)''',
+                [(self.guild_id, inviter_id) for inviter_id in {entry[0] for entry in entries}], True
+            ),
+            (
+                '''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) + ? WHERE guild_id = ? AND user_id = ?''',
+                [(amount, self.guild_id, inviter_id) for inviter_id, amount in totals.items()], True
+            ),
+            (
+                '''UPDATE users SET role_id = ? WHERE guild_id = ? AND user_id = ?''',
+                [(role_id, self.guild_id, user_id) for role_id, user_id in role_updates], True
+            ),
+        ])
+        logging.info(f"Applied {len(entries)} missed upgrade commissions and {len(role_updates)} role syncs.")
+
+    # 佣金方案模拟（simulator.py）
+    def get_upgrade_history(self):
+        """按发生顺序取出热表中所有直接邀请者的升级计佣事件（不含续费） (id, inviter_id, new_member_id, role_id)。"""
+        self.cursor.execute(
+            '''SELECT id, inviter_id, new_member_id, role_id FROM referral_events
+               WHERE guild_id = ? AND role_id IS NOT NULL AND COALESCE(level, 1) = 1 AND COALESCE(renewal, 0) = 0 ORDER BY id ASC''',
+            (self.guild_id,)
+        )
+        return self.cursor.fetchall()
+
+    def get_user_role_ids(self):
+        """所有记录了当前角色的用户 (user_id, role_id)。"""
+        self.cursor.execute(
+            '''SELECT user_id, role_id FROM users WHERE guild_id = ? AND role_id IS NOT NULL''',
+            (self.guild_id,)
+        )
+        return self.cursor.fetchall()
+
+    def get_commission_totals(self):
+        """按邀请者汇总实际产生的直接邀请升级佣金 (inviter_id, total)，不含上线分成与续费。"""
+        self.cursor.execute(
+            '''SELECT inviter_id, SUM(amount) FROM (
+                   SELECT inviter_id, commission_amount AS amount FROM referral_events
+                   WHERE guild_id = ? AND COALESCE(level, 1) = 1 AND COALESCE(renewal, 0) = 0
+                   UNION ALL
+                   SELECT inviter_id, commission_total FROM referral_rollups WHERE guild_id = ? AND level = 1 AND renewal = 0
+               ) GROUP BY inviter_id''',
+            (self.guild_id, self.guild_id)
+        )
+        return self.cursor.fetchall()
+
     def get_commission_stats(self, user_id: int):
         # total
-        self.cursor.execute('''SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE inviter_id = ?''', (user_id,))
+        self.cursor.execute(
+            '''SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE guild_id = ? AND inviter_id = ? AND COALESCE(held, 0) = 0''',
+            (self.guild_id, user_id)
+        )
         total = float(self.cursor.fetchone()[0] or 0)
         # settled
-        self.cursor.execute('''SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE inviter_id = ? AND settled = 1''', (user_id,))
+        self.cursor.execute(
+            '''SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE guild_id = ? AND inviter_id = ? AND settled = 1''',
+            (self.guild_id, user_id)
+        )
         settled = float(self.cursor.fetchone()[0] or 0)
+        # 已归档的流水均为已结算
+        archived = self.get_archived_commission_total(user_id)
+        total += archived
+        settled += archived
         unsettled = total - settled
         return total, settled, unsettled
 
+    def get_commission_leaderboard(self):
+        """所有余额>0的用户及其佣金统计 (user_id, username, reward_balance, role_id, total, settled)，按余额降序。
+        口径同 get_commission_stats（含归档汇总、不含暂扣），一次聚合完成，不逐个用户查询。"""
+        self.cursor.execute(
+            '''SELECT u.user_id, u.username, u.reward_balance, u.role_id,
+                      COALESCE(e.total, 0) + COALESCE(r.total, 0), COALESCE(e.settled, 0) + COALESCE(r.total, 0)
+               FROM users u
+               LEFT JOIN (
+                   SELECT inviter_id,
+                          SUM(CASE WHEN COALESCE(held, 0) = 0 THEN commission_amount ELSE 0 END) AS total,
+                          SUM(CASE WHEN settled = 1 THEN commission_amount ELSE 0 END) AS settled
+                   FROM referral_events WHERE guild_id = ? GROUP BY inviter_id
+               ) e ON e.inviter_id = u.user_id
+               LEFT JOIN (
+                   SELECT inviter_id, SUM(commission_total) AS total FROM referral_rollups WHERE guild_id = ? GROUP BY inviter_id
+               ) r ON r.inviter_id = u.user_id
+               WHERE u.guild_id = ? AND u.reward_balance > 0
+               ORDER BY u.reward_balance DESC''',
+            (self.guild_id, self.guild_id, self.guild_id)
+        )
+        return self.cursor.fetchall()
+
+    def get_archived_commission_total(self, user_id: int) -> float:
+        self.cursor.execute(
+            '''SELECT COALESCE(SUM(commission_total), 0) FROM referral_rollups WHERE guild_id = ? AND inviter_id = ?''',
+            (self.guild_id, user_id)
+        )
+        return float(self.cursor.fetchone()[0] or 0)
+
     def get_recent_referral_events(self, inviter_id: int, limit: int = 10):
-        """获取最近的佣金产生事件（升组触发）。返回 new_member_id, joined_at, commission_amount, settled, role_id。"""
+        """获取最近的佣金产生事件（升组/续费触发）。返回 new_member_id, joined_at, commission_amount, settled, role_id, level, renewal。"""
         self.cursor.execute(
-            '''SELECT new_member_id, joined_at, commission_amount, settled, role_id FROM referral_events
-               WHERE inviter_id = ? ORDER BY id DESC LIMIT ?''',
-            (inviter_id, limit)
+            '''SELECT new_member_id, joined_at, commission_amount, settled, role_id, COALESCE(level, 1), COALESCE(renewal, 0) FROM referral_events
+               WHERE guild_id = ? AND inviter_id = ? ORDER BY id DESC LIMIT ?''',
+            (self.guild_id, inviter_id, limit)
         )
         return self.cursor.fetchall()
 
     def get_recent_payouts(self, user_id: int, limit: int = 10):
         """获取最近的结算记录。返回 amount, created_at, note。"""
         self.cursor.execute(
-            '''SELECT amount, created_at, note FROM payouts WHERE user_id = ? ORDER BY id DESC LIMIT ?''',
-            (user_id, limit)
+            '''SELECT amount, created_at, note FROM payouts WHERE guild_id = ? AND user_id = ? ORDER BY id DESC LIMIT ?''',
+            (self.guild_id, user_id, limit)
         )
         return self.cursor.fetchall()
 
     # 自拉自数据清理
     def purge_all_self_invites(self):
-        """全局清理自拉自：
+        """全局清理自拉自（跨所有服务器分区，自拉自判定只依赖行内字段）：
         - users 表：user_id = referred_by 的记录置空 referred_by
         - referral_events 表：删除 inviter_id = new_member_id 的事件
         """
         try:
-            self.cursor.execute('''UPDATE users SET referred_by = NULL WHERE user_id = referred_by''')
-            self.cursor.execute('''DELETE FROM referral_events WHERE inviter_id = new_member_id''')
-            self.conn.commit()
+            self._write([
+                ('''UPDATE users SET referred_by = NULL WHERE user_id = referred_by''', ()),
+                ('''DELETE FROM referral_events WHERE inviter_id = new_member_id''', ()),
+                # 确有历史流水被删除时（changes() 为上一条语句的影响行数），下次余额对账需全量重建
+                ('''DELETE FROM balance_reconcile_state WHERE changes() > 0''', ()),
+            ])
             logging.info("Purged global self-invite associations and events.")
         except Exception as exc:
             logging.error(f"Failed to purge global self-invites: {exc}")
@@ -260,10 +848,18 @@ class Database:
     def purge_self_invites_for_user(self, user_id: int):
         """按用户清理自拉自数据。"""
         try:
-            self.cursor.execute('''UPDATE users SET referred_by = NULL WHERE user_id = ? AND referred_by = ?''', (user_id, user_id))
-            self.cursor.execute('''DELETE FROM referral_events WHERE inviter_id = ? AND new_member_id = ?''', (user_id, user_id))
-            self.conn.commit()
-            logging.info(f"Purged self-invite data for user {user_id}.")
+            self._write([
+                (
+                    '''UPDATE users SET referred_by = NULL WHERE guild_id = ? AND user_id = ? AND referred_by = ?''',
+                    (self.guild_id, user_id, user_id)
+                ),
+                (
+                    '''DELETE FROM referral_events WHERE guild_id = ? AND inviter_id = ? AND new_member_id = ?''',
+                    (self.guild_id, user_id, user_id)
+                ),
+                ('''DELETE FROM balance_reconcile_state WHERE guild_id = ? AND changes() > 0''', (self.guild_id,)),
+            ])
+            db_log.info("Purged self-invite data for user %s.", user_id)
         except Exception as exc:
             logging.error(f"Failed to purge self-invites for user {user_id}: {exc}")
 
@@ -272,38 +868,195 @@ class Database:
         remaining = float(amount)
         settled_sum = 0.0
         # 找出未结算事件
-        self.cursor.execute('''SELECT id, commission_amount FROM referral_events WHERE inviter_id = ? AND settled = 0 ORDER BY id ASC''', (user_id,))
+        self.cursor.execute(
+            '''SELECT id, commission_amount FROM referral_events
+               WHERE guild_id = ? AND inviter_id = ? AND settled = 0 AND COALESCE(held, 0) = 0 ORDER BY id ASC''',
+            (self.guild_id, user_id)
+        )
         rows = self.cursor.fetchall()
+        ops = []
         for event_id, commission in rows:
             if remaining <= 0:
                 break
             take = min(commission, remaining)
             if take >= commission:
                 # 整条事件结算
-                self.cursor.execute('''UPDATE referral_events SET settled = 1 WHERE id = ?''', (event_id,))
+                ops.append(('''UPDATE referral_events SET settled = 1 WHERE id = ?''', (event_id,)))
             else:
                 # 局部结算：将原事件金额缩小为已结算部分并标记已结算，再插入一条未结算的余数事件
-                self.cursor.execute('''UPDATE referral_events SET commission_amount = ?, settled = 1 WHERE id = ?''', (take, event_id))
-                self.cursor.execute(
-                    '''INSERT INTO referral_events (inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled)
-                       SELECT inviter_id, invite_code, new_member_id, joined_at, ?, 0 FROM referral_events WHERE id = ?''',
+                ops.append(('''UPDATE referral_events SET commission_amount = ?, settled = 1 WHERE id = ?''', (take, event_id)))
+                ops.append((
+                    '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount, settled, config_version, level, renewal, split_from)
+                       SELECT guild_id, inviter_id, invite_code, new_member_id, joined_at, ?, 0, config_version, level, renewal, COALESCE(split_from, id) FROM referral_events WHERE id = ?''',
                     (commission - take, event_id)
-                )
+                ))
             remaining -= take
             settled_sum += take
         if settled_sum > 0:
             # 写 payouts
             import datetime
             now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.cursor.execute('''INSERT INTO payouts (user_id, amount, created_at, note) VALUES (?, ?, ?, ?)''', (user_id, settled_sum, now, 'manual settle'))
+            ops.append((
+                '''INSERT INTO payouts (guild_id, user_id, amount, created_at, note) VALUES (?, ?, ?, ?, ?)''',
+                (self.guild_id, user_id, settled_sum, now, 'manual settle')
+            ))
             # 扣减余额
-            self.cursor.execute('''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) - ? WHERE user_id = ?''', (settled_sum, user_id))
-            self.conn.commit()
+            ops.append((
+                '''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) - ? WHERE guild_id = ? AND user_id = ?''',
+                (settled_sum, self.guild_id, user_id)
+            ))
+            self._write(ops)
         return settled_sum
 
+    # 疑似刷邀请（fraud.py）
+    def flag_inviter(self, user_id: int, reasons: str, details: str, flagged_at: str, hold: bool = False) -> bool:
+        """标记疑似刷邀请的邀请者，返回是否为新标记（已处于待审核状态时不覆盖）。"""
+        results = self._write([(
+            '''INSERT INTO flagged_inviters (guild_id, user_id, reasons, details, flagged_at, hold, status)
+               VALUES (?, ?, ?, ?, ?, ?, 'flagged')
+               ON CONFLICT (guild_id, user_id) DO UPDATE SET reasons = excluded.reasons, details = excluded.details,
+                   flagged_at = excluded.flagged_at, hold = excluded.hold, status = 'flagged', reviewed_at = NULL
+               WHERE flagged_inviters.status != 'flagged' ''',
+            (self.guild_id, user_id, reasons, details, flagged_at, int(hold))
+        )])
+        return bool(results and results[0][1])
+
+    def get_held_inviter_ids(self, user_ids) -> set[int]:
+        """user_ids 中佣金当前被暂扣的邀请者。"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return set()
+        placeholders = ", ".join("?" * len(user_ids))
+        self.cursor.execute(
+            f'''SELECT user_id FROM flagged_inviters
+                WHERE guild_id = ? AND status = 'flagged' AND hold = 1 AND user_id IN ({placeholders})''',
+            (self.guild_id, *user_ids)
+        )
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def get_flag_status(self, user_id: int) -> str | None:
+        """标记状态：flagged（待审核）/ cleared（已释放），从未被标记时为 None。"""
+        self.cursor.execute(
+            '''SELECT status FROM flagged_inviters WHERE guild_id = ? AND user_id = ?''', (self.guild_id, user_id)
+        )
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def is_commission_held(self, user_id: int) -> bool:
+        return bool(self.get_held_inviter_ids([user_id]))
+
+    def get_flagged_inviters(self, limit: int = 25):
+        """待审核的邀请者 (user_id, username, reasons, details, flagged_at, hold, held_total)，按标记时间降序。"""
+        self.cursor.execute(
+            '''SELECT f.user_id, u.username, f.reasons, f.details, f.flagged_at, f.hold,
+                      (SELECT COALESCE(SUM(e.commission_amount), 0) FROM referral_events e
+                       WHERE e.guild_id = f.guild_id AND e.inviter_id = f.user_id AND e.held = 1)
+               FROM flagged_inviters f
+               LEFT JOIN users u ON u.guild_id = f.guild_id AND u.user_id = f.user_id
+               WHERE f.guild_id = ? AND f.status = 'flagged'
+               ORDER BY f.flagged_at DESC LIMIT ?''',
+            (self.guild_id, limit)
+        )
+        return self.cursor.fetchall()
+
+    def get_held_commission_total(self, user_id: int) -> float:
+        self.cursor.execute(
+            '''SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE guild_id = ? AND inviter_id = ? AND held = 1''',
+            (self.guild_id, user_id)
+        )
+        return float(self.cursor.fetchone()[0] or 0)
+
+    def release_flagged_inviter(self, user_id: int, reviewed_at: str) -> float:
+        """审核通过：暂扣的佣金转为正常流水并入账余额，解除标记，返回释放金额。"""
+        released = self.get_held_commission_total(user_id)
+        self._write([
+            ('''INSERT OR IGNORE INTO users (guild_id, user_id, reward_balance) VALUES (?, ?, 0)''', (self.guild_id, user_id)),
+            (
+                '''UPDATE users SET reward_balance = COALESCE(reward_balance, 0) + (
+                       SELECT COALESCE(SUM(commission_amount), 0) FROM referral_events WHERE guild_id = ? AND inviter_id = ? AND held = 1
+                   ) WHERE guild_id = ? AND user_id = ?''',
+                (self.guild_id, user_id, self.guild_id, user_id)
+            ),
+            ('''UPDATE referral_events SET held = 0 WHERE guild_id = ? AND inviter_id = ? AND held = 1''', (self.guild_id, user_id)),
+            # 已累计过的流水重新计入佣金：下次余额对账需全量重建
+            ('''DELETE FROM balance_reconcile_state WHERE guild_id = ? AND changes() > 0''', (self.guild_id,)),
+            (
+                '''UPDATE flagged_inviters SET status = 'cleared', hold = 0, reviewed_at = ? WHERE guild_id = ? AND user_id = ?''',
+                (reviewed_at, self.guild_id, user_id)
+            ),
+        ])
+        db_log.info("Released flagged inviter %s, %s held commission credited.", user_id, released)
+        return released
+
+    def forfeit_held_commissions(self, user_id: int, reviewed_at: str) -> float:
+        """审核确认刷邀请：没收当前暂扣的佣金（不入账、不可结算），邀请者保持标记，返回没收金额。"""
+        forfeited = self.get_held_commission_total(user_id)
+        self._write([
+            ('''UPDATE referral_events SET held = 2 WHERE guild_id = ? AND inviter_id = ? AND held = 1''', (self.guild_id, user_id)),
+            ('''UPDATE flagged_inviters SET reviewed_at = ? WHERE guild_id = ? AND user_id = ?''', (reviewed_at, self.guild_id, user_id)),
+        ])
+        db_log.info("Forfeited %s held commission of flagged inviter %s.", forfeited, user_id)
+        return forfeited
+
+    # 单服旧数据认领
+    def adopt_legacy_rows(self, legacy_guild_id: int):
+        """将归在 legacy_guild_id（迁移默认分区）下的旧数据整体归属到当前服务器；完成后记入 legacy_adoptions，只执行一次。"""
+        import datetime
+
+        if legacy_guild_id == self.guild_id:
+            return 0
+        self.cursor.execute('''SELECT guild_id FROM legacy_adoptions WHERE legacy_guild_id = ?''', (legacy_guild_id,))
+        if self.cursor.fetchone():
+            return 0
+        # users/invites 主键含 guild_id，若目标分区已有同一用户则保留目标分区数据
+        results = self._write([
+            (f"UPDATE OR IGNORE {table} SET guild_id = ? WHERE guild_id = ?", (self.guild_id, legacy_guild_id))
+            for table, _ in _PARTITIONED_TABLES
+        ] + [
+            # 流水换了分区：两个分区的余额对账都需全量重建
+            ('''DELETE FROM balance_reconcile_state WHERE guild_id IN (?, ?)''', (self.guild_id, legacy_guild_id)),
+            ('''INSERT OR IGNORE INTO legacy_adoptions (legacy_guild_id, guild_id, adopted_at) VALUES (?, ?, ?)''',
+             (legacy_guild_id, self.guild_id, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))),
+        ])
+        moved = sum(rowcount for _, rowcount in results[:len(_PARTITIONED_TABLES)])
+        if moved:
+            logging.info(f"Adopted {moved} legacy rows from guild {legacy_guild_id} into guild {self.guild_id}.")
+        # 与目标分区冲突而未移动的行仍留在默认分区，需人工核对
+        skipped = {}
+        for table, _ in _PARTITIONED_TABLES:
+            self.cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE guild_id = ?", (legacy_guild_id,))
+            count = self.cursor.fetchone()[0]
+            if count:
+                skipped[table] = count
+        if skipped:
+            details = ", ".join(f"{table}={count}" for table, count in skipped.items())
+            logging.error(f"Skipped {sum(skipped.values())} legacy rows in guild {legacy_guild_id} that conflict with "
+                          f"existing rows in guild {self.guild_id} ({details}); reconcile them manually.")
+        return moved
+
+    # 等级配置版本
+    def record_level_config(self, version: str, levels_json: str, source: str, loaded_at: str):
+        self._write([(
+            '''INSERT OR IGNORE INTO level_config_versions (version, levels_json, source, loaded_at) VALUES (?, ?, ?, ?)''',
+            (version, levels_json, source, loaded_at)
+        )])
+
+    # 斜杠指令同步指纹
+    def get_command_sync_fingerprint(self, scope: str):
+        self.cursor.execute('''SELECT fingerprint FROM command_sync_state WHERE scope = ?''', (scope,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def set_command_sync_fingerprint(self, scope: str, fingerprint: str, synced_at: str):
+        self._write([(
+            '''INSERT OR REPLACE INTO command_sync_state (scope, fingerprint, synced_at) VALUES (?, ?, ?)''',
+            (scope, fingerprint, synced_at)
+        )])
+
     def close(self):
         if getattr(self, "conn", None):
+            # 先关闭游标：结算最后一条语句的追踪统计（SQL_TRACE）
+            self.cursor.close()
             self.conn.close()
-            logging.debug("Database connection closed.")
+            db_log.debug("Database connection closed.")
             self.conn = None
-
@@ -0,0 +1,149 @@
+"""单写入者数据库进程。
+
+多进程分片模式下由 launcher.py 启动：本进程独占 SQLite 文件的写入，分片工作进程通过本地 IPC
+（multiprocessing.connection）提交批量写操作，读取则各自打开只读 WAL 连接，避免多进程写锁竞争。
+同一时间到达的多个请求合并为一个事务提交（组提交），单个请求失败只回滚其自身的 SAVEPOINT。
+"""
+import argparse
+import logging
+import queue
+import sqlite3
+import threading
+from multiprocessing.connection import Client, Listener
+
+from config import (
+    ARCHIVE_INTERVAL_HOURS,
+    ARCHIVE_RETENTION_DAYS,
+    DATABASE_PATH,
+    DB_WRITER_ADDRESS,
+    DB_WRITER_AUTHKEY,
+)
+from database import Database, run_write_ops
+import archive
+import sqltrace
+
+
+def parse_address(address: str):
+    """'host:port' 解析为 TCP 地址，其余视为 Unix socket 路径。"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+class WriterClient:
+    """工作进程侧的写入客户端：一个进程一条连接，线程安全。"""
+
+    def __init__(self, address: str, authkey: str):
+        self._conn = Client(parse_address(address), authkey=authkey.encode('utf-8'))
+        self._lock = threading.Lock()
+
+    def submit(self, ops):
+        with self._lock:
+            self._conn.send(ops)
+            reply = self._conn.recv()
+        if not reply['ok']:
+            raise sqlite3.DatabaseError(reply['error'])
+        return reply['results']
+
+
+class WriterServer:
+    def __init__(self, address: str, authkey: str, max_batch: int = 256):
+        if DB_WRITER_ADDRESS:
+            # 写入进程自身必须直连数据库，否则会把写操作转发给自己
+            raise RuntimeError("DB_WRITER_ADDRESS must not be set in the database writer process.")
+        self.address = parse_address(address)
+        self.authkey = authkey.encode('utf-8')
+        self.max_batch = max_batch
+        self.requests: queue.Queue = queue.Queue()
+        # 由写入进程负责建表/迁移，然后切换到 WAL 以便读进程并发读取
+        with Database():
+            pass
+        self.conn = sqltrace.connect(DATABASE_PATH, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.batches = 0
+        self.requests_served = 0
+
+    def serve_forever(self):
+        listener = Listener(self.address, authkey=self.authkey)
+        logging.info(f"Database writer listening on {self.address} for {DATABASE_PATH}.")
+        threading.Thread(target=self._write_loop, name='db-writer', daemon=True).start()
+        if ARCHIVE_RETENTION_DAYS > 0:
+            # 多进程模式下由写入进程负责定时归档（归档使用独立连接，与组提交交替持有写锁）
+            threading.Thread(target=archive.run_periodically, args=(ARCHIVE_RETENTION_DAYS, ARCHIVE_INTERVAL_HOURS),
+                             name='db-archiver', daemon=True).start()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as exc:
+                logging.error(f"Database writer failed to accept connection: {exc}")
+                continue
+            threading.Thread(target=self._client_loop, args=(conn,), daemon=True).start()
+
+    def _client_loop(self, conn):
+        while True:
+            try:
+                ops = conn.recv()
+            except (EOFError, OSError):
+                break
+            done = threading.Event()
+            slot = {}
+            self.requests.put((ops, slot, done))
+            done.wait()
+            try:
+                conn.send(slot['reply'])
+            except (EOFError, OSError):
+                break
+        conn.close()
+
+    def _write_loop(self):
+        cursor = self.conn.cursor()
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+            except Exception as exc:
+                for _, slot, done in batch:
+                    slot['reply'] = {'ok': False, 'error': f"begin failed: {exc}"}
+                    done.set()
+                logging.error(f"Database writer could not start a transaction: {exc}")
+                continue
+            for ops, slot, _ in batch:
+                cursor.execute('SAVEPOINT request')
+                try:
+                    slot['reply'] = {'ok': True, 'results': run_write_ops(cursor, ops)}
+                    cursor.execute('RELEASE request')
+                except Exception as exc:
+                    cursor.execute('ROLLBACK TO request')
+                    cursor.execute('RELEASE request')
+                    slot['reply'] = {'ok': False, 'error': str(exc)}
+                    logging.error(f"Database writer request failed: {exc}")
+            try:
+                cursor.execute('COMMIT')
+            except Exception as exc:
+                cursor.execute('ROLLBACK')
+                for _, slot, _ in batch:
+                    slot['reply'] = {'ok': False, 'error': f"commit failed: {exc}"}
+                logging.error(f"Database writer commit failed: {exc}")
+            self.batches += 1
+            self.requests_served += len(batch)
+            for _, _, done in batch:
+                done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单写入者数据库进程")
+    parser.add_argument('--address', required=True, help="监听地址：host:port 或 Unix socket 路径")
+    parser.add_argument('--max-batch', type=int, default=256, help="单个事务合并的最大请求数")
+    args = parser.parse_args()
+    WriterServer(args.address, DB_WRITER_AUTHKEY, max_batch=args.max_batch).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,4 +4,5 @@ from bot import bot
 from config import DISCORD_TOKEN
 
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    # 日志已由 config.py 配置，不让 discord.py 再挂同步的控制台处理器
+    bot.run(DISCORD_TOKEN, log_handler=None)
@@ -0,0 +1,253 @@
+"""流式导出：将 users / referral_events / payouts 按条件导出为 CSV 或 JSONL（可 gzip 压缩），供财务对账。
+
+行通过生成器按 fetchmany 分批读取、逐行写出，内存占用与行数无关（百万级流水同样平稳）。
+使用只读连接，不影响运行中的 Bot；referral_events 可选合并归档库中的流水（--include-archived）。
+
+过滤条件：
+- since / until：按各表的时间列（join_date / joined_at / created_at）过滤，since 含、until 不含，
+  格式 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS（如按月导出：--since 2026-09-01 --until 2026-10-01）
+- inviter：users 按 referred_by，referral_events 按 inviter_id，payouts 按 user_id
+- settled：仅 referral_events 支持
+
+    python export.py referral_events --since 2026-09-01 --until 2026-10-01 -o events-2026-09.csv.gz
+    python export.py payouts --format jsonl --guild 123456789 -o payouts.jsonl.gz
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+# 表名 -> (导出列, 时间列, 邀请者过滤列, 是否支持 settled 过滤)
+TABLES = {
+    'users': (
+        ('user_id', 'username', 'referred_by', 'join_date', 'reward_balance', 'role_id'),
+        'join_date', 'referred_by', False,
+    ),
+    'referral_events': (
+        ('id', 'inviter_id', 'invite_code', 'new_member_id', 'joined_at', 'commission_amount', 'settled',
+         'role_id', 'config_version', 'level', 'renewal', 'held'),
+        'joined_at', 'inviter_id', True,
+    ),
+    'payouts': (
+        ('id', 'user_id', 'amount', 'created_at', 'note'),
+        'created_at', 'user_id', False,
+    ),
+}
+FORMATS = ('csv', 'jsonl')
+
+EXPORT_BATCH_SIZE = 5000
+
+
+def parse_time_bound(text: str) -> str:
+    """校验并规范化时间边界（与库中的本地时间文本按字符串比较），格式错误时抛出 ValueError。"""
+    text = text.strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date {text!r}, expected YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+
+
+def _connect(database_path: str | None = None) -> sqlite3.Connection:
+    from config import DATABASE_PATH
+
+    return sqlite3.connect(f"file:{database_path or DATABASE_PATH}?mode=ro", uri=True)
+
+
+def archive_path_for(database_path: str | None = None) -> str:
+    """主库对应的归档库：未指定主库时为 ARCHIVE_DATABASE_PATH，否则按主库路径推导（同 config 的默认规则）。"""
+    from config import ARCHIVE_DATABASE_PATH
+
+    if not database_path:
+        return ARCHIVE_DATABASE_PATH
+    return os.path.splitext(database_path)[0] + '_archive.db'
+
+
+def _attach_archive(conn: sqlite3.Connection, archive_path: str | None) -> bool:
+    """只读附加归档库；归档库不存在或尚未归档过时返回 False。"""
+    if not archive_path or not os.path.exists(archive_path):
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+    return conn.execute(
+        "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'referral_events'"
+    ).fetchone() is not None
+
+
+def _existing_columns(conn: sqlite3.Connection, schema: str, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+
+
+def build_query(conn: sqlite3.Connection, table: str, guild_id: int, since: str | None = None, until: str | None = None,
+                inviter_id: int | None = None, settled: bool | None = None, include_archived: bool = False,
+                archive_path: str | None = None):
+    """返回 (列名, SQL, 参数)。旧库缺少的列导出为空值；include_archived 时合并 archive_path 归档库中的流水。"""
+    if table not in TABLES:
+        raise ValueError(f"unknown table: {table}")
+    columns, time_column, inviter_column, supports_settled = TABLES[table]
+    if settled is not None and not supports_settled:
+        raise ValueError(f"{table} does not support the settled filter")
+    where = ["guild_id = ?"]
+    params: list = [guild_id]
+    if since:
+        where.append(f"{time_column} >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{time_column} < ?")
+        params.append(until)
+    if inviter_id is not None:
+        where.append(f"{inviter_column} = ?")
+        params.append(inviter_id)
+    if settled is not None:
+        where.append("settled = ?")
+        params.append(1 if settled else 0)
+    condition = " AND ".join(where)
+
+    def select(schema: str) -> str:
+        existing = _existing_columns(conn, schema, table)
+        column_list = ", ".join(name if name in existing else f"NULL AS {name}" for name in columns)
+        return f"SELECT {column_list} FROM {schema}.{table} WHERE {condition}"
+
+    order = "id" if 'id' in columns else columns[0]
+    if include_archived and table == 'referral_events' and _attach_archive(conn, archive_path):
+        # 归档与热库的 id 不重叠（归档保留原 id），按 id 合并即为原始顺序
+        sql = f"{select('archive')} UNION ALL {select('main')} ORDER BY {order}"
+        params = params * 2
+    else:
+        sql = f"{select('main')} ORDER BY {order}"
+    return list(columns), sql, params
+
+
+def iter_rows(conn: sqlite3.Connection, sql: str, params, batch_size: int = EXPORT_BATCH_SIZE):
+    """按 fetchmany 分批产出行。"""
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def iter_csv(columns, rows):
+    """逐行产出 CSV 文本（首行为表头）。"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+
+def iter_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+
+def export_table(fileobj, table: str, guild_id: int, fmt: str = 'csv', compress: bool = True,
+                 since: str | None = None, until: str | None = None, inviter_id: int | None = None,
+                 settled: bool | None = None, include_archived: bool = False, database_path: str | None = None,
+                 batch_size: int = EXPORT_BATCH_SIZE, progress=None, archive_path: str | None = None) -> dict:
+    """将导出内容写入二进制文件对象 fileobj，返回 {'rows', 'seconds'}；progress(rows) 每导出一批调用一次。
+    archive_path 默认为 database_path 对应的归档库（见 archive_path_for）。"""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    started = time.perf_counter()
+    conn = _connect(database_path)
+    count = 0
+    try:
+        columns, sql, params = build_query(conn, table, guild_id, since, until, inviter_id, settled, include_archived,
+                                           archive_path or archive_path_for(database_path))
+
+        def counted():
+            nonlocal count
+            for row in iter_rows(conn, sql, params, batch_size):
+                count += 1
+                if progress is not None and count % batch_size == 0:
+                    progress(count)
+                yield row
+
+        chunks = iter_csv(columns, counted()) if fmt == 'csv' else iter_jsonl(columns, counted())
+        stream = gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0) if compress else fileobj
+        # 逐行文本经缓冲后再批量压缩写出，避免每行一次 zlib/系统调用
+        writer = io.TextIOWrapper(stream, encoding='utf-8', newline='', write_through=False)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.flush()
+        finally:
+            # detach 后由调用方负责关闭 fileobj
+            writer.detach()
+            if compress:
+                stream.close()
+    finally:
+        conn.close()
+    return {'rows': count, 'seconds': time.perf_counter() - started}
+
+
+def export_filename(table: str, fmt: str, compress: bool, since: str | None = None, until: str | None = None) -> str:
+    parts = [table]
+    if since or until:
+        parts.append(f"{(since or '')[:10]}_{(until or '')[:10]}")
+    return "-".join(parts) + f".{fmt}" + (".gz" if compress else "")
+
+
+def _time_arg(text: str) -> str:
+    try:
+        return parse_time_bound(text)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流式导出用户、佣金流水与结算记录")
+    parser.add_argument('table', choices=sorted(TABLES))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--guild', type=int, default=None, help="服务器ID（默认 DEFAULT_GUILD_ID）")
+    parser.add_argument('--since', type=_time_arg, default=None, help="起始时间（含），YYYY-MM-DD[ HH:MM:SS]")
+    parser.add_argument('--until', type=_time_arg, default=None, help="截止时间（不含），YYYY-MM-DD[ HH:MM:SS]")
+    parser.add_argument('--inviter', type=int, default=None, help="只导出该邀请者（payouts 为结算对象）")
+    parser.add_argument('--settled', choices=('yes', 'no'), default=None, help="仅 referral_events：按是否已结算过滤")
+    parser.add_argument('--include-archived', action='store_true', help="仅 referral_events：合并归档库中的流水")
+    parser.add_argument('--no-gzip', action='store_true', help="不压缩")
+    parser.add_argument('--db', default=None, help="SQLite 文件路径（默认使用 DATABASE_PATH）")
+    parser.add_argument('--archive-db', default=None,
+                        help="归档库路径（默认 ARCHIVE_DATABASE_PATH；指定 --db 时为 <db>_archive.db）")
+    parser.add_argument('-o', '--output', default=None, help="输出文件（默认按表名与时间范围命名，'-' 为标准输出）")
+    args = parser.parse_args(argv)
+    from config import DEFAULT_GUILD_ID
+
+    compress = not args.no_gzip
+    guild_id = args.guild if args.guild is not None else DEFAULT_GUILD_ID
+    settled = None if args.settled is None else args.settled == 'yes'
+    if settled is not None and not TABLES[args.table][3]:
+        parser.error("--settled is only supported for referral_events")
+    output = args.output or export_filename(args.table, args.format, compress, args.since, args.until)
+    options = dict(fmt=args.format, compress=compress, since=args.since, until=args.until, inviter_id=args.inviter,
+                   settled=settled, include_archived=args.include_archived, database_path=args.db,
+                   archive_path=args.archive_db)
+    try:
+        if output == '-':
+            result = export_table(sys.stdout.buffer, args.table, guild_id, **options)
+        else:
+            with open(output, 'wb') as f:
+                result = export_table(f, args.table, guild_id, **options)
+    except ValueError as exc:
+        sys.exit(f"Export failed: {exc}")
+    print(f"Exported {result['rows']} {args.table} rows in {result['seconds']:.2f}s"
+          + ("" if output == '-' else f" to {output}"), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
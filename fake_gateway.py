@@ -0,0 +1,122 @@
+"""假网关：不连接 Discord，用合成的成员加入 / 角色升级事件驱动 bot.py 中的真实处理函数。
+
+用于在本地验证多进程分片模式（launcher.py --fake-gateway）：每个工作进程只为分配给自己的分片
+生成服务器事件，数据库写入经由写入进程完成。也可单独运行：python fake_gateway.py --events 200
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+import bot
+from config import (
+    SHARD_IDS,
+    SHARD_COUNT,
+    ALLOWED_CHANNEL_IDS,
+    INVITE_NOTIFICATION_CHANNEL_ID,
+    COMMISSION_NOTIFICATION_CHANNEL_ID,
+)
+from database import Database
+import levels
+from fakes import FakeGuild, FakeRest
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """与 Discord 相同的分片规则：(guild_id >> 22) % shard_count。"""
+    return (guild_id >> 22) % shard_count
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_guild(guild_id: int, inviters: int, rng: random.Random, rest: FakeRest | None = None) -> FakeGuild:
+    """构造一个合成服务器：通知/允许频道、当前等级配置中的付费角色，以及持有邀请链接的邀请者。"""
+    guild = FakeGuild(guild_id, name=f"Fake Guild {guild_id}", rest=rest)
+    channel_ids = {INVITE_NOTIFICATION_CHANNEL_ID, COMMISSION_NOTIFICATION_CHANNEL_ID, *ALLOWED_CHANNEL_IDS}
+    for channel_id in channel_ids:
+        guild.add_channel(channel_id)
+    invite_channel = guild.get_channel(ALLOWED_CHANNEL_IDS[0])
+    paid_roles = [guild.add_role(level.role_ids[0], level.name) for level in levels.current().levels if level.role_ids]
+    with Database(guild_id) as db:
+        for i in range(inviters):
+            member = guild.add_member(guild_id + 1 + i, roles=[rng.choice(paid_roles)] if paid_roles else [])
+            invite = guild.create_invite(member, invite_channel)
+            db.add_invite_v2(member.id, invite.code, invite.url, invite_channel.id, time.strftime('%Y-%m-%d %H:%M:%S'))
+    return guild
+
+
+async def drive(guilds: list[FakeGuild], events: int, rng: random.Random, upgrade_ratio: float = 0.5) -> dict:
+    """按比例交替产生加入与升级事件，返回各类事件的耗时样本。"""
+    for guild in guilds:
+        await bot._prime_guild(guild)
+    tiers = [[g.get_role(level.role_ids[0]) for level in levels.current().levels if level.role_ids] for g in guilds]
+    joined: dict[int, list] = {guild.id: [] for guild in guilds}
+    next_id = {guild.id: guild.id + 100_000 for guild in guilds}
+    samples: dict[str, list[float]] = {'join': [], 'upgrade': []}
+
+    for _ in range(events):
+        index = rng.randrange(len(guilds))
+        guild = guilds[index]
+        roles = tiers[index]
+        candidates = [m for m in joined[guild.id] if len(m.roles) < len(roles)]
+        if roles and candidates and rng.random() < upgrade_ratio:
+            member = rng.choice(candidates)
+            before = member.snapshot()
+            member.roles.append(roles[len(member.roles)])
+            start = time.perf_counter()
+            await bot.on_member_update(before, member)
+            samples['upgrade'].append(time.perf_counter() - start)
+        else:
+            invite = rng.choice(list(guild._invites.values()))
+            next_id[guild.id] += 1
+            member = guild.add_member(next_id[guild.id])
+            guild.use_invite(invite.code)
+            start = time.perf_counter()
+            await bot.on_member_join(member)
+            samples['join'].append(time.perf_counter() - start)
+            joined[guild.id].append(member)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="假网关：用合成事件驱动真实处理函数")
+    parser.add_argument('--guilds', type=int, default=4, help="合成服务器总数（按分片过滤后只处理本进程的部分）")
+    parser.add_argument('--events', type=int, default=200, help="本进程生成的事件数")
+    parser.add_argument('--inviters', type=int, default=10, help="每个服务器的邀请者数量")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    shard_count = SHARD_COUNT or 1
+    shard_ids = SHARD_IDS or list(range(shard_count))
+    # 使用雪花格式的服务器ID，使其按分片规则均匀分布
+    guild_ids = [(i + 1) << 22 for i in range(args.guilds)]
+    mine = [gid for gid in guild_ids if shard_for_guild(gid, shard_count) in shard_ids]
+    if not mine:
+        logging.info(f"Fake gateway for shards {shard_ids}: no guilds assigned.")
+        return
+    guilds = [build_guild(gid, args.inviters, rng) for gid in mine]
+
+    start = time.perf_counter()
+    samples = asyncio.run(drive(guilds, args.events, rng))
+    elapsed = time.perf_counter() - start
+    total = sum(len(v) for v in samples.values())
+    lines = [f"shards={shard_ids} guilds={len(guilds)} events={total} elapsed={elapsed:.2f}s throughput={total / elapsed:.1f}/s"]
+    for kind, values in samples.items():
+        lines.append(
+            f"  {kind:<8} n={len(values):<6} p50={percentile(values, 50) * 1000:.2f}ms "
+            f"p99={percentile(values, 99) * 1000:.2f}ms"
+        )
+    report = "\n".join(lines)
+    logging.info(f"Fake gateway report:\n{report}")
+    print(report, flush=True)
+
+
+if __name__ == '__main__':
+    main()
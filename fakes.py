@@ -0,0 +1,323 @@
+"""轻量级 Discord 对象替身。
+
+用于在不连接 Discord 网关的情况下驱动 bot.py 中的真实事件处理函数与斜杠指令回调（本地假网关、基准测试等）。
+只实现处理函数实际用到的属性与方法；所有“REST 调用”统一经过 FakeRest 计数（同时计入 metrics），并可模拟延迟。
+"""
+import asyncio
+import copy
+import itertools
+import time
+from datetime import datetime, timezone
+
+import discord
+
+import metrics
+
+
+class FakeResponse:
+    """构造 discord.HTTPException 所需的最小响应对象。"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+def not_found(message: str) -> discord.NotFound:
+    return discord.NotFound(FakeResponse(404, 'Not Found'), message)
+
+
+class FakeRest:
+    """本地 REST 替身：按路由计数，可选固定延迟与限速。
+
+    rate_limit=(limit, per) 时每个路由在 per 秒窗口内最多 limit 次，global_limit 为每秒全局上限；
+    超出时记为一次限速命中（rate_limited），并像 discord.py 处理 429 一样等待窗口重置后继续。
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: tuple[int, float] | None = None, global_limit: int | None = None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.global_limit = global_limit
+        self.calls: dict[str, int] = {}
+        self.rate_limited: dict[str, int] = {}
+        self._buckets: dict[str, list] = {}
+
+    async def _acquire(self, key: str, limit: int, per: float, route: str):
+        loop = asyncio.get_running_loop()
+        while True:
+            bucket = self._buckets.setdefault(key, [loop.time(), 0])
+            now = loop.time()
+            if now - bucket[0] >= per:
+                bucket[0], bucket[1] = now, 0
+            if bucket[1] < limit:
+                bucket[1] += 1
+                return
+            self.rate_limited[route] = self.rate_limited.get(route, 0) + 1
+            await asyncio.sleep(bucket[0] + per - now)
+
+    async def call(self, route: str):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        start = time.perf_counter()
+        if self.global_limit:
+            await self._acquire('*', self.global_limit, 1.0, route)
+        if self.rate_limit:
+            await self._acquire(route, self.rate_limit[0], self.rate_limit[1], route)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        metrics.record_rest(route, time.perf_counter() - start)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def total_rate_limited(self) -> int:
+        return sum(self.rate_limited.values())
+
+
+class FakeRole:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<FakeRole id={self.id} name={self.name!r}>"
+
+
+class FakePermissions:
+    def __init__(self, administrator: bool = False):
+        self.administrator = administrator
+
+
+class FakeMember:
+    def __init__(self, id: int, name: str, guild: 'FakeGuild', roles=(), joined_at: datetime | None = None,
+                 created_at: datetime | None = None, administrator: bool = False):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.roles = list(roles)
+        self.joined_at = joined_at or datetime.now(timezone.utc)
+        self.created_at = created_at or self.joined_at
+        self.guild_permissions = FakePermissions(administrator)
+        self.display_avatar = None
+        self.bot = False
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+    def snapshot(self) -> 'FakeMember':
+        """角色列表独立的浅拷贝，用作 on_member_update 的 before。"""
+        clone = copy.copy(self)
+        clone.roles = list(self.roles)
+        return clone
+
+    async def add_roles(self, *roles, reason=None):
+        await self.guild.rest.call('PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}')
+        self.roles.extend(r for r in roles if r not in self.roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.guild.rest.call('DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}')
+        self.roles = [r for r in self.roles if r not in roles]
+
+
+class FakeInvite:
+    def __init__(self, code: str, guild: 'FakeGuild', channel: 'FakeChannel', inviter: FakeMember | None, uses: int = 0):
+        self.code = code
+        self.guild = guild
+        self.channel = channel
+        self.inviter = inviter
+        self.uses = uses
+
+    @property
+    def url(self) -> str:
+        return f"https://discord.gg/{self.code}"
+
+    async def delete(self, reason=None):
+        await self.guild.rest.call('DELETE /invites/{code}')
+        self.guild._invites.pop(self.code, None)
+
+
+class FakeChannel:
+    def __init__(self, id: int, name: str, guild: 'FakeGuild'):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.sent: list[dict] = []
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.call('POST /channels/{channel_id}/messages')
+        self.sent.append({'content': content, **kwargs})
+
+    async def create_invite(self, max_age=0, max_uses=0, unique=True, reason=None):
+        await self.guild.rest.call('POST /channels/{channel_id}/invites')
+        return self.guild.create_invite(None, self)
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        await self._interaction.guild.rest.call('POST /interactions/{interaction_id}/{interaction_token}/callback')
+        self._done = True
+
+    async def defer(self, ephemeral: bool = False, thinking: bool = False):
+        await self._respond()
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond()
+        self._interaction.sent.append({'content': content, **kwargs})
+
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.guild.rest.call('POST /webhooks/{application_id}/{interaction_token}')
+        self._interaction.sent.append({'content': content, **kwargs})
+
+
+class FakeInteraction:
+    """按钮交互或斜杠指令调用；custom_id 为 None 时视为斜杠指令（application_command）。"""
+
+    _ids = itertools.count((1 << 22) * 1000)
+
+    def __init__(self, user: FakeMember, channel: 'FakeChannel', custom_id: str | None = None):
+        self.id = next(self._ids)
+        self.user = user
+        self.guild = user.guild
+        self.guild_id = user.guild.id
+        self.channel = channel
+        if custom_id is None:
+            self.type = discord.InteractionType.application_command
+            self.data = {}
+        else:
+            self.type = discord.InteractionType.component
+            self.data = {'custom_id': custom_id, 'component_type': 2}
+        self.command = None
+        self.extras: dict = {}
+        self.sent: list[dict] = []
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, content=None, **kwargs):
+        await self.guild.rest.call('PATCH /webhooks/{application_id}/{interaction_token}/messages/@original')
+        self.sent.append({'content': content, 'edited': True, **kwargs})
+
+
+class FakeGuild:
+    _codes = itertools.count(1)
+
+    def __init__(self, id: int, name: str = 'Fake Guild', rest: FakeRest | None = None):
+        self.id = id
+        self.name = name
+        self.rest = rest or FakeRest()
+        self._members: dict[int, FakeMember] = {}
+        self._roles: dict[int, FakeRole] = {}
+        self._channels: dict[int, FakeChannel] = {}
+        self._invites: dict[str, FakeInvite] = {}
+
+    # 构造辅助
+    def add_role(self, id: int, name: str) -> FakeRole:
+        role = self._roles.setdefault(id, FakeRole(id, name))
+        return role
+
+    def add_channel(self, id: int, name: str = 'channel') -> FakeChannel:
+        return self._channels.setdefault(id, FakeChannel(id, name, self))
+
+    def add_member(self, id: int, name: str | None = None, roles=(), **kwargs) -> FakeMember:
+        member = FakeMember(id, name or f"user{id}", self, roles=roles, **kwargs)
+        self._members[id] = member
+        return member
+
+    def create_invite(self, inviter: FakeMember | None, channel: FakeChannel) -> FakeInvite:
+        code = f"fake{next(self._codes):06d}"
+        invite = FakeInvite(code, self, channel, inviter)
+        self._invites[code] = invite
+        return invite
+
+    def add_invite(self, code: str, inviter: FakeMember | None, channel: 'FakeChannel', uses: int = 0) -> FakeInvite:
+        invite = FakeInvite(code, self, channel, inviter, uses)
+        self._invites[code] = invite
+        return invite
+
+    def use_invite(self, code: str):
+        self._invites[code].uses += 1
+
+    def remove_member(self, user_id: int):
+        self._members.pop(user_id, None)
+
+    # 处理函数使用的 discord.Guild 接口
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self._members.values())
+
+    @property
+    def roles(self) -> list[FakeRole]:
+        return list(self._roles.values())
+
+    @property
+    def channels(self) -> list['FakeChannel']:
+        return list(self._channels.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self._members)
+
+    def get_member(self, user_id: int):
+        return self._members.get(user_id)
+
+    def get_member_named(self, name: str):
+        return next((m for m in self._members.values() if m.name == name), None)
+
+    def get_role(self, role_id: int):
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
+
+    async def fetch_member(self, user_id: int):
+        await self.rest.call('GET /guilds/{guild_id}/members/{user_id}')
+        member = self._members.get(user_id)
+        if member is None:
+            raise not_found('Unknown Member')
+        return member
+
+    async def fetch_channel(self, channel_id: int):
+        await self.rest.call('GET /channels/{channel_id}')
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            raise not_found('Unknown Channel')
+        return channel
+
+    async def invites(self):
+        await self.rest.call('GET /guilds/{guild_id}/invites')
+        return list(self._invites.values())
+
+    async def fetch_invite(self, code: str):
+        await self.rest.call('GET /invites/{code}')
+        invite = self._invites.get(code)
+        if invite is None:
+            raise not_found('Unknown Invite')
+        return invite
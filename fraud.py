@@ -0,0 +1,129 @@
+"""刷邀请检测：在成员加入时按邀请者维护滑动窗口，实时发现异常的邀请模式。
+
+每个 (服务器, 邀请者) 一个窗口，按加入时间顺序保存 (时间戳, 是否新账号)，并维护窗口内新账号计数；
+每次加入先从队头弹出过期条目再追加，单次观察均摊 O(1)，不查询数据库。规则：
+- join_rate：窗口（FRAUD_WINDOW_MINUTES）内带来的加入人数超过 FRAUD_MAX_JOINS_PER_WINDOW
+- new_accounts：窗口内至少 FRAUD_MIN_JOINS 人，且注册不足 FRAUD_NEW_ACCOUNT_DAYS 天的账号占比达到 FRAUD_NEW_ACCOUNT_RATIO
+- invite_burst：单个邀请码在 FRAUD_BURST_SECONDS 秒内被使用达到 FRAUD_BURST_JOINS 次
+同一邀请者被标记后不再重复报告（直到 reset，如管理员审核释放后）；持久化的标记与佣金暂扣见 database.py 的 flagged_inviters。
+窗口只在内存中，重启后重新累计；长时间无人加入的窗口定期清理。
+"""
+import time
+from collections import deque
+from datetime import datetime
+
+from config import (
+    FRAUD_BURST_JOINS,
+    FRAUD_BURST_SECONDS,
+    FRAUD_MAX_JOINS_PER_WINDOW,
+    FRAUD_MIN_JOINS,
+    FRAUD_NEW_ACCOUNT_DAYS,
+    FRAUD_NEW_ACCOUNT_RATIO,
+    FRAUD_WINDOW_MINUTES,
+)
+
+REASON_LABELS = {
+    'join_rate': '加入速率过高',
+    'new_accounts': '新账号占比过高',
+    'invite_burst': '邀请码短时突增',
+}
+
+
+class _Window:
+    __slots__ = ('joins', 'young')
+
+    def __init__(self):
+        self.joins: deque[tuple[float, bool]] = deque()
+        self.young = 0
+
+
+class Detector:
+    def __init__(self, window_seconds: float = FRAUD_WINDOW_MINUTES * 60, max_joins: int = FRAUD_MAX_JOINS_PER_WINDOW,
+                 new_account_days: float = FRAUD_NEW_ACCOUNT_DAYS, new_account_ratio: float = FRAUD_NEW_ACCOUNT_RATIO,
+                 min_joins: int = FRAUD_MIN_JOINS, burst_seconds: float = FRAUD_BURST_SECONDS,
+                 burst_joins: int = FRAUD_BURST_JOINS):
+        self.window_seconds = window_seconds
+        self.max_joins = max_joins
+        self.new_account_seconds = new_account_days * 86400
+        self.new_account_ratio = new_account_ratio
+        self.min_joins = min_joins
+        self.burst_seconds = burst_seconds
+        self.burst_joins = burst_joins
+        self._windows: dict[tuple[int, int], _Window] = {}
+        self._bursts: dict[tuple[int, str], deque[float]] = {}
+        self._flagged: set[tuple[int, int]] = set()
+        self._next_prune = 0.0
+
+    def __len__(self):
+        return len(self._windows)
+
+    def observe(self, guild_id: int, inviter_id: int, account_created_at: datetime | None = None,
+                invite_code: str | None = None, now: float | None = None) -> tuple[list[str], dict]:
+        """记录一次经 inviter_id 邀请的加入，返回 (新触发的规则列表, 窗口统计)；已标记过的邀请者规则列表为空。"""
+        now = time.time() if now is None else now
+        if now >= self._next_prune:
+            self.prune(now)
+        key = (guild_id, inviter_id)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window()
+        horizon = now - self.window_seconds
+        joins = window.joins
+        while joins and joins[0][0] <= horizon:
+            if joins.popleft()[1]:
+                window.young -= 1
+        young = account_created_at is not None and now - account_created_at.timestamp() < self.new_account_seconds
+        joins.append((now, young))
+        window.young += young
+
+        code_joins = 0
+        if invite_code:
+            burst = self._bursts.get((guild_id, invite_code))
+            if burst is None:
+                burst = self._bursts[(guild_id, invite_code)] = deque()
+            burst_horizon = now - self.burst_seconds
+            while burst and burst[0] <= burst_horizon:
+                burst.popleft()
+            burst.append(now)
+            code_joins = len(burst)
+
+        count = len(joins)
+        stats = {'joins': count, 'young': window.young, 'window_minutes': self.window_seconds / 60,
+                 'invite_code': invite_code, 'code_joins': code_joins, 'burst_seconds': self.burst_seconds}
+        if key in self._flagged:
+            return [], stats
+        reasons = []
+        if count > self.max_joins:
+            reasons.append('join_rate')
+        if count >= self.min_joins and window.young / count >= self.new_account_ratio:
+            reasons.append('new_accounts')
+        if code_joins >= self.burst_joins:
+            reasons.append('invite_burst')
+        if reasons:
+            self._flagged.add(key)
+        return reasons, stats
+
+    def prune(self, now: float | None = None):
+        """清理窗口内已无加入记录的邀请者与邀请码（每个窗口周期最多执行一次）。"""
+        now = time.time() if now is None else now
+        horizon = now - self.window_seconds
+        for key in [key for key, window in self._windows.items() if not window.joins or window.joins[-1][0] <= horizon]:
+            del self._windows[key]
+        burst_horizon = now - self.burst_seconds
+        for key in [key for key, burst in self._bursts.items() if not burst or burst[-1] <= burst_horizon]:
+            del self._bursts[key]
+        self._next_prune = now + self.window_seconds
+
+    def reset(self, guild_id: int, inviter_id: int):
+        """清空邀请者的窗口与已标记状态（审核释放后重新开始检测）。"""
+        self._windows.pop((guild_id, inviter_id), None)
+        self._flagged.discard((guild_id, inviter_id))
+
+
+def describe(reasons, stats: dict) -> str:
+    """标记原因与窗口统计的可读说明（写入 flagged_inviters.details）。"""
+    labels = "、".join(REASON_LABELS.get(reason, reason) for reason in reasons)
+    text = f"{labels}：{stats['window_minutes']:g} 分钟内加入 {stats['joins']} 人，其中新账号 {stats['young']} 人"
+    if stats.get('invite_code'):
+        text += f"；邀请码 {stats['invite_code']} 在 {stats['burst_seconds']:g} 秒内使用 {stats['code_joins']} 次"
+    return text
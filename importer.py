@@ -0,0 +1,442 @@
+"""批量导入：从其他邀请系统迁移时，一次导入历史用户（邀请关系、加入时间、角色、余额）、佣金流水与结算记录。
+
+文件为 CSV（首行表头）或 JSONL，可 gzip 压缩（.gz），列名与 export.py 导出的一致，多余的列忽略。
+导入分三步，均在同一连接上完成：
+1. 加载：逐行解析并做类型转换，按 IMPORT_CHUNK_SIZE 行一批 executemany 写入临时暂存表（TEMP，不占主库写锁）
+2. 校验：在暂存表上用集合 SQL 标记问题行——自邀、引用的用户不存在（现有用户与本次导入的用户均可被引用）、
+   同一文件内重复的用户、负数金额；文件内重复的流水/结算记录只保留第一行，与库中（含只读附加的归档库）已有记录
+   完全相同的视为已导入并跳过（可重复执行）
+3. 合并：一个事务内写入 users（与 add_or_update_user 相同的合并规则，文件中的 reward_balance 覆盖现有余额）、
+   重建该服务器的邀请关系闭包表，再写入 referral_events、payouts
+
+有问题的行不导入，按原因汇总并可用 --errors 输出明细；--strict 时只要有问题行就整体放弃。
+导入的流水不会再计入余额：迁移时余额以用户文件中的 reward_balance 为准。
+
+    python importer.py --users users.csv --events events.jsonl.gz --payouts payouts.csv --guild 123456789
+    python importer.py --users users.csv --dry-run --errors rejected.csv
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+IMPORT_CHUNK_SIZE = 10000
+
+# 显示前若干条问题行
+_SAMPLE_ERRORS = 20
+
+
+def _time(value) -> str:
+    text = str(value).strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"invalid time {text!r}")
+
+
+def _flag(value) -> int:
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes'):
+        return 1
+    if text in ('0', 'false', 'no'):
+        return 0
+    raise ValueError(f"invalid flag {value!r}")
+
+
+# 表名 -> [(列名, 转换函数, 是否必填)]
+SPECS = {
+    'users': [
+        ('user_id', int, True),
+        ('username', str, False),
+        ('referred_by', int, False),
+        ('join_date', _time, False),
+        ('reward_balance', float, False),
+        ('role_id', int, False),
+    ],
+    'referral_events': [
+        ('inviter_id', int, True),
+        ('invite_code', str, False),
+        ('new_member_id', int, True),
+        ('joined_at', _time, True),
+        ('commission_amount', float, True),
+        ('settled', _flag, False),
+        ('role_id', int, False),
+        ('config_version', str, False),
+        ('level', int, False),
+        ('renewal', _flag, False),
+    ],
+    'payouts': [
+        ('user_id', int, True),
+        ('amount', float, True),
+        ('created_at', _time, True),
+        ('note', str, False),
+    ],
+}
+
+
+def _open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def iter_records(path: str):
+    """逐条产出 (行号, dict)；按扩展名识别 CSV 或 JSONL（.jsonl/.ndjson，可加 .gz）。"""
+    base = path[:-3] if path.endswith('.gz') else path
+    with _open_text(path) as f:
+        if base.endswith(('.jsonl', '.ndjson', '.json')):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError:
+                        yield line_no, None
+        else:
+            # 行号从 2 开始（第 1 行为表头）
+            for line_no, record in enumerate(csv.DictReader(f), 2):
+                yield line_no, record
+
+
+def convert(record, spec) -> tuple:
+    """按列定义转换一条记录；缺少必填列或类型错误时抛出 ValueError。"""
+    if not isinstance(record, dict):
+        raise ValueError("malformed record")
+    values = []
+    for name, cast, required in spec:
+        value = record.get(name)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            if required:
+                raise ValueError(f"missing {name}")
+            values.append(None)
+            continue
+        try:
+            values.append(cast(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid {name} {value!r}")
+    return tuple(values)
+
+
+class Importer:
+    """一次导入：暂存 -> 校验 -> 合并，统计各阶段行数与速度。"""
+
+    def __init__(self, guild_id: int, allow_missing_references: bool = False, chunk_size: int = IMPORT_CHUNK_SIZE):
+        import sqltrace
+        from config import DATABASE_PATH
+
+        self.guild_id = guild_id
+        self.allow_missing_references = allow_missing_references
+        self.chunk_size = chunk_size
+        # 自行管理事务；与写入进程并存时等待其释放写锁
+        self.conn = sqltrace.connect(DATABASE_PATH, timeout=30, isolation_level=None, uri=True)
+        self._archive: bool | None = None
+        self.staged: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.timings: dict[str, float] = {}
+
+    def close(self):
+        self.conn.close()
+
+    def _attach_archive(self) -> bool:
+        """只读附加归档库（ARCHIVE_DATABASE_PATH）；归档库不存在或尚未归档过时返回 False。"""
+        if self._archive is None:
+            from config import ARCHIVE_DATABASE_PATH
+
+            self._archive = False
+            if os.path.exists(ARCHIVE_DATABASE_PATH):
+                self.conn.execute("ATTACH DATABASE ? AS archive", (f"file:{ARCHIVE_DATABASE_PATH}?mode=ro",))
+                self._archive = self.conn.execute(
+                    "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'referral_events'"
+                ).fetchone() is not None
+        return self._archive
+
+    def _stage_table(self, table: str):
+        columns = ", ".join(name for name, _, _ in SPECS[table])
+        self.conn.execute(f"DROP TABLE IF EXISTS temp.stage_{table}")
+        self.conn.execute(f"CREATE TEMP TABLE stage_{table} (line INTEGER, source TEXT, {columns}, error TEXT)")
+        # 解析失败的行也记入暂存表（只有行号与原因），便于统一汇总
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS stage_rejects (source TEXT, line INTEGER, error TEXT)")
+
+    def load(self, table: str, path: str) -> int:
+        """解析文件并分批写入暂存表，返回成功解析的行数。"""
+        started = time.perf_counter()
+        spec = SPECS[table]
+        self._stage_table(table)
+        placeholders = ", ".join("?" for _ in range(len(spec) + 2))
+        insert = f"INSERT INTO temp.stage_{table} VALUES ({placeholders}, NULL)"
+        batch, rejects = [], []
+        loaded = 0
+        self.conn.execute("BEGIN")
+        try:
+            for line_no, record in iter_records(path):
+                try:
+                    batch.append((line_no, path, *convert(record, spec)))
+                except ValueError as exc:
+                    rejects.append((path, line_no, str(exc)))
+                    continue
+                if len(batch) >= self.chunk_size:
+                    self.conn.executemany(insert, batch)
+                    loaded += len(batch)
+                    batch.clear()
+            if batch:
+                self.conn.executemany(insert, batch)
+                loaded += len(batch)
+            if rejects:
+                self.conn.executemany("INSERT INTO temp.stage_rejects VALUES (?, ?, ?)", rejects)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.staged[table] = loaded
+        self.timings[f"load_{table}"] = time.perf_counter() - started
+        return loaded
+
+    def validate(self):
+        """在暂存表上标记问题行（error 非空的行不会合并）。"""
+        started = time.perf_counter()
+        staged = set(self.staged)
+        ops = []
+        # 暂存表上建索引后再做集合校验
+        if 'users' in staged:
+            ops += [
+                "CREATE INDEX temp.idx_stage_users_user ON stage_users (user_id, line)",
+                "CREATE INDEX temp.idx_stage_users_referred ON stage_users (referred_by)",
+                "UPDATE stage_users SET error = 'self-invite' WHERE referred_by = user_id",
+                # 同一用户出现多次时以最后一行为准
+                '''UPDATE stage_users SET error = 'duplicate user' WHERE error IS NULL AND EXISTS (
+                       SELECT 1 FROM stage_users later WHERE later.user_id = stage_users.user_id AND later.line > stage_users.line)''',
+                "UPDATE stage_users SET error = 'negative balance' WHERE error IS NULL AND reward_balance < 0",
+            ]
+        if 'referral_events' in staged:
+            ops += [
+                "CREATE INDEX temp.idx_stage_events_inviter ON stage_referral_events (inviter_id)",
+                "UPDATE stage_referral_events SET error = 'self-invite' WHERE inviter_id = new_member_id",
+                "UPDATE stage_referral_events SET error = 'negative amount' WHERE error IS NULL AND commission_amount < 0",
+            ]
+        if 'payouts' in staged:
+            ops.append("UPDATE stage_payouts SET error = 'non-positive amount' WHERE amount <= 0")
+        for sql in ops:
+            self.conn.execute(sql)
+
+        if not self.allow_missing_references:
+            known = "(SELECT user_id FROM main.users WHERE guild_id = ?{staged_users})".format(
+                staged_users=" UNION SELECT user_id FROM stage_users WHERE error IS NULL" if 'users' in staged else ""
+            )
+            references = [('users', 'referred_by', 'unknown referrer'),
+                          ('referral_events', 'inviter_id', 'unknown inviter'),
+                          ('referral_events', 'new_member_id', 'unknown member'),
+                          ('payouts', 'user_id', 'unknown user')]
+            # 被拒绝的用户不可被引用：先校验用户自身（邀请链上游被拒时逐轮传递），再校验引用它们的流水/结算记录
+            for table, column, reason in references:
+                if table not in staged:
+                    continue
+                changed = self.conn.execute(
+                    f"UPDATE stage_{table} SET error = ? WHERE error IS NULL AND {column} IS NOT NULL "
+                    f"AND {column} NOT IN {known}",
+                    (reason, self.guild_id),
+                ).rowcount
+                # 用户的邀请者被拒绝后，其下线也随之拒绝：每轮只检查刚被拒绝用户的直接下线（走 referred_by 索引）
+                while table == 'users' and changed:
+                    changed = self.conn.execute(
+                        '''UPDATE stage_users SET error = ? WHERE error IS NULL AND referred_by IN (
+                               SELECT user_id FROM stage_users WHERE error IS NOT NULL)
+                             AND NOT EXISTS (SELECT 1 FROM stage_users s WHERE s.user_id = stage_users.referred_by AND s.error IS NULL)
+                             AND NOT EXISTS (SELECT 1 FROM main.users u WHERE u.guild_id = ? AND u.user_id = stage_users.referred_by)''',
+                        (reason, self.guild_id),
+                    ).rowcount
+
+        # 文件内完全相同的流水/结算记录（判定键同下方“已导入”）：只保留第一条有效行
+        if 'referral_events' in staged:
+            self.conn.execute("CREATE INDEX temp.idx_stage_events_member ON stage_referral_events (new_member_id, joined_at, line)")
+            self.conn.execute(
+                '''UPDATE stage_referral_events SET error = 'duplicate in file' WHERE error IS NULL AND EXISTS (
+                       SELECT 1 FROM stage_referral_events earlier
+                       WHERE earlier.new_member_id = stage_referral_events.new_member_id
+                         AND earlier.joined_at = stage_referral_events.joined_at
+                         AND earlier.line < stage_referral_events.line AND earlier.error IS NULL
+                         AND earlier.role_id IS stage_referral_events.role_id
+                         AND earlier.inviter_id = stage_referral_events.inviter_id
+                         AND COALESCE(earlier.level, 1) = COALESCE(stage_referral_events.level, 1)
+                         AND COALESCE(earlier.renewal, 0) = COALESCE(stage_referral_events.renewal, 0))'''
+            )
+        if 'payouts' in staged:
+            self.conn.execute("CREATE INDEX temp.idx_stage_payouts_user ON stage_payouts (user_id, created_at, line)")
+            self.conn.execute(
+                '''UPDATE stage_payouts SET error = 'duplicate in file' WHERE error IS NULL AND EXISTS (
+                       SELECT 1 FROM stage_payouts earlier
+                       WHERE earlier.user_id = stage_payouts.user_id AND earlier.created_at = stage_payouts.created_at
+                         AND earlier.amount = stage_payouts.amount
+                         AND earlier.line < stage_payouts.line AND earlier.error IS NULL)'''
+            )
+
+        # 与库中已有记录完全相同：视为已导入，跳过（流水还要查归档库：已结算的旧流水会被移到那里）
+        if 'referral_events' in staged:
+            schemas = ['main', 'archive'] if self._attach_archive() else ['main']
+            exists = " OR ".join(
+                f'''EXISTS (
+                       SELECT 1 FROM {schema}.referral_events e
+                       WHERE e.guild_id = ? AND e.new_member_id = stage_referral_events.new_member_id
+                         AND e.role_id IS stage_referral_events.role_id AND e.inviter_id = stage_referral_events.inviter_id
+                         AND e.joined_at = stage_referral_events.joined_at
+                         AND COALESCE(e.level, 1) = COALESCE(stage_referral_events.level, 1)
+                         AND COALESCE(e.renewal, 0) = COALESCE(stage_referral_events.renewal, 0))'''
+                for schema in schemas
+            )
+            self.conn.execute(
+                f"UPDATE stage_referral_events SET error = 'already imported' WHERE error IS NULL AND ({exists})",
+                (self.guild_id,) * len(schemas)
+            )
+        if 'payouts' in staged:
+            self.conn.execute(
+                '''UPDATE stage_payouts SET error = 'already imported' WHERE error IS NULL AND EXISTS (
+                       SELECT 1 FROM main.payouts p
+                       WHERE p.guild_id = ? AND p.user_id = stage_payouts.user_id
+                         AND p.amount = stage_payouts.amount AND p.created_at = stage_payouts.created_at)''',
+                (self.guild_id,)
+            )
+
+        self.errors.clear()
+        for table in staged:
+            for reason, count in self.conn.execute(
+                f"SELECT error, COUNT(*) FROM stage_{table} WHERE error IS NOT NULL GROUP BY error"
+            ):
+                self.errors[f"{table}: {reason}"] += count
+        if self.conn.execute("SELECT 1 FROM sqlite_temp_master WHERE name = 'stage_rejects'").fetchone():
+            for reason, count in self.conn.execute("SELECT error, COUNT(*) FROM stage_rejects GROUP BY error"):
+                # 汇总时去掉原始值：invalid user_id 'abc' -> invalid user_id
+                self.errors["parse: " + reason.split(" '", 1)[0]] += count
+        self.timings['validate'] = time.perf_counter() - started
+
+    def rejected_rows(self):
+        """产出 (文件, 行号, 原因)，按文件与行号排序。"""
+        parts = [f"SELECT source, line, error FROM stage_{table} WHERE error IS NOT NULL" for table in self.staged]
+        if self.conn.execute("SELECT 1 FROM sqlite_temp_master WHERE name = 'stage_rejects'").fetchone():
+            parts.append("SELECT source, line, error FROM stage_rejects")
+        if parts:
+            yield from self.conn.execute(" UNION ALL ".join(parts) + " ORDER BY 1, 2")
+
+    def merge(self) -> dict:
+        """单事务合并暂存表中的有效行，返回各表写入行数。"""
+        started = time.perf_counter()
+        from database import CLOSURE_BACKFILL_SQL
+
+        merged = {}
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if 'users' in self.staged:
+                merged['users'] = self.conn.execute(
+                    '''INSERT INTO users (guild_id, user_id, username, referred_by, join_date, reward_balance, role_id)
+                       SELECT ?, user_id, username, referred_by, join_date, reward_balance, role_id
+                       FROM stage_users WHERE error IS NULL ORDER BY line
+                       ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                           username = COALESCE(NULLIF(excluded.username, ''), users.username),
+                           referred_by = COALESCE(excluded.referred_by, users.referred_by),
+                           join_date = COALESCE(NULLIF(excluded.join_date, ''), users.join_date),
+                           reward_balance = COALESCE(excluded.reward_balance, users.reward_balance),
+                           role_id = COALESCE(excluded.role_id, users.role_id)''',
+                    (self.guild_id,)
+                ).rowcount
+                # 文件未给出余额的新用户从 0 开始
+                self.conn.execute("UPDATE users SET reward_balance = 0 WHERE guild_id = ? AND reward_balance IS NULL",
+                                  (self.guild_id,))
+                # 邀请关系可能整体变化：重建该服务器的闭包表
+                self.conn.execute("DELETE FROM referral_closure WHERE guild_id = ?", (self.guild_id,))
+                before = self.conn.total_changes
+                self.conn.execute(CLOSURE_BACKFILL_SQL, (self.guild_id, self.guild_id))
+                merged['referral_closure'] = self.conn.total_changes - before
+            if 'referral_events' in self.staged:
+                merged['referral_events'] = self.conn.execute(
+                    '''INSERT INTO referral_events (guild_id, inviter_id, invite_code, new_member_id, joined_at, commission_amount,
+                                                   settled, role_id, config_version, level, renewal)
+                       SELECT ?, inviter_id, invite_code, new_member_id, joined_at, commission_amount, COALESCE(settled, 0),
+                              role_id, COALESCE(config_version, 'import'), COALESCE(level, 1), COALESCE(renewal, 0)
+                       FROM stage_referral_events WHERE error IS NULL ORDER BY joined_at, line''',
+                    (self.guild_id,)
+                ).rowcount
+            if 'payouts' in self.staged:
+                merged['payouts'] = self.conn.execute(
+                    '''INSERT INTO payouts (guild_id, user_id, amount, created_at, note)
+                       SELECT ?, user_id, amount, created_at, COALESCE(note, 'import')
+                       FROM stage_payouts WHERE error IS NULL ORDER BY created_at, line''',
+                    (self.guild_id,)
+                ).rowcount
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.timings['merge'] = time.perf_counter() - started
+        return merged
+
+
+def _rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:,.0f} rows/s" if seconds > 0 else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入历史用户、佣金流水与结算记录")
+    parser.add_argument('--users', default=None, help="用户文件（user_id, username, referred_by, join_date, reward_balance, role_id）")
+    parser.add_argument('--events', default=None, help="佣金流水文件（列同 export.py referral_events）")
+    parser.add_argument('--payouts', default=None, help="结算记录文件（user_id, amount, created_at, note）")
+    parser.add_argument('--guild', type=int, default=None, help="服务器ID（默认 DEFAULT_GUILD_ID）")
+    parser.add_argument('--db', default=None, help="SQLite 文件路径（默认使用 DATABASE_PATH）")
+    parser.add_argument('--dry-run', action='store_true', help="只加载与校验，不写入")
+    parser.add_argument('--strict', action='store_true', help="有任何问题行时不导入")
+    parser.add_argument('--allow-missing-references', action='store_true', help="允许引用库中不存在的用户")
+    parser.add_argument('--errors', default=None, help="将问题行（文件, 行号, 原因）写入 CSV")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    files = [(table, path) for table, path in (('users', args.users), ('referral_events', args.events),
+                                                ('payouts', args.payouts)) if path]
+    if not files:
+        parser.error("nothing to import: pass --users, --events and/or --payouts")
+    if args.db:
+        # 必须在导入 config 之前设置
+        os.environ['DATABASE_PATH'] = args.db
+    from config import DEFAULT_GUILD_ID
+    from database import Database
+
+    # 确保目标库已建表/迁移
+    with Database():
+        pass
+    guild_id = args.guild if args.guild is not None else DEFAULT_GUILD_ID
+    importer = Importer(guild_id, args.allow_missing_references, args.chunk_size)
+    try:
+        for table, path in files:
+            rows = importer.load(table, path)
+            seconds = importer.timings[f"load_{table}"]
+            print(f"Loaded {rows} {table} rows from {path} in {seconds:.2f}s ({_rate(rows, seconds)}).")
+        importer.validate()
+        rejected = sum(count for reason, count in importer.errors.items() if not reason.endswith('already imported'))
+        for reason, count in importer.errors.most_common():
+            print(f"  {count:>8}  {reason}")
+        if args.errors:
+            with open(args.errors, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('file', 'line', 'error'))
+                writer.writerows(importer.rejected_rows())
+        elif importer.errors:
+            for source, line, error in list(importer.rejected_rows())[:_SAMPLE_ERRORS]:
+                print(f"  {source}:{line}: {error}")
+        print(f"Validated in {importer.timings['validate']:.2f}s.")
+        if args.dry_run:
+            print("Dry run: nothing written.")
+            return
+        if args.strict and rejected:
+            sys.exit(f"Import aborted: {rejected} rejected rows (--strict).")
+        merged = importer.merge()
+        total = sum(merged.values())
+        seconds = sum(importer.timings.values())
+        print(f"Merged {', '.join(f'{count} {table}' for table, count in merged.items())} into guild {guild_id} "
+              f"in {importer.timings['merge']:.2f}s; {total} rows overall in {seconds:.2f}s ({_rate(total, seconds)}).")
+    finally:
+        importer.close()
+
+
+if __name__ == '__main__':
+    main()
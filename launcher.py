@@ -0,0 +1,138 @@
+"""多进程分片启动器。
+
+启动 1 个数据库写入进程（db_writer.py，独占 SQLite 写入）和 N 个分片工作进程（各自运行 bot.py，
+只连接分配到的分片），让网关事件处理利用多核，同时避免多个进程争抢 SQLite 写锁。
+
+    python launcher.py --workers 4 --shards 8
+    python launcher.py --workers 2 --shards 4 --fake-gateway --events 500   # 本地假网关验证
+"""
+import argparse
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Client
+
+from config import LOG_FILE, METRICS_PORT
+from db_writer import parse_address
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _log_file_for(name: str) -> str:
+    """每个子进程写独立的日志文件，避免多进程同时滚动同一个文件。"""
+    root, ext = os.path.splitext(LOG_FILE)
+    return f"{root}-{name}{ext or '.log'}"
+
+
+def _wait_for_writer(address: str, authkey: str, proc: subprocess.Popen, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Database writer exited early with code {proc.returncode}.")
+        try:
+            Client(parse_address(address), authkey=authkey.encode('utf-8')).close()
+            return
+        except (ConnectionRefusedError, FileNotFoundError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Database writer did not start listening on {address} within {timeout}s.")
+
+
+def assign_shards(shard_count: int, workers: int) -> list[list[int]]:
+    """按轮询将分片分配给工作进程。"""
+    return [[shard for shard in range(shard_count) if shard % workers == w] for w in range(workers)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程分片启动器：1 个写入进程 + N 个分片工作进程")
+    parser.add_argument('--workers', type=int, default=2, help="分片工作进程数")
+    parser.add_argument('--shards', type=int, default=None, help="分片总数（默认等于工作进程数）")
+    parser.add_argument('--writer-address', default='127.0.0.1:8765', help="写入进程监听地址（host:port 或 Unix socket 路径）")
+    parser.add_argument('--fake-gateway', action='store_true', help="工作进程运行 fake_gateway.py 而不连接 Discord")
+    parser.add_argument('--events', type=int, default=200, help="假网关模式下每个工作进程生成的事件数")
+    parser.add_argument('--guilds', type=int, default=8, help="假网关模式下的合成服务器总数")
+    args = parser.parse_args()
+
+    shard_count = args.shards or args.workers
+    workers = min(args.workers, shard_count)
+    authkey = secrets.token_hex(16)
+
+    base_env = dict(os.environ, DB_WRITER_AUTHKEY=authkey)
+    writer_env = {k: v for k, v in base_env.items() if k != 'DB_WRITER_ADDRESS'}
+    writer_env['LOG_FILE'] = _log_file_for('db-writer')
+    writer = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'db_writer.py'), '--address', args.writer_address],
+        env=writer_env,
+    )
+    _wait_for_writer(args.writer_address, authkey, writer)
+    logging.info(f"Database writer started (pid {writer.pid}) on {args.writer_address}.")
+
+    def start_worker(index: int, shard_ids: list[int]) -> subprocess.Popen:
+        env = dict(
+            base_env,
+            SHARD_IDS=",".join(str(s) for s in shard_ids),
+            SHARD_COUNT=str(shard_count),
+            DB_WRITER_ADDRESS=args.writer_address,
+            LOG_FILE=_log_file_for(f"worker{index}"),
+        )
+        if METRICS_PORT:
+            # 每个工作进程导出各自的指标，端口依次递增
+            env['METRICS_PORT'] = str(METRICS_PORT + index)
+        if args.fake_gateway:
+            cmd = [sys.executable, os.path.join(BASE_DIR, 'fake_gateway.py'),
+                   '--events', str(args.events), '--guilds', str(args.guilds)]
+        else:
+            cmd = [sys.executable, os.path.join(BASE_DIR, 'bot.py')]
+        proc = subprocess.Popen(cmd, env=env)
+        logging.info(f"Worker {index} started (pid {proc.pid}) for shards {shard_ids}.")
+        return proc
+
+    assignments = assign_shards(shard_count, workers)
+    procs = {index: start_worker(index, shards) for index, shards in enumerate(assignments)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    exit_code = 0
+    try:
+        while not stopping and procs:
+            time.sleep(0.5)
+            if writer.poll() is not None:
+                logging.error(f"Database writer exited with code {writer.returncode}; stopping workers.")
+                exit_code = 1
+                break
+            for index, proc in list(procs.items()):
+                code = proc.poll()
+                if code is None:
+                    continue
+                if args.fake_gateway or code == 0:
+                    # 假网关跑完即退出；正常退出的工作进程不再拉起
+                    procs.pop(index)
+                    exit_code = exit_code or code
+                else:
+                    logging.error(f"Worker {index} exited with code {code}; restarting in 5s.")
+                    time.sleep(5)
+                    procs[index] = start_worker(index, assignments[index])
+    finally:
+        for proc in [*procs.values(), writer]:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in [*procs.values(), writer]:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
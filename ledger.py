@@ -0,0 +1,195 @@
+"""余额对账：核对 users.reward_balance 是否等于“累计佣金 - 累计结算”，找出与流水历史不一致的用户。
+
+余额由各写入路径单独维护（adjust_reward_balance 在 0 处截断、旧版 !settle 只扣余额不写结算记录等），
+可能与 referral_events / payouts 逐渐偏离。本模块把每个用户的累计佣金与累计结算保存在 balance_ledger 中，
+并在 balance_reconcile_state 记录已累计到的流水/结算 id（高水位）：
+- 增量模式只汇总 id 大于高水位的新行，执行代价与新增行数成正比，可以高频运行
+- 全量模式（首次、--full，或历史流水被删除/移走后）清空该服务器的累计值，按热表 + 归档汇总重新计算
+被暂扣（held）的佣金不计入，审核释放后该服务器下次全量重建。
+局部结算会把原事件金额改小并拆出一条余数事件（split_from 指向最初的事件）：原事件已累计时余数不再重复累计。
+累计值在一个短写事务内更新（配置了写入进程时由写入进程执行）；与余额的比对在只读快照中进行，不阻塞 Bot 写入。
+
+    python ledger.py
+    python ledger.py --full --guild 123456789 --csv drift.csv
+"""
+import argparse
+import csv
+import io
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+from config import BALANCE_DRIFT_TOLERANCE, DATABASE_PATH
+import sqltrace
+
+# 累计值的更新全部是 SQL（高水位与上界都在语句中读取），经 Database._write 在一个写事务中执行：
+# 单进程时直接写入，配置了写入进程（DB_WRITER_ADDRESS）时交给写入进程，不与其争抢写锁。
+# {hwm} 为已累计到的流水/结算 id：增量模式读 balance_reconcile_state，全量模式为 0；上界取全表最大 id（O(1)）
+_EVENTS_HWM = "COALESCE((SELECT events_hwm FROM balance_reconcile_state WHERE guild_id = :guild), 0)"
+_PAYOUTS_HWM = "COALESCE((SELECT payouts_hwm FROM balance_reconcile_state WHERE guild_id = :guild), 0)"
+
+_CREDITS_SQL = '''
+    INSERT INTO balance_ledger (guild_id, user_id, credits)
+    SELECT guild_id, inviter_id, SUM(commission_amount) FROM referral_events
+    WHERE guild_id = :guild AND id > {hwm} AND id <= (SELECT COALESCE(MAX(id), 0) FROM referral_events)
+      AND inviter_id IS NOT NULL AND COALESCE(held, 0) = 0
+      AND (split_from IS NULL OR split_from > {hwm})
+    GROUP BY inviter_id
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET credits = credits + excluded.credits'''
+
+_PAYOUTS_SQL = '''
+    INSERT INTO balance_ledger (guild_id, user_id, payouts)
+    SELECT guild_id, user_id, SUM(amount) FROM payouts
+    WHERE guild_id = :guild AND id > {hwm} AND id <= (SELECT COALESCE(MAX(id), 0) FROM payouts) AND user_id IS NOT NULL
+    GROUP BY user_id
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET payouts = payouts + excluded.payouts'''
+
+_STATE_SQL = '''
+    INSERT INTO balance_reconcile_state (guild_id, events_hwm, payouts_hwm, reconciled_at)
+    VALUES (:guild, (SELECT COALESCE(MAX(id), 0) FROM referral_events), (SELECT COALESCE(MAX(id), 0) FROM payouts), :now)
+    ON CONFLICT (guild_id) DO UPDATE SET events_hwm = excluded.events_hwm,
+        payouts_hwm = excluded.payouts_hwm, reconciled_at = excluded.reconciled_at'''
+
+
+def _update_ops(guild_id: int, full: bool) -> list:
+    params = {'guild': guild_id, 'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    ops = []
+    if full:
+        ops += [
+            ("DELETE FROM balance_ledger WHERE guild_id = :guild", params),
+            # 已归档的流水只剩汇总行
+            ('''INSERT INTO balance_ledger (guild_id, user_id, credits)
+                SELECT guild_id, inviter_id, SUM(commission_total) FROM referral_rollups
+                WHERE guild_id = :guild GROUP BY inviter_id''', params),
+        ]
+    # 全量模式下所有余数事件都按当前金额计入（原事件已被改小）
+    ops += [
+        (_CREDITS_SQL.format(hwm="0" if full else _EVENTS_HWM), params),
+        (_PAYOUTS_SQL.format(hwm="0" if full else _PAYOUTS_HWM), params),
+        (_STATE_SQL, params),
+    ]
+    return ops
+
+
+# 余额本身的变化（如截断、只扣余额）不产生流水，因此每次都与该服务器全部用户比对（一次索引连接，不读取历史流水）；
+# 在只读快照中执行，不占写锁：高水位之后新到的流水/结算（tail）一并计入应有余额，与同一快照中的余额比较
+_DRIFT_SQL = '''
+    WITH tail (user_id, credits, payouts) AS (
+        SELECT user_id, SUM(credits), SUM(payouts) FROM (
+            SELECT inviter_id AS user_id, commission_amount AS credits, 0 AS payouts FROM referral_events
+            WHERE guild_id = :guild AND id > :events_hwm AND COALESCE(held, 0) = 0
+              AND (split_from IS NULL OR split_from > :events_hwm)
+            UNION ALL
+            SELECT user_id, 0, amount FROM payouts WHERE guild_id = :guild AND id > :payouts_hwm
+        ) GROUP BY user_id
+    )
+    SELECT user_id, username, balance, credits, payouts, balance - (credits - payouts) AS drift FROM (
+        SELECT u.user_id, u.username, COALESCE(u.reward_balance, 0) AS balance,
+               COALESCE(l.credits, 0) + COALESCE(t.credits, 0) AS credits,
+               COALESCE(l.payouts, 0) + COALESCE(t.payouts, 0) AS payouts
+        FROM users u
+        LEFT JOIN balance_ledger l ON l.guild_id = u.guild_id AND l.user_id = u.user_id
+        LEFT JOIN tail t ON t.user_id = u.user_id
+        WHERE u.guild_id = :guild
+    ) WHERE ABS(balance - (credits - payouts)) > :tolerance'''
+
+
+def reconcile(guild_id: int, full: bool = False, tolerance: float = BALANCE_DRIFT_TOLERANCE,
+              limit: int | None = 100) -> dict:
+    """增量（或全量）更新累计值并找出余额偏差的用户。
+
+    返回 {'mode', 'events', 'payouts', 'drifted': [(user_id, username, balance, credits, payouts, drift), ...],
+    'drifted_count', 'drift_total', 'seconds'}；drifted 按偏差绝对值降序，最多 limit 条（None 为全部），
+    drift = 当前余额 - 应有余额（正数表示余额多于流水历史）。
+    """
+    from database import Database
+
+    started = time.perf_counter()
+    conn = sqltrace.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True, timeout=30, isolation_level=None)
+    try:
+        state = conn.execute(
+            "SELECT events_hwm, payouts_hwm FROM balance_reconcile_state WHERE guild_id = ?", (guild_id,)
+        ).fetchone()
+        mode = 'full' if full or state is None else 'incremental'
+        previous_events_hwm, previous_payouts_hwm = (0, 0) if mode == 'full' else state
+        with Database(guild_id) as db:
+            db._write(_update_ops(guild_id, mode == 'full'))
+        # 比对在读事务中进行，期间 Bot 可以继续写入
+        conn.execute("BEGIN")
+        try:
+            events_hwm, payouts_hwm = conn.execute(
+                "SELECT events_hwm, payouts_hwm FROM balance_reconcile_state WHERE guild_id = ?", (guild_id,)
+            ).fetchone()
+            events = conn.execute(
+                "SELECT COUNT(*) FROM referral_events WHERE guild_id = ? AND id > ? AND id <= ?",
+                (guild_id, previous_events_hwm, events_hwm)
+            ).fetchone()[0]
+            payouts = conn.execute(
+                "SELECT COUNT(*) FROM payouts WHERE guild_id = ? AND id > ? AND id <= ?",
+                (guild_id, previous_payouts_hwm, payouts_hwm)
+            ).fetchone()[0]
+            params = {'guild': guild_id, 'events_hwm': events_hwm, 'payouts_hwm': payouts_hwm, 'tolerance': tolerance}
+            drifted_count, drift_total = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(drift), 0) FROM ({_DRIFT_SQL})", params
+            ).fetchone()
+            drifted = conn.execute(
+                f"{_DRIFT_SQL} ORDER BY ABS(drift) DESC LIMIT :limit", {**params, 'limit': -1 if limit is None else limit}
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    logging.info(f"Balance reconciliation ({mode}) for guild {guild_id}: {events} events, {payouts} payouts, "
+                 f"{drifted_count} drifted users ({drift_total:+.2f} USDT) in {elapsed:.3f}s.")
+    return {'mode': mode, 'events': events, 'payouts': payouts, 'drifted': drifted, 'drifted_count': drifted_count,
+            'drift_total': float(drift_total), 'seconds': elapsed}
+
+
+def guild_ids() -> list[int]:
+    """库中有用户数据的服务器（定时对账时逐个处理）。"""
+    conn = sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT guild_id FROM users")]
+    finally:
+        conn.close()
+
+
+def drift_csv(drifted) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('user_id', 'username', 'balance', 'credits', 'payouts', 'expected', 'drift'))
+    for user_id, username, balance, credits, payouts, drift in drifted:
+        writer.writerow((user_id, username or '', round(balance, 2), round(credits, 2), round(payouts, 2),
+                         round(credits - payouts, 2), round(drift, 2)))
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="核对用户余额与佣金流水/结算记录")
+    parser.add_argument('--guild', type=int, default=None, help="服务器ID（默认 DEFAULT_GUILD_ID）")
+    parser.add_argument('--full', action='store_true', help="忽略高水位，全量重建累计值")
+    parser.add_argument('--tolerance', type=float, default=BALANCE_DRIFT_TOLERANCE)
+    parser.add_argument('--csv', default=None, help="将偏差用户写入 CSV 文件")
+    parser.add_argument('--limit', type=int, default=20, help="输出的偏差用户数")
+    args = parser.parse_args()
+    from config import DEFAULT_GUILD_ID
+    from database import Database
+
+    # 确保已建表/迁移
+    with Database():
+        pass
+    guild_id = args.guild if args.guild is not None else DEFAULT_GUILD_ID
+    result = reconcile(guild_id, full=args.full, tolerance=args.tolerance, limit=None if args.csv else args.limit)
+    print(f"{result['mode']}: {result['events']} new events, {result['payouts']} new payouts, "
+          f"{result['drifted_count']} drifted users ({result['drift_total']:+.2f} USDT) in {result['seconds']:.3f}s")
+    for user_id, username, balance, credits, payouts, drift in result['drifted'][:args.limit]:
+        print(f"  {user_id:>20}  balance={balance:.2f}  expected={credits - payouts:.2f}  drift={drift:+.2f}  {username or ''}")
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            f.write(drift_csv(result['drifted']))
+
+
+if __name__ == '__main__':
+    main()
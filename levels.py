@@ -0,0 +1,125 @@
+"""可热更新的等级配置。
+
+等级（价格、佣金比例、角色）保存在不可变的 LevelSnapshot 中，bot.py 的所有查询都通过 current() 取当前快照；
+配置变化时构造新快照并整体替换引用（原子切换），正在处理的事件继续使用它开始时取到的快照。
+设置 LEVELS_CONFIG_FILE（与 LEVELS_CONFIG 相同的 JSON 格式）后，文件修改会被轮询检测并自动加载，
+也可由管理员指令 /reload_levels 立即加载；未设置时沿用启动时从环境变量解析的配置。
+每个快照有基于内容的版本号，写入 referral_events.config_version，便于追溯佣金由哪一版配置计算。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from types import MappingProxyType
+
+from config import (
+    LEVELS_CONFIG,
+    LEVELS_CONFIG_FILE,
+    LEVELS_RELOAD_INTERVAL,
+    LevelConfig,
+    parse_levels_config,
+)
+
+
+class LevelSnapshot:
+    """一版等级配置的只读视图。"""
+
+    __slots__ = ('levels', 'role_to_level', 'paid_role_ids', 'tier_price', 'version', 'source', 'loaded_at')
+
+    def __init__(self, levels: list[LevelConfig], source: str):
+        ordered = tuple(sorted(levels, key=lambda level: level.tier))
+        role_to_level = {}
+        for level in ordered:
+            for role_id in level.role_ids:
+                role_to_level[role_id] = level
+        object.__setattr__(self, 'levels', ordered)
+        object.__setattr__(self, 'role_to_level', MappingProxyType(role_to_level))
+        object.__setattr__(self, 'paid_role_ids', frozenset(role_to_level))
+        object.__setattr__(self, 'tier_price', MappingProxyType({level.tier: level.price for level in ordered}))
+        object.__setattr__(self, 'version', hashlib.sha256(self.to_json().encode('utf-8')).hexdigest()[:12])
+        object.__setattr__(self, 'source', source)
+        object.__setattr__(self, 'loaded_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LevelSnapshot is immutable")
+
+    def to_json(self) -> str:
+        items = []
+        for level in self.levels:
+            item = {'name': level.name, 'tier': level.tier, 'role_ids': list(level.role_ids),
+                    'commission': level.commission, 'price': level.price}
+            # 未设置有效期时不写入，保持旧配置的版本号不变
+            if level.period_days:
+                item['period_days'] = level.period_days
+            items.append(item)
+        return json.dumps(items, ensure_ascii=False, sort_keys=True)
+
+    def level_for_role(self, role_id: int | None) -> LevelConfig | None:
+        return self.role_to_level.get(role_id) if role_id else None
+
+
+_current = LevelSnapshot(LEVELS_CONFIG, 'env')
+_file_mtime: float | None = None
+
+
+def current() -> LevelSnapshot:
+    return _current
+
+
+def _persist(snapshot: LevelSnapshot):
+    try:
+        from database import Database
+        with Database() as db:
+            db.record_level_config(snapshot.version, snapshot.to_json(), snapshot.source, snapshot.loaded_at)
+    except Exception as exc:
+        logging.error(f"Failed to record level config version {snapshot.version}: {exc}")
+
+
+def reload(path: str | None = None) -> tuple[bool, LevelSnapshot]:
+    """从 LEVELS_CONFIG_FILE 重新加载；内容无变化时不切换。解析失败或为空时保留旧快照并抛出 ValueError。"""
+    global _current, _file_mtime
+    path = path or LEVELS_CONFIG_FILE
+    if not path:
+        raise ValueError("LEVELS_CONFIG_FILE is not set")
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    _file_mtime = os.path.getmtime(path)
+    parsed = parse_levels_config(text)
+    if not parsed:
+        raise ValueError(f"no valid levels in {path}")
+    snapshot = LevelSnapshot(parsed, path)
+    if snapshot.version == _current.version:
+        return False, _current
+    previous, _current = _current, snapshot
+    _persist(snapshot)
+    logging.info(f"Level config switched {previous.version} -> {snapshot.version} ({len(snapshot.levels)} levels from {path}).")
+    return True, snapshot
+
+
+def load_initial():
+    """启动时：配置了文件则以文件为准，否则记录环境变量配置的版本。"""
+    if LEVELS_CONFIG_FILE and os.path.exists(LEVELS_CONFIG_FILE):
+        try:
+            reload()
+            return
+        except Exception as exc:
+            logging.error(f"Failed to load {LEVELS_CONFIG_FILE}, keeping environment levels: {exc}")
+    _persist(_current)
+
+
+async def watch_file(interval: float = LEVELS_RELOAD_INTERVAL):
+    """轮询 LEVELS_CONFIG_FILE 的修改时间，变化时自动重新加载。"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.path.getmtime(LEVELS_CONFIG_FILE)
+        except OSError:
+            continue
+        if mtime == _file_mtime:
+            continue
+        try:
+            reload()
+        except Exception as exc:
+            logging.error(f"Level config reload failed, keeping version {_current.version}: {exc}")
@@ -0,0 +1,111 @@
+"""事件循环卡顿看门狗。
+
+循环内的 ticker 任务按固定间隔休眠并测量实际调度延迟（loop lag），写入 metrics（/perfstats 与 /metrics 可见）；
+辅助线程监视 ticker 的心跳，一旦超过 LOOP_LAG_THRESHOLD_MS 仍未更新，就从外部抓取事件循环线程当前的调用栈，
+记录正在阻塞循环的处理函数和代码行（同步 SQLite 调用、大列表渲染等）。
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+from config import LOOP_LAG_THRESHOLD_MS
+
+watchdog_log = logging.getLogger('commission.watchdog')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 计时/追踪用的包装层（metrics.timed_handler 的 wrapper、sqltrace 游标等）不是处理函数，也不是阻塞位置
+_INSTRUMENTATION_FILES = {os.path.join(BASE_DIR, name) for name in ('loop_watchdog.py', 'metrics.py', 'sqltrace.py')}
+
+
+def _blocking_site(frames: list[traceback.FrameSummary]) -> tuple[str, str]:
+    """从调用栈中找出本项目代码：事件循环回调之后最外层的函数视为处理函数，最内层的行视为阻塞位置。"""
+    # 跳过 bot.run()/asyncio.run() 等外层帧，只看当前正在执行的回调（Handle._run）之内的部分
+    for index in range(len(frames) - 1, -1, -1):
+        if frames[index].filename.endswith(os.path.join('asyncio', 'events.py')):
+            frames = frames[index + 1:]
+            break
+    ours = [
+        f for f in frames
+        if os.path.abspath(f.filename).startswith(BASE_DIR) and os.path.abspath(f.filename) not in _INSTRUMENTATION_FILES
+    ]
+    if not ours:
+        return "?", f"{frames[-1].filename}:{frames[-1].lineno}" if frames else "?"
+    handler = ours[0].name
+    innermost = ours[-1]
+    return handler, f"{os.path.basename(innermost.filename)}:{innermost.lineno} in {innermost.name}"
+
+
+class LoopWatchdog:
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.1,
+                 threshold: float = LOOP_LAG_THRESHOLD_MS / 1000.0):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._reported_tick = None
+        self._stopped = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        """须在事件循环线程中调用（例如 setup_hook 内）。"""
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._task = self.loop.create_task(self._tick(), name='loop-watchdog')
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        watchdog_log.info("Event loop watchdog started (threshold %.0fms).", self.threshold * 1000)
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _tick(self):
+        while not self._stopped.is_set():
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - start - self.interval, 0.0)
+            self.last_tick = now
+            metrics.observe('loop_lag_seconds', lag)
+            if lag >= self.threshold:
+                metrics.inc('loop_stalls_total')
+                watchdog_log.warning("Event loop was blocked for %.0fms.", lag * 1000)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            tick = self.last_tick
+            stalled = time.monotonic() - tick - self.interval
+            if stalled < self.threshold or self._reported_tick == tick:
+                continue
+            # 每次卡顿只抓取一次调用栈
+            self._reported_tick = tick
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)
+            handler, site = _blocking_site(frames)
+            metrics.inc('loop_blocking_sites_total', handler=handler, site=site)
+            watchdog_log.warning(
+                "Event loop blocked for %.0fms so far in %s at %s. Stack:\n%s",
+                stalled * 1000, handler, site, "".join(traceback.format_list(frames[-15:])),
+            )
+
+
+_watchdog: LoopWatchdog | None = None
+
+
+def start(loop: asyncio.AbstractEventLoop | None = None) -> LoopWatchdog:
+    """启动进程级单例看门狗（重复调用无副作用）。"""
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = LoopWatchdog(loop or asyncio.get_running_loop())
+        _watchdog.start()
+    return _watchdog
@@ -0,0 +1,339 @@
+"""进程内性能指标：计数器与延迟直方图。
+
+覆盖三类热点：事件/按钮/斜杠指令处理函数（handler）、Database 方法（db）以及发往 Discord 的
+REST 调用（rest）；另外统计交互首次响应（ACK）是否超出 Discord 的 3 秒窗口。
+数据通过管理员指令 /perfstats 查看，或在设置 METRICS_PORT 时以 Prometheus 文本格式从本地 HTTP 端点导出。
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import discord
+from discord import app_commands
+
+from config import METRICS_HOST, METRICS_PORT
+
+# Discord 要求交互在 3 秒内得到首次响应，否则令牌失效（10062 Unknown interaction）
+INTERACTION_ACK_WINDOW = 3.0
+
+# 直方图桶上限（秒），覆盖从本地 SQLite 查询到慢 REST 调用的范围
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 当前正在执行的处理函数名，用于把 REST 调用归属到发起它的 handler（asyncio 任务各自复制上下文）
+current_handler: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_handler', default=None)
+
+_lock = threading.Lock()
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Histogram:
+    """固定桶直方图（供 Prometheus 导出）+ 最近样本窗口（供 /perfstats 计算分位数）。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, pct: float) -> float:
+        return percentile(list(self.recent), pct)
+
+
+# 指标注册表：name -> {labels(tuple of (k, v)) -> Counter/Histogram}
+counters: dict[str, dict[tuple, Counter]] = {}
+histograms: dict[str, dict[tuple, Histogram]] = {}
+
+_HELP = {
+    'handler_latency_seconds': '处理函数耗时',
+    'handler_errors_total': '处理函数异常次数',
+    'db_latency_seconds': 'Database 方法耗时',
+    'db_errors_total': 'Database 方法异常次数',
+    'rest_latency_seconds': 'Discord REST 调用耗时',
+    'rest_calls_total': '按处理函数统计的 REST 调用次数',
+    'interaction_ack_seconds': '交互创建到首次响应的耗时',
+    'interaction_ack_missed_total': '超出 3 秒窗口或令牌已失效的交互次数',
+    'loop_lag_seconds': '事件循环调度延迟',
+    'loop_stalls_total': '调度延迟超过阈值的次数',
+    'loop_blocking_sites_total': '看门狗捕获到的阻塞位置',
+    'backups_total': '在线备份次数',
+    'backup_duration_seconds': '在线备份耗时',
+    'fraud_flags_total': '疑似刷邀请的标记次数',
+    'component_clicks_total': '按操作与结果（执行/合并/拒绝）统计的按钮点击次数',
+    'panel_cache_requests_total': '面板渲染缓存的命中/未命中次数',
+    'report_jobs_total': '按报表与结果（完成/失败/超时/忙）统计的报表任务次数',
+    'report_duration_seconds': '报表任务耗时（含进程启动）',
+}
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: int = 1, **labels):
+    with _lock:
+        counters.setdefault(name, {}).setdefault(_key(labels), Counter()).inc(amount)
+
+
+def observe(name: str, value: float, **labels):
+    with _lock:
+        histograms.setdefault(name, {}).setdefault(_key(labels), Histogram()).observe(value)
+
+
+def reset():
+    with _lock:
+        counters.clear()
+        histograms.clear()
+
+
+@contextmanager
+def track(handler: str):
+    """统计一段处理逻辑的耗时与异常，并将其间的 REST 调用归属到该 handler。"""
+    token = current_handler.set(handler)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc('handler_errors_total', handler=handler)
+        raise
+    finally:
+        observe('handler_latency_seconds', time.perf_counter() - start, handler=handler)
+        current_handler.reset(token)
+
+
+def timed_handler(name=None):
+    """事件处理协程装饰器（放在 @bot.event 之下，保留原函数名供 discord.py 识别事件）。
+    name 可为字符串，或根据参数返回标签的函数（返回 None 表示本次不统计）。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            handler = name(*args, **kwargs) if callable(name) else (name or func.__name__)
+            if handler is None:
+                return await func(*args, **kwargs)
+            with track(handler):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_methods(prefix: str = 'db', exclude=('close',)):
+    """类装饰器：为所有公开方法记录耗时与异常（标签 method=<方法名>）。"""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or attr in exclude or not callable(value):
+                continue
+            setattr(cls, attr, _timed_method(prefix, value))
+        return cls
+    return decorator
+
+
+def _timed_method(prefix: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            inc(f'{prefix}_errors_total', method=func.__name__)
+            raise
+        finally:
+            observe(f'{prefix}_latency_seconds', time.perf_counter() - start, method=func.__name__)
+    return wrapper
+
+
+def record_rest(route: str, elapsed: float):
+    observe('rest_latency_seconds', elapsed, route=route)
+    inc('rest_calls_total', handler=current_handler.get() or 'other', route=route)
+
+
+def record_ack(interaction_id: int, missed: bool = False):
+    """记录交互从创建（雪花时间）到首次响应完成的耗时。"""
+    elapsed = (discord.utils.utcnow() - discord.utils.snowflake_time(interaction_id)).total_seconds()
+    observe('interaction_ack_seconds', max(elapsed, 0.0))
+    if missed or elapsed > INTERACTION_ACK_WINDOW:
+        inc('interaction_ack_missed_total')
+
+
+class MetricsCommandTree(app_commands.CommandTree):
+    """斜杠指令耗时统计：interaction_check 记录开始时间，完成/出错时写入 slash.<指令名>。"""
+
+    async def interaction_check(self, interaction: discord.Interaction, /) -> bool:
+        if interaction.command is not None:
+            interaction.extras['metrics_start'] = time.perf_counter()
+            current_handler.set(f"slash.{interaction.command.qualified_name}")
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError, /) -> None:
+        finish_command(interaction, failed=True)
+        await super().on_error(interaction, error)
+
+
+def finish_command(interaction: discord.Interaction, failed: bool = False):
+    start = interaction.extras.pop('metrics_start', None)
+    if start is None or interaction.command is None:
+        return
+    handler = f"slash.{interaction.command.qualified_name}"
+    observe('handler_latency_seconds', time.perf_counter() - start, handler=handler)
+    if failed:
+        inc('handler_errors_total', handler=handler)
+
+
+def install_rest_instrumentation(http):
+    """包装 bot.http.request 与交互 webhook 适配器，统计每个 REST 路由的耗时与调用次数。"""
+    if getattr(http, '_metrics_installed', False):
+        return
+    original = http.request
+
+    async def request(route, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(route, **kwargs)
+        finally:
+            record_rest(f"{route.method} {route.path}", time.perf_counter() - start)
+
+    http.request = request
+    http._metrics_installed = True
+
+    # 交互响应与 followup 不经过 bot.http，而是走 webhook 适配器
+    from discord.webhook.async_ import AsyncWebhookAdapter
+    if getattr(AsyncWebhookAdapter, '_metrics_installed', False):
+        return
+    adapter_request = AsyncWebhookAdapter.request
+    create_response = AsyncWebhookAdapter.create_interaction_response
+
+    async def webhook_request(self, route, session, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await adapter_request(self, route, session, **kwargs)
+        finally:
+            record_rest(f"{route.method} {route.path}", time.perf_counter() - start)
+
+    async def create_interaction_response(self, interaction_id, token, **kwargs):
+        try:
+            result = await create_response(self, interaction_id, token, **kwargs)
+        except discord.NotFound:
+            record_ack(interaction_id, missed=True)
+            raise
+        record_ack(interaction_id)
+        return result
+
+    AsyncWebhookAdapter.request = webhook_request
+    AsyncWebhookAdapter.create_interaction_response = create_interaction_response
+    AsyncWebhookAdapter._metrics_installed = True
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP commission_{name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE commission_{name} counter")
+            for key, counter in sorted(series.items()):
+                lines.append(f"commission_{name}{_labels(key)} {counter.value}")
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP commission_{name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE commission_{name} histogram")
+            for key, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.bucket_counts):
+                    cumulative += count
+                    lines.append(f"commission_{name}_bucket{_labels(key, (('le', bound),))} {cumulative}")
+                lines.append(f"commission_{name}_bucket{_labels(key, (('le', '+Inf'),))} {hist.count}")
+                lines.append(f"commission_{name}_sum{_labels(key)} {hist.sum}")
+                lines.append(f"commission_{name}_count{_labels(key)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary_rows(name: str, label: str, limit: int = 10, sort_by: str = 'total') -> list[str]:
+    """/perfstats 使用的文本行：按累计耗时（或 p99）排序的前 limit 项。"""
+    with _lock:
+        series = [(dict(key).get(label, '-'), hist) for key, hist in histograms.get(name, {}).items()]
+        rows = [(value, hist.count, hist.sum, hist.mean, hist.quantile(50), hist.quantile(99)) for value, hist in series]
+    rows.sort(key=lambda r: r[5] if sort_by == 'p99' else r[2], reverse=True)
+    return [
+        f"`{value}` n={count} avg={mean * 1000:.1f}ms p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms"
+        for value, count, _, mean, p50, p99 in rows[:limit]
+    ]
+
+
+def counter_total(name: str, **labels) -> int:
+    with _lock:
+        return sum(
+            c.value for key, c in counters.get(name, {}).items()
+            if all(dict(key).get(k) == v for k, v in labels.items())
+        )
+
+
+def rest_calls_by_handler(limit: int = 10) -> list[str]:
+    totals: dict[str, int] = {}
+    with _lock:
+        for key, counter in counters.get('rest_calls_total', {}).items():
+            handler = dict(key).get('handler', 'other')
+            totals[handler] = totals.get(handler, 0) + counter.value
+    ordered = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return [f"`{handler}` {count} 次" for handler, count in ordered[:limit]]
+
+
+async def start_http_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """在当前事件循环（即 bot 自身的 aiohttp 循环）上启动 /metrics 端点；port 为 0 时不启动。"""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
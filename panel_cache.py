@@ -0,0 +1,100 @@
+"""面板渲染缓存：缓存“查看佣金”“查看记录”按钮生成的回复（embed 列表），按用户 LRU 淘汰。
+
+渲染一次需要若干数据库查询、逐个解析受邀成员当前角色（可能 fetch_member）、逐行格式化与分块，
+而这些数据只在该用户获得/失去受邀成员、产生佣金、被结算，或其受邀成员角色变化时才会改变。
+因此由 bot.py 在 on_member_join / on_member_update / on_member_remove / 结算等路径显式失效相关用户：
+- 以 (服务器, 用户) 为 LRU 单位，超过 PANEL_CACHE_SIZE 个用户时淘汰最久未使用的
+- 条目记录生成时的等级配置版本，热更新后自然失效；PANEL_CACHE_TTL_SECONDS 作为兜底（如离线工具直接改库）
+- 渲染期间发生的失效会使本次结果不写入缓存，避免把旧数据存回去
+命中/未命中按操作计入 panel_cache_requests_total，命中率在 /perfstats 中查看。
+"""
+import functools
+import time
+from collections import OrderedDict
+
+from config import PANEL_CACHE_SIZE, PANEL_CACHE_TTL_SECONDS
+import levels
+import metrics
+
+
+class PanelCache:
+    def __init__(self, max_users: int = PANEL_CACHE_SIZE, ttl: float = PANEL_CACHE_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl = ttl
+        # (guild_id, user_id) -> {action: (config_version, expires_at, messages)}
+        self._entries: OrderedDict[tuple[int, int], dict[str, tuple]] = OrderedDict()
+        # 正在渲染的 (guild_id, user_id, action) -> 令牌；失效时移除，渲染结束时令牌不符则不写入
+        self._pending: dict[tuple[int, int, str], object] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, guild_id: int, user_id: int, action: str):
+        entry = self._entries.get((guild_id, user_id))
+        cached = entry.get(action) if entry else None
+        if cached is None:
+            return None
+        version, expires_at, messages = cached
+        if version != levels.current().version or (self.ttl and expires_at <= time.monotonic()):
+            del entry[action]
+            return None
+        self._entries.move_to_end((guild_id, user_id))
+        return messages
+
+    def put(self, guild_id: int, user_id: int, action: str, messages):
+        if self.max_users <= 0:
+            return
+        key = (guild_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {}
+        else:
+            self._entries.move_to_end(key)
+        entry[action] = (levels.current().version, time.monotonic() + self.ttl, messages)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, guild_id: int, *user_ids):
+        """丢弃这些用户的所有面板（None 会被忽略）。"""
+        for user_id in user_ids:
+            if user_id is None:
+                continue
+            self._entries.pop((guild_id, user_id), None)
+            for key in [key for key in self._pending if key[0] == guild_id and key[1] == user_id]:
+                del self._pending[key]
+
+    def clear(self, guild_id: int | None = None):
+        """丢弃某个服务器（None 为全部）的所有面板，用于批量改动（补发漏发佣金、归档等）之后。"""
+        if guild_id is None:
+            self._entries.clear()
+            self._pending.clear()
+            return
+        for key in [key for key in self._entries if key[0] == guild_id]:
+            del self._entries[key]
+        for key in [key for key in self._pending if key[0] == guild_id]:
+            del self._pending[key]
+
+    def cached(self, action: str):
+        """装饰器：async def render(interaction) -> list[dict] 的结果按交互用户缓存。"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(interaction):
+                guild_id, user_id = interaction.guild_id, interaction.user.id
+                messages = self.get(guild_id, user_id, action)
+                if messages is not None:
+                    metrics.inc('panel_cache_requests_total', action=action, result='hit')
+                    return messages
+                metrics.inc('panel_cache_requests_total', action=action, result='miss')
+                key = (guild_id, user_id, action)
+                token = self._pending[key] = object()
+                try:
+                    messages = await func(interaction)
+                finally:
+                    valid = self._pending.get(key) is token
+                    if valid:
+                        del self._pending[key]
+                if valid:
+                    self.put(guild_id, user_id, action, messages)
+                return messages
+            return wrapper
+        return decorator
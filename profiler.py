@@ -0,0 +1,56 @@
+"""运行中按需采集 cProfile（由管理员指令 /profile 触发）。
+
+cProfile 只统计调用 enable() 的线程，而所有事件处理都运行在事件循环线程上，因此在循环内启用即可覆盖
+正常流量；采集时长有上限，并用锁保证同一时间只有一个采集，以限制额外开销。完整 pstats 文件保存在日志目录下，
+可用 `python -m pstats <文件>` 或 snakeviz 等工具进一步分析。
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+from datetime import datetime
+
+from config import LOG_FILE, PROFILE_MAX_SECONDS
+
+PROFILE_DIR = os.path.dirname(LOG_FILE) or '.'
+
+_lock = asyncio.Lock()
+
+
+def is_running() -> bool:
+    return _lock.locked()
+
+
+def top_functions(stats: pstats.Stats, limit: int = 15, sort_by: str = 'cumulative') -> list[str]:
+    """按 sort_by 排序的前 limit 个函数：累计耗时、自身耗时、调用次数与位置。"""
+    stats.sort_stats(sort_by)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        cc, nc, tt, ct, _ = stats.stats[func]
+        filename, lineno, name = func
+        location = f"{os.path.basename(filename)}:{lineno}" if lineno else filename
+        calls = f"{nc}/{cc}" if nc != cc else str(nc)
+        rows.append(f"{ct * 1000:8.1f}ms {tt * 1000:8.1f}ms {calls:>7} {name} ({location})")
+    return rows
+
+
+async def capture(seconds: float, sort_by: str = 'cumulative', limit: int = 15) -> tuple[str, list[str], float]:
+    """采集 seconds 秒（不超过 PROFILE_MAX_SECONDS），返回 (pstats 文件路径, 摘要行, 总耗时)。
+    已有采集在进行时抛出 RuntimeError。
+    """
+    if _lock.locked():
+        raise RuntimeError("profile capture already running")
+    async with _lock:
+        seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.pstats")
+        await asyncio.to_thread(profile.dump_stats, path)
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        return path, top_functions(stats, limit=limit, sort_by=sort_by), stats.total_tt
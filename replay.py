@@ -0,0 +1,308 @@
+"""回放 capture.py 录制的网关事件，复现生产中的事件序列（加入潮、支付机器人批量授予角色、重连重放等）。
+
+回放在本地进行：服务器/成员/邀请由录制中的快照重建为 fakes.py 中的替身，REST 调用由带限速的 FakeRest 代替；
+数据库使用临时文件（可选从生产库快照复制）。事件按原始间隔（或 --speed 倍速）作为独立任务派发给 bot.py 中的
+真实处理函数，结束后报告端到端延迟、限速命中次数以及回放前后的数据库差异。
+
+    python replay.py captures/events.jsonl --speed 10
+    python replay.py captures/events.jsonl --db affiliate_system.db --speed 0 --global-limit 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import deque
+
+HANDLED_EVENTS = ('member_join', 'member_update', 'member_remove', 'interaction')
+
+
+def load_records(path: str) -> list[dict]:
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 进程被强杀时最后一行可能不完整
+                print(f"Skipping malformed line {line_no}", file=sys.stderr)
+    records.sort(key=lambda r: r['t'])
+    return records
+
+
+def attach_invite_usage(records: list[dict]):
+    """根据加入后录制的 invite_uses 变化，为每个 member_join 标注所使用的邀请码（按顺序逐个认领）。"""
+    uses: dict[int, dict[str, int]] = {}
+    pending: dict[int, deque] = {}
+    for record in records:
+        guild_id = record['g']
+        if record['e'] == 'guild':
+            uses[guild_id] = {code: count for code, _, _, count in record['invites']}
+        elif record['e'] == 'member_join':
+            pending.setdefault(guild_id, deque()).append(record)
+        elif record['e'] == 'invite_uses':
+            state = uses.setdefault(guild_id, {})
+            waiting = pending.setdefault(guild_id, deque())
+            for code, count in record['uses'].items():
+                for _ in range(max(count - state.get(code, 0), 0)):
+                    if waiting:
+                        waiting.popleft()['invite'] = code
+                state[code] = count
+            for code in record.get('removed', []):
+                state.pop(code, None)
+
+
+def db_state(path: str) -> dict:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+        balances = {}
+        commissions = {}
+        if 'users' in tables:
+            balances = {(g, u): b or 0.0 for g, u, b in conn.execute("SELECT guild_id, user_id, reward_balance FROM users")}
+        if 'referral_events' in tables:
+            commissions = {
+                (g, u): total or 0.0
+                for g, u, total in conn.execute(
+                    "SELECT guild_id, inviter_id, SUM(commission_amount) FROM referral_events GROUP BY guild_id, inviter_id"
+                )
+            }
+        return {'counts': counts, 'balances': balances, 'commissions': commissions}
+    finally:
+        conn.close()
+
+
+def diff_states(before: dict, after: dict, limit: int = 10) -> list[str]:
+    lines = []
+    for table in sorted(set(before['counts']) | set(after['counts'])):
+        old, new = before['counts'].get(table, 0), after['counts'].get(table, 0)
+        if old != new:
+            lines.append(f"  {table}: {old} -> {new} ({new - old:+d})")
+    for title, key in (("reward_balance", 'balances'), ("commission", 'commissions')):
+        changes = []
+        for ident in set(before[key]) | set(after[key]):
+            delta = after[key].get(ident, 0.0) - before[key].get(ident, 0.0)
+            if abs(delta) > 1e-9:
+                changes.append((delta, ident))
+        if changes:
+            changes.sort(key=lambda item: abs(item[0]), reverse=True)
+            lines.append(f"  {title} changed for {len(changes)} users, total {sum(d for d, _ in changes):+.2f} USDT:")
+            for delta, (guild_id, user_id) in changes[:limit]:
+                lines.append(f"    guild {guild_id} user {user_id}: {delta:+.2f}")
+    return lines or ["  (no changes)"]
+
+
+class ReplayWorld:
+    """由录制快照重建的本地服务器集合。"""
+
+    def __init__(self, rest):
+        self.rest = rest
+        self.guilds = {}
+
+    def guild(self, guild_id: int, name: str | None = None):
+        import levels
+        from config import ALLOWED_CHANNEL_IDS, INVITE_NOTIFICATION_CHANNEL_ID, COMMISSION_NOTIFICATION_CHANNEL_ID
+        from fakes import FakeGuild
+
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = FakeGuild(guild_id, name=name or f"Guild {guild_id}", rest=self.rest)
+            for channel_id in {INVITE_NOTIFICATION_CHANNEL_ID, COMMISSION_NOTIFICATION_CHANNEL_ID, *ALLOWED_CHANNEL_IDS}:
+                guild.add_channel(channel_id)
+            for level in levels.current().levels:
+                for role_id in level.role_ids:
+                    guild.add_role(role_id, level.name)
+            self.guilds[guild_id] = guild
+        return guild
+
+    def member(self, guild, snapshot, update_roles: bool = True):
+        from datetime import datetime, timezone
+
+        user_id, name, role_ids, joined_at = snapshot
+        member = guild.get_member(user_id)
+        if member is None:
+            joined = datetime.fromtimestamp(joined_at, timezone.utc) if joined_at else None
+            member = guild.add_member(user_id, name=name, joined_at=joined)
+            update_roles = True
+        if update_roles:
+            member.roles = [guild.get_role(r) or guild.add_role(r, str(r)) for r in role_ids]
+        return member
+
+    def apply_guild(self, record: dict):
+        guild = self.guild(record['g'], record.get('name'))
+        for role_id, role_name in record.get('roles', []):
+            guild.add_role(role_id, role_name)
+        for channel_id in record.get('channels', []):
+            guild.add_channel(channel_id)
+        for snapshot in record.get('inviters', []):
+            self.member(guild, snapshot)
+        guild._invites.clear()
+        for code, inviter_id, channel_id, uses in record.get('invites', []):
+            channel = guild.add_channel(channel_id) if channel_id else None
+            guild.add_invite(code, guild.get_member(inviter_id) if inviter_id else None, channel, uses)
+        return guild
+
+
+async def dispatch(world: ReplayWorld, record: dict):
+    """把一条录制事件还原为替身对象，并调用对应的真实处理函数。"""
+    import bot
+    from fakes import FakeInteraction
+
+    guild = world.guild(record['g'])
+    event = record['e']
+    if event == 'member_join':
+        member = world.member(guild, record['m'])
+        code = record.get('invite')
+        if code:
+            if code not in guild._invites:
+                guild.add_invite(code, None, None)
+            guild.use_invite(code)
+        await bot.on_member_join(member)
+    elif event == 'member_update':
+        after = world.member(guild, record['m'], update_roles=False)
+        before = after.snapshot()
+        before.roles = [guild.get_role(r) or guild.add_role(r, str(r)) for r in record['before']]
+        after.roles = [guild.get_role(r) or guild.add_role(r, str(r)) for r in record['m'][2]]
+        await bot.on_member_update(before, after)
+    elif event == 'member_remove':
+        member = world.member(guild, record['m'])
+        guild.remove_member(member.id)
+        await bot.on_member_remove(member)
+    elif event == 'interaction':
+        member = world.member(guild, record['m'])
+        channel = guild.add_channel(record['channel']) if record.get('channel') else None
+        await bot.on_interaction(FakeInteraction(member, channel, record.get('custom_id')))
+
+
+async def replay(records: list[dict], speed: float, rest) -> dict:
+    import bot
+    import metrics
+
+    world = ReplayWorld(rest)
+    samples: dict[str, list[float]] = {event: [] for event in HANDLED_EVENTS}
+    errors: dict[str, int] = {}
+    tasks = []
+
+    async def run(record, scheduled):
+        try:
+            await dispatch(world, record)
+        except Exception as exc:
+            errors[record['e']] = errors.get(record['e'], 0) + 1
+            print(f"{record['e']} failed: {exc!r}", file=sys.stderr)
+        samples[record['e']].append(time.perf_counter() - scheduled)
+
+    loop_start = time.perf_counter()
+    base = records[0]['t'] if records else 0.0
+    for record in records:
+        if speed > 0:
+            target = loop_start + (record['t'] - base) / speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        scheduled = time.perf_counter()
+        event = record['e']
+        if event == 'guild':
+            # 启动/重连快照：重建现场并像 on_ready 一样预热邀请缓存
+            await bot._prime_guild(world.apply_guild(record))
+        elif event == 'invite_create':
+            guild = world.guild(record['g'])
+            inviter = guild.get_member(record['inviter']) if record.get('inviter') else None
+            channel = guild.add_channel(record['channel']) if record.get('channel') else None
+            guild.add_invite(record['code'], inviter, channel)
+        elif event == 'invite_delete':
+            world.guild(record['g'])._invites.pop(record['code'], None)
+        elif event in HANDLED_EVENTS:
+            # 与网关一致：每个事件在独立任务中处理
+            tasks.append(asyncio.create_task(run(record, scheduled)))
+            if speed <= 0:
+                await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - loop_start
+    return {
+        'elapsed': elapsed,
+        'events': sum(len(v) for v in samples.values()),
+        'latency': {
+            event: {
+                'n': len(values),
+                'p50_ms': metrics.percentile(values, 50) * 1000,
+                'p99_ms': metrics.percentile(values, 99) * 1000,
+                'max_ms': max(values) * 1000 if values else 0.0,
+            }
+            for event, values in samples.items() if values
+        },
+        'errors': errors,
+        'rest_calls': rest.total_calls,
+        'rate_limited': dict(rest.rate_limited),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放录制的网关事件")
+    parser.add_argument('capture', help="capture.py 录制的 JSON Lines 文件")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速；0 表示不等待、尽快派发")
+    parser.add_argument('--db', default=None, help="作为起点的数据库快照（复制到临时文件，原文件不变）")
+    parser.add_argument('--rest-latency', type=float, default=0.05, help="每次 REST 调用的模拟延迟（秒）")
+    parser.add_argument('--route-limit', type=int, default=5, help="每个路由每个窗口内的请求上限")
+    parser.add_argument('--route-window', type=float, default=5.0, help="路由限速窗口（秒）")
+    parser.add_argument('--global-limit', type=int, default=50, help="每秒全局请求上限")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.capture)
+    if not records:
+        sys.exit("Capture file is empty.")
+    attach_invite_usage(records)
+
+    fd, db_path = tempfile.mkstemp(prefix='commission-replay-', suffix='.db')
+    os.close(fd)
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    else:
+        os.remove(db_path)
+    # 必须在导入 config 之前设置：回放只写临时库，不经过写入进程，也不再录制
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ.pop('DB_WRITER_ADDRESS', None)
+    os.environ.pop('CAPTURE_FILE', None)
+    try:
+        from database import Database
+        from fakes import FakeRest
+
+        with Database():
+            pass
+        before = db_state(db_path)
+        rest = FakeRest(latency=args.rest_latency, rate_limit=(args.route_limit, args.route_window),
+                        global_limit=args.global_limit)
+        result = asyncio.run(replay(records, args.speed, rest))
+        after = db_state(db_path)
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    diff = diff_states(before, after)
+    if args.json:
+        result['db_diff'] = diff
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+    print(f"events={result['events']} elapsed={result['elapsed']:.2f}s speed={args.speed} "
+          f"rest_calls={result['rest_calls']} rate_limited={sum(result['rate_limited'].values())}")
+    for event, stats in result['latency'].items():
+        print(f"  {event:<14} n={stats['n']:<6} p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms max={stats['max_ms']:.1f}ms")
+    for route, hits in sorted(result['rate_limited'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  rate limited {hits}x: {route}")
+    if result['errors']:
+        print(f"  handler errors: {result['errors']}")
+    print("DB diff:")
+    print("\n".join(diff))
+
+
+if __name__ == '__main__':
+    main()
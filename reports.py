@@ -0,0 +1,247 @@
+"""重型管理员报表：在独立的工作进程中以只读 SQLite 连接执行，不占用 Bot 的事件循环与 GIL。
+
+累计佣金排行榜、数据导出、佣金方案模拟都要扫描整张表，放在线程里执行仍会与网关心跳争抢 GIL。
+ReportService 为每个任务启动一个工作进程（最多 REPORT_MAX_WORKERS 个同时运行），经队列回传进度与结果：
+- 同一种报表同一时间只运行一个，重复发起时抛出 ReportBusy（附带正在运行的任务信息）
+- 进度按 REPORT_PROGRESS_INTERVAL 合并后交给回调（bot.py 用来编辑原始响应）
+- 超过 REPORT_TIME_BUDGET_SECONDS 的任务直接终止其进程并抛出 ReportTimeout；调用方被取消时同样终止
+工作进程以 forkserver（不可用时 spawn）方式启动，不继承 Bot 进程的事件循环、线程与数据库连接；
+任务函数在工作进程中运行，参数与返回值须可 pickle（只用基本类型），文件类结果写入临时文件后返回路径。
+工作进程带 COMMISSION_REPORT_WORKER=1 启动，config 不再打开日志文件；日志记录同样经队列交给 Bot 进程写出。
+按报表与结果计入 report_jobs_total，耗时计入 report_duration_seconds。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler
+
+from config import REPORT_MAX_WORKERS, REPORT_PROGRESS_INTERVAL, REPORT_TIME_BUDGET_SECONDS
+import metrics
+
+REPORT_LABELS = {
+    'leaderboard': '累计佣金排行榜',
+    'export': '数据导出',
+    'simulation': '佣金方案模拟',
+}
+
+
+class ReportBusy(RuntimeError):
+    """同一种报表已在运行。"""
+
+    def __init__(self, kind: str, job: dict):
+        super().__init__(f"report {kind} is already running")
+        self.kind = kind
+        self.job = job
+
+
+class ReportTimeout(RuntimeError):
+    """任务超出时间预算，工作进程已终止。"""
+
+
+# ---- 任务函数（在工作进程中执行） ----
+
+def leaderboard_job(progress, guild_id: int) -> dict:
+    """所有余额>0的用户及其佣金统计，一次聚合查询完成。"""
+    from database import Database
+
+    progress("正在汇总佣金……")
+    with Database(guild_id, read_only=True) as db:
+        rows = db.get_commission_leaderboard()
+    progress(f"已汇总 {len(rows)} 名用户")
+    logging.info(f"Built commission leaderboard for guild {guild_id}: {len(rows)} users.")
+    return {'rows': [(uid, username, float(balance or 0), role_id, float(total), float(settled))
+                     for uid, username, balance, role_id, total, settled in rows]}
+
+
+def export_job(progress, table: str, guild_id: int, path: str, **options) -> dict:
+    """导出到 path（由调用方创建并负责删除）。"""
+    import export
+
+    with open(path, 'wb') as output:
+        result = export.export_table(output, table, guild_id, progress=lambda rows: progress(f"已导出 {rows} 行"),
+                                     **options)
+    result['size'] = os.path.getsize(path)
+    return result
+
+
+def simulation_job(progress, guild_id: int, plans_text: str, current_levels: str | None = None,
+                   current_version: str | None = None) -> dict:
+    """current_levels 为 Bot 当前生效的等级配置（工作进程不共享热更新后的快照）。"""
+    from config import parse_levels_config
+    import simulator
+
+    plans = simulator.load_plans(plans_text)
+    if current_levels:
+        plans.insert(0, simulator.Plan(f"current ({current_version})", parse_levels_config(current_levels)))
+    progress(f"正在加载历史并计算 {len(plans)} 个方案……")
+    history, results, timings = simulator.simulate(guild_id, plans, include_current=False, read_only=True)
+    return {
+        'events': history.events,
+        'inviters': len(history.inviter_ids),
+        'plans': len(results),
+        'table': simulator.format_table(history, results),
+        'csv': simulator.inviter_csv(history, results),
+        'timings': timings,
+    }
+
+
+JOBS = {
+    'leaderboard': leaderboard_job,
+    'export': export_job,
+    'simulation': simulation_job,
+}
+
+
+class _ChannelLogHandler(QueueHandler):
+    """把工作进程的日志记录（已格式化、可 pickle）放入结果队列，由 Bot 进程交给自己的日志处理器。"""
+
+    def enqueue(self, record):
+        self.queue.put(('log', record))
+
+
+def _worker_main(channel, kind: str, params: dict):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_ChannelLogHandler(channel))
+
+    def progress(text: str):
+        channel.put(('progress', text))
+
+    try:
+        channel.put(('done', JOBS[kind](progress, **params)))
+    except Exception as exc:
+        channel.put(('error', f"{type(exc).__name__}: {exc}"))
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    if ctx.get_start_method() == 'forkserver':
+        # forkserver 预先导入本模块（及 config、metrics），之后每个任务只需 fork
+        ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
+@contextmanager
+def _worker_environment():
+    """启动工作进程（首次启动时还包括 forkserver）期间设置 COMMISSION_REPORT_WORKER，子进程据此继承。"""
+    previous = os.environ.get('COMMISSION_REPORT_WORKER')
+    os.environ['COMMISSION_REPORT_WORKER'] = '1'
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['COMMISSION_REPORT_WORKER']
+        else:
+            os.environ['COMMISSION_REPORT_WORKER'] = previous
+
+
+# ---- 调度（在 Bot 进程中执行） ----
+
+class ReportService:
+    def __init__(self, max_workers: int = REPORT_MAX_WORKERS, time_budget: float = REPORT_TIME_BUDGET_SECONDS,
+                 progress_interval: float = REPORT_PROGRESS_INTERVAL, poll_interval: float = 0.1):
+        self.max_workers = max_workers
+        self.time_budget = time_budget
+        self.progress_interval = progress_interval
+        self.poll_interval = poll_interval
+        self._ctx = None
+        self._slots = asyncio.Semaphore(max_workers)
+        # kind -> {'user_id', 'started', 'pid'}
+        self._running: dict[str, dict] = {}
+
+    def running(self) -> dict[str, dict]:
+        return dict(self._running)
+
+    async def run(self, kind: str, params: dict, on_progress=None, user_id: int | None = None,
+                  time_budget: float | None = None):
+        """在工作进程中执行 JOBS[kind](progress, **params) 并返回结果。
+
+        on_progress 为 async def (text)，回调失败不影响任务；任务内异常以 RuntimeError 抛出。
+        """
+        if kind not in JOBS:
+            raise ValueError(f"unknown report: {kind}")
+        job = self._running.get(kind)
+        if job is not None:
+            metrics.inc('report_jobs_total', report=kind, result='busy')
+            raise ReportBusy(kind, job)
+        job = self._running[kind] = {'user_id': user_id, 'started': time.monotonic(), 'pid': None}
+        started = time.perf_counter()
+        result = 'failed'
+        try:
+            if on_progress is not None and self._slots.locked():
+                await self._notify(on_progress, "等待空闲的报表进程……")
+            async with self._slots:
+                value = await self._execute(kind, params, job, on_progress, time_budget or self.time_budget)
+            result = 'ok'
+            return value
+        except ReportTimeout:
+            result = 'timeout'
+            raise
+        finally:
+            del self._running[kind]
+            metrics.inc('report_jobs_total', report=kind, result=result)
+            metrics.observe('report_duration_seconds', time.perf_counter() - started, report=kind)
+
+    async def _execute(self, kind, params, job, on_progress, budget):
+        if self._ctx is None:
+            self._ctx = _context()
+        channel = self._ctx.Queue()
+        process = self._ctx.Process(target=_worker_main, args=(channel, kind, params), name=f"report-{kind}",
+                                    daemon=True)
+        with _worker_environment():
+            process.start()
+        job['pid'] = process.pid
+        deadline = time.monotonic() + budget
+        pending = None
+        last_progress = 0.0
+        try:
+            while True:
+                try:
+                    message = channel.get_nowait()
+                except queue.Empty:
+                    message = None
+                now = time.monotonic()
+                if now >= deadline:
+                    raise ReportTimeout(f"report {kind} exceeded {budget:g}s")
+                if message is None:
+                    if not process.is_alive():
+                        # 进程刚退出时结果可能仍在管道中
+                        try:
+                            message = await asyncio.to_thread(channel.get, True, 1)
+                        except queue.Empty:
+                            raise RuntimeError(f"report worker exited with code {process.exitcode}")
+                    else:
+                        if pending is not None and now - last_progress >= self.progress_interval:
+                            await self._notify(on_progress, pending)
+                            pending, last_progress = None, now
+                        await asyncio.sleep(self.poll_interval)
+                        continue
+                status, payload = message
+                if status == 'log':
+                    logging.getLogger(payload.name).handle(payload)
+                    continue
+                if status == 'done':
+                    return payload
+                if status == 'error':
+                    raise RuntimeError(payload)
+                pending = payload
+        finally:
+            if process.is_alive():
+                process.terminate()
+            await asyncio.to_thread(process.join, 5)
+            channel.close()
+
+    @staticmethod
+    async def _notify(on_progress, text):
+        if on_progress is None:
+            return
+        try:
+            await on_progress(text)
+        except Exception as exc:
+            logging.warning(f"Report progress update failed: {exc}")
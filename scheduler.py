@@ -0,0 +1,84 @@
+"""单任务定时器调度：所有定时器按到期时间放在一个最小堆中，由一个后台任务睡到最早的到期时间再批量触发。
+
+定时器以键（如 (guild_id, user_id)）标识，同一键只保留最新的到期时间；重新调度或取消时不在堆中删除旧条目，
+而是弹出时与当前到期时间比对后丢弃（惰性删除），因此调度/取消都是 O(log n)，数万个待触发定时器也只占一个任务。
+定时器本身的持久化由调用方负责（见 database.py 的 membership_timers），本模块只负责内存中的排序与唤醒。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+# 一次唤醒中连续触发这么多个定时器后让出事件循环，避免积压时长时间占用
+_YIELD_EVERY = 100
+
+
+class TimerScheduler:
+    def __init__(self, handler, name: str = 'timers'):
+        """handler: async def handler(key)，到期时调用；异常只记录日志，不影响其他定时器。"""
+        self.handler = handler
+        self.name = name
+        self._heap: list[tuple[float, int, object]] = []
+        self._due: dict[object, float] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, key, due: float):
+        """按 time.time() 时间戳调度（覆盖同一键之前的调度）。"""
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        # 唤醒调度任务重新计算睡眠时长（批量调度时只会多算一次）
+        self._wakeup.set()
+        # 惰性删除积累过多时重建堆
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(d, next(self._seq), k) for k, d in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, key):
+        self._due.pop(key, None)
+
+    def next_due(self) -> float | None:
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"scheduler:{self.name}")
+
+    async def _run(self):
+        while True:
+            due = self.next_due()
+            self._wakeup.clear()
+            if due is None:
+                await self._wakeup.wait()
+                continue
+            delay = due - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            fired = 0
+            now = time.time()
+            while True:
+                due = self.next_due()
+                if due is None or due > now:
+                    break
+                _, _, key = heapq.heappop(self._heap)
+                del self._due[key]
+                try:
+                    await self.handler(key)
+                except Exception as exc:
+                    logging.error(f"Timer {self.name} {key} failed: {exc}")
+                fired += 1
+                if fired % _YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+            if fired:
+                logging.debug(f"Fired {fired} {self.name} timers, {len(self._due)} pending.")
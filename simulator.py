@@ -0,0 +1,279 @@
+"""佣金方案模拟：在调整等级价格或佣金比例之前，用历史记录估算候选方案“当初会发多少佣金”。
+
+历史（users.role_id、referral_events 中带 role_id 的升级事件）只加载一次并转成列式数组：
+按发生顺序还原每次升级的前后角色，相同 (邀请者, 升级前角色, 升级后角色) 的事件合并为一个键并记录次数。
+每个候选方案只是一组“角色 -> 层级/价格/比例”的查找表，计算规则与 on_member_update 相同：
+层级上升才计佣，金额 = 差价 × 邀请者当前身份的佣金比例（无付费身份时按普通会员），逐笔保留两位小数。
+安装了 numpy 时所有方案在一个批次中向量化计算，否则退回纯 Python 逐键计算（结果相同）。
+
+方案文件为 JSON，等级格式同 LEVELS_CONFIG：
+    {"降价10%": [{"name": "月费会员", "tier": 1, "role_ids": "111", "commission": 20, "price": 90}, ...], ...}
+或 [{"name": "方案A", "levels": [...], "basic_commission": 5}, ...]
+
+    python simulator.py plans.json
+    python simulator.py plans.json --db affiliate_system.db --guild 123456789 --json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖：未安装时使用纯 Python 实现
+    np = None
+
+
+class Plan:
+    """一个候选方案：等级列表与普通会员（无付费身份）邀请者的佣金比例。"""
+
+    __slots__ = ('name', 'levels', 'basic_commission')
+
+    def __init__(self, name: str, levels, basic_commission: float | None = None):
+        from config import ALLOW_BASIC_INVITER, BASIC_INVITE_COMMISSION
+
+        self.name = name
+        self.levels = list(levels)
+        if basic_commission is None:
+            basic_commission = BASIC_INVITE_COMMISSION if ALLOW_BASIC_INVITER else 0
+        self.basic_commission = float(basic_commission)
+
+    def lookup(self) -> dict:
+        return {role_id: level for level in self.levels for role_id in level.role_ids}
+
+
+def load_plans(text: str) -> list[Plan]:
+    """解析方案文件；任一方案没有有效等级时抛出 ValueError。"""
+    from config import parse_levels_config
+
+    data = json.loads(text)
+    if isinstance(data, dict):
+        items = list(data.items())
+    elif isinstance(data, list):
+        items = [(item.get('name') if isinstance(item, dict) else None, item) for item in data]
+    else:
+        raise ValueError("plans must be a JSON object or list")
+    plans = []
+    for index, (name, spec) in enumerate(items, 1):
+        name = str(name or f"plan{index}")
+        if isinstance(spec, dict):
+            levels_data, basic = spec.get('levels', []), spec.get('basic_commission')
+        else:
+            levels_data, basic = spec, None
+        parsed = parse_levels_config(json.dumps(levels_data))
+        if not parsed:
+            raise ValueError(f"plan {name} has no valid levels")
+        plans.append(Plan(name, parsed, basic))
+    if not plans:
+        raise ValueError("no plans given")
+    return plans
+
+
+class History:
+    """升级历史的列式表示（角色与邀请者都映射为连续下标，角色下标 0 表示无付费角色）。"""
+
+    def __init__(self, events, user_roles, actual_totals):
+        role_index = {0: 0}
+        inviter_index = {}
+        last_role = {}
+        keys = defaultdict(int)
+        for inviter_id, member_id, role_id in events:
+            previous = last_role.get(member_id, 0)
+            last_role[member_id] = role_id
+            inviter = inviter_index.setdefault(inviter_id, len(inviter_index))
+            prev_idx = role_index.setdefault(previous, len(role_index))
+            new_idx = role_index.setdefault(role_id, len(role_index))
+            keys[(inviter, prev_idx, new_idx)] += 1
+
+        # 邀请者身份取 users.role_id，未记录时取其自身最近一次升级到的角色
+        current_roles = dict(user_roles)
+        self.inviter_ids = list(inviter_index)
+        self.inviter_roles = [
+            role_index.setdefault(current_roles.get(inviter_id) or last_role.get(inviter_id, 0), len(role_index))
+            for inviter_id in self.inviter_ids
+        ]
+        self.role_ids = list(role_index)
+        self.events = len(events)
+        self.key_inviter = [key[0] for key in keys]
+        self.key_prev = [key[1] for key in keys]
+        self.key_new = [key[2] for key in keys]
+        self.key_count = list(keys.values())
+
+        actual = {inviter_id: float(total or 0) for inviter_id, total in actual_totals}
+        self.actual_total = sum(actual.values())
+        self.actual = [actual.get(inviter_id, 0.0) for inviter_id in self.inviter_ids]
+
+
+def load_history(guild_id: int, read_only: bool = False) -> History:
+    import archive
+    from database import Database
+
+    with Database(guild_id, read_only=read_only) as db:
+        # 已归档的旧流水与热表按 id 合并，保证每个成员的升级顺序正确
+        events = sorted(archive.archived_upgrade_history(guild_id) + db.get_upgrade_history())
+        return History([row[1:] for row in events], db.get_user_role_ids(), db.get_commission_totals())
+
+
+def _tables(history: History, plan: Plan):
+    """方案在历史角色下标上的 (层级, 价格, 比例) 查找表。"""
+    lookup = plan.lookup()
+    tier, price, percent = [], [], []
+    for role_id in history.role_ids:
+        level = lookup.get(role_id)
+        tier.append(level.tier if level else 0)
+        price.append(level.price if level else 0.0)
+        percent.append(level.commission if level else plan.basic_commission)
+    return tier, price, percent
+
+
+def _evaluate_numpy(history: History, plans: list[Plan]):
+    tables = [_tables(history, plan) for plan in plans]
+    tier = np.array([t for t, _, _ in tables], dtype=np.int64)
+    price = np.array([p for _, p, _ in tables], dtype=np.float64)
+    percent = np.array([c for _, _, c in tables], dtype=np.float64)
+    inviter = np.array(history.key_inviter, dtype=np.int64)
+    prev = np.array(history.key_prev, dtype=np.int64)
+    new = np.array(history.key_new, dtype=np.int64)
+    count = np.array(history.key_count, dtype=np.float64)
+    inviter_role = np.array(history.inviter_roles, dtype=np.int64)[inviter]
+
+    # (方案数, 键数) 矩阵：每个键单笔金额 × 次数
+    upgraded = tier[:, new] > tier[:, prev]
+    incremental = np.maximum(price[:, new] - price[:, prev], 0.0)
+    amount = np.where(upgraded, np.round(incremental * percent[:, inviter_role] / 100.0, 2), 0.0) * count
+
+    n_plans, n_inviters = len(plans), len(history.inviter_ids)
+    n_tiers = int(tier.max()) + 1 if tier.size else 1
+    offsets = np.arange(n_plans)[:, None]
+    by_inviter = np.bincount((offsets * n_inviters + inviter).ravel(), weights=amount.ravel(),
+                             minlength=n_plans * n_inviters).reshape(n_plans, n_inviters)
+    by_tier = np.bincount((offsets * n_tiers + tier[:, new]).ravel(), weights=amount.ravel(),
+                          minlength=n_plans * n_tiers).reshape(n_plans, n_tiers)
+    return [
+        (by_inviter[p].tolist(), {t: float(v) for t, v in enumerate(by_tier[p]) if v})
+        for p in range(n_plans)
+    ]
+
+
+def _evaluate_python(history: History, plans: list[Plan]):
+    results = []
+    keys = list(zip(history.key_inviter, history.key_prev, history.key_new, history.key_count))
+    for plan in plans:
+        tier, price, percent = _tables(history, plan)
+        by_inviter = [0.0] * len(history.inviter_ids)
+        by_tier = defaultdict(float)
+        for inviter, prev, new, count in keys:
+            if tier[new] <= tier[prev]:
+                continue
+            incremental = max(price[new] - price[prev], 0.0)
+            amount = round(incremental * percent[history.inviter_roles[inviter]] / 100.0, 2) * count
+            by_inviter[inviter] += amount
+            by_tier[tier[new]] += amount
+        results.append((by_inviter, {t: v for t, v in sorted(by_tier.items()) if v}))
+    return results
+
+
+def evaluate(history: History, plans: list[Plan]) -> list[dict]:
+    """批量计算每个方案的总佣金、按层级与按邀请者的佣金。"""
+    if not history.key_count:
+        raw = [([0.0] * len(history.inviter_ids), {}) for _ in plans]
+    elif np is not None:
+        raw = _evaluate_numpy(history, plans)
+    else:
+        raw = _evaluate_python(history, plans)
+    results = []
+    for plan, (by_inviter, by_tier) in zip(plans, raw):
+        total = sum(by_inviter)
+        changed = sum(1 for sim, act in zip(by_inviter, history.actual) if abs(sim - act) >= 0.005)
+        results.append({
+            'name': plan.name,
+            'total': round(total, 2),
+            'delta': round(total - history.actual_total, 2),
+            'changed_inviters': changed,
+            'by_tier': {int(t): round(v, 2) for t, v in by_tier.items()},
+            'by_inviter': by_inviter,
+        })
+    return results
+
+
+def simulate(guild_id: int, plans: list[Plan], include_current: bool = True,
+             read_only: bool = False) -> tuple[History, list[dict], dict]:
+    """加载历史并计算；include_current 时在最前面加入当前生效的配置作为对照。返回 (历史, 结果, 耗时)。"""
+    import levels
+
+    if include_current:
+        snapshot = levels.current()
+        plans = [Plan(f"current ({snapshot.version})", snapshot.levels)] + list(plans)
+    started = time.perf_counter()
+    history = load_history(guild_id, read_only)
+    loaded = time.perf_counter()
+    results = evaluate(history, plans)
+    finished = time.perf_counter()
+    timings = {'load_seconds': loaded - started, 'evaluate_seconds': finished - loaded}
+    return history, results, timings
+
+
+def format_table(history: History, results: list[dict]) -> list[str]:
+    lines = [
+        f"{'plan':<24}{'total':>12}{'Δ actual':>12}{'Δ%':>8}{'inviters±':>10}  by tier",
+        f"{'actual':<24}{history.actual_total:>12.2f}{'':>12}{'':>8}{'':>10}",
+    ]
+    for r in results:
+        pct = f"{r['delta'] / history.actual_total * 100:+.1f}" if history.actual_total else "-"
+        tiers = " ".join(f"T{t}:{v:.0f}" for t, v in sorted(r['by_tier'].items()))
+        lines.append(f"{r['name'][:23]:<24}{r['total']:>12.2f}{r['delta']:>+12.2f}{pct:>8}{r['changed_inviters']:>10}  {tiers}")
+    return lines
+
+
+def inviter_csv(history: History, results: list[dict]) -> str:
+    """每个邀请者在实际与各方案下的佣金（CSV）。"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['inviter_id', 'actual'] + [r['name'] for r in results])
+    for index, inviter_id in enumerate(history.inviter_ids):
+        writer.writerow([inviter_id, f"{history.actual[index]:.2f}"] + [f"{r['by_inviter'][index]:.2f}" for r in results])
+    return out.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用历史升级记录模拟候选佣金方案")
+    parser.add_argument('plans', help="方案 JSON 文件")
+    parser.add_argument('--db', default=None, help="SQLite 文件路径（默认使用 DATABASE_PATH）")
+    parser.add_argument('--guild', type=int, default=None, help="服务器ID（默认 DEFAULT_GUILD_ID）")
+    parser.add_argument('--no-current', action='store_true', help="不加入当前配置作为对照")
+    parser.add_argument('--csv', default=None, help="将每个邀请者的结果写入 CSV 文件")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出汇总结果")
+    args = parser.parse_args(argv)
+    if args.db:
+        # 必须在导入 config 之前设置
+        os.environ['DATABASE_PATH'] = args.db
+    from config import DEFAULT_GUILD_ID
+
+    with open(args.plans, encoding='utf-8') as f:
+        try:
+            plans = load_plans(f.read())
+        except ValueError as exc:
+            sys.exit(f"Invalid plans file: {exc}")
+    guild_id = args.guild if args.guild is not None else DEFAULT_GUILD_ID
+    history, results, timings = simulate(guild_id, plans, include_current=not args.no_current)
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            f.write(inviter_csv(history, results))
+    if args.json:
+        summary = [{k: v for k, v in r.items() if k != 'by_inviter'} for r in results]
+        print(json.dumps({'events': history.events, 'inviters': len(history.inviter_ids),
+                          'actual_total': round(history.actual_total, 2), 'plans': summary, **timings},
+                         ensure_ascii=False, indent=2))
+        return
+    print(f"guild={guild_id} events={history.events} keys={len(history.key_count)} inviters={len(history.inviter_ids)} "
+          f"load={timings['load_seconds']:.2f}s evaluate={timings['evaluate_seconds']:.3f}s "
+          f"({'numpy' if np is not None else 'python'})")
+    print("\n".join(format_table(history, results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""SQLite 慢查询追踪与按语句形态的耗时画像（SQL_TRACE=true 时启用）。
+
+Database / 写入进程以 TracingConnection 打开连接后，每条语句按“形态”（去掉多余空白、折叠 IN 列表后的 SQL）
+累计调用次数、总耗时、p99、返回行数与 SQLite 虚拟机步数。单次耗时（含游标取数）超过 SQL_SLOW_MS 的语句
+连同绑定参数展开后的 SQL 与 EXPLAIN QUERY PLAN 写入滚动的慢查询日志；汇总可通过 /sqlstats 查看，
+进程退出时也会写入日志。
+"""
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from config import (
+    SQL_TRACE,
+    SQL_SLOW_MS,
+    SQL_SLOW_LOG,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+)
+
+# 进度回调间隔（虚拟机指令数）；步数按此粒度估算
+PROGRESS_INTERVAL = 1000
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+_lock = threading.Lock()
+
+# 慢查询日志单独滚动，不混入主日志
+slow_log = logging.getLogger('commission.sql.slow')
+slow_log.propagate = False
+_slow_handler = None
+
+
+def _ensure_slow_handler():
+    global _slow_handler
+    if _slow_handler is None:
+        log_dir = os.path.dirname(SQL_SLOW_LOG)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        _slow_handler = RotatingFileHandler(SQL_SLOW_LOG, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        _slow_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(_slow_handler)
+        slow_log.setLevel(logging.INFO)
+
+
+def statement_shape(sql: str) -> str:
+    """归一化 SQL 作为统计键：合并空白，将 (?, ?, ?) 折叠为 (?...)。"""
+    return _PLACEHOLDER_LIST.sub('?...', _WHITESPACE.sub(' ', sql).strip())
+
+
+class StatementStats:
+    def __init__(self, window: int = 1024):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.slow = 0
+        self.recent: deque[float] = deque(maxlen=window)
+        self.plan: str | None = None
+
+    def p99(self) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+
+
+# 语句形态 -> 统计
+stats: dict[str, StatementStats] = {}
+
+
+def reset():
+    with _lock:
+        stats.clear()
+
+
+class TracingConnection(sqlite3.Connection):
+    """记录最近一条执行的语句（绑定参数已展开）与虚拟机步数，cursor() 默认返回 TracingCursor。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_sql = None
+        self.steps = 0
+        # 关闭连接时结算各游标尚未取尽的语句（如 fetchone 只取一行的查询）
+        self._cursors = weakref.WeakSet()
+        self.set_trace_callback(self._on_trace)
+        self.set_progress_handler(self._on_progress, PROGRESS_INTERVAL)
+
+    def _on_trace(self, sql: str):
+        self.last_sql = sql
+
+    def _on_progress(self) -> int:
+        self.steps += PROGRESS_INTERVAL
+        return 0
+
+    def cursor(self, factory=None):
+        cursor = super().cursor(factory or TracingCursor)
+        if isinstance(cursor, TracingCursor):
+            self._cursors.add(cursor)
+        return cursor
+
+    def close(self):
+        for cursor in list(self._cursors):
+            cursor._finish()
+        super().close()
+
+
+class TracingCursor(sqlite3.Cursor):
+    """一次调用的耗时 = execute + 后续取数，直到结果取尽或游标被再次执行时结算。"""
+
+    _pending = None
+
+    def _start(self, sql: str, params):
+        self._finish()
+        self._pending = {
+            'shape': statement_shape(sql),
+            'sql': sql,
+            'params': params,
+            'elapsed': 0.0,
+            'rows': 0,
+            'steps': self.connection.steps,
+            'expanded': None,
+        }
+
+    def _add(self, elapsed: float, rows: int = 0):
+        if self._pending is not None:
+            self._pending['elapsed'] += elapsed
+            self._pending['rows'] += rows
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        steps = self.connection.steps - pending['steps']
+        elapsed = pending['elapsed']
+        with _lock:
+            entry = stats.setdefault(pending['shape'], StatementStats())
+            entry.calls += 1
+            entry.total += elapsed
+            entry.max = max(entry.max, elapsed)
+            entry.rows += pending['rows']
+            entry.steps += steps
+            entry.recent.append(elapsed)
+            is_slow = elapsed * 1000 >= SQL_SLOW_MS
+            if is_slow:
+                entry.slow += 1
+            need_plan = is_slow and entry.plan is None
+        if is_slow:
+            plan = self._explain(pending['sql'], pending['params']) if need_plan else entry.plan
+            if need_plan:
+                entry.plan = plan
+            _ensure_slow_handler()
+            slow_log.info(
+                "%.1fms rows=%d steps~%d sql=%s\n  plan: %s",
+                elapsed * 1000, pending['rows'], steps, pending['expanded'] or pending['shape'], plan,
+            )
+
+    def _explain(self, sql: str, params) -> str:
+        try:
+            # 普通游标执行，避免 EXPLAIN 本身被统计
+            rows = sqlite3.Cursor(self.connection).execute(f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+            return " | ".join(row[-1] for row in rows) or "(empty)"
+        except sqlite3.Error as exc:
+            return f"(explain failed: {exc})"
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._add(time.perf_counter() - start)
+            if self._pending is not None:
+                self._pending['expanded'] = self.connection.last_sql
+        if self.description is None:
+            # 写语句没有结果集，立即结算
+            self._add(0.0, max(self.rowcount, 0))
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(time.perf_counter() - start, max(self.rowcount, 0))
+            self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - start, 1 if row is not None else 0)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size if size is not None else self.arraysize)
+        self._add(time.perf_counter() - start, len(rows))
+        if len(rows) < (size if size is not None else self.arraysize):
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+def connect(database, **kwargs) -> sqlite3.Connection:
+    """SQL_TRACE 开启时返回 TracingConnection，否则为普通连接。"""
+    if SQL_TRACE:
+        kwargs.setdefault('factory', TracingConnection)
+    return sqlite3.connect(database, **kwargs)
+
+
+def summary_rows(limit: int = 10, sort_by: str = 'total') -> list[str]:
+    """按累计耗时 / p99 / 调用次数排序的语句形态汇总。"""
+    with _lock:
+        rows = [(shape, s.calls, s.total, s.p99(), s.rows, s.steps, s.slow) for shape, s in stats.items()]
+    index = {'total': 2, 'p99': 3, 'calls': 1}.get(sort_by, 2)
+    rows.sort(key=lambda r: r[index], reverse=True)
+    lines = []
+    for shape, calls, total, p99, returned, steps, slow in rows[:limit]:
+        text = shape if len(shape) <= 120 else shape[:117] + '...'
+        lines.append(
+            f"n={calls} total={total * 1000:.0f}ms p99={p99 * 1000:.1f}ms rows={returned} "
+            f"steps~{steps} slow={slow}\n  {text}"
+        )
+    return lines
+
+
+def log_summary(limit: int = 20):
+    if stats:
+        logging.info("SQL statement profile (top by total time):\n%s", "\n".join(summary_rows(limit)))
+
+
+if SQL_TRACE:
+    atexit.register(log_summary)
@@ -0,0 +1,37 @@
+"""测试环境：在导入 config 之前指定临时数据库、日志与等级配置，每个测试使用独立的 guild_id。"""
+import itertools
+import os
+import sys
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix="commission-tests-")
+os.environ.update({
+    'ALLOWED_CHANNEL_ID': '1',
+    'NOTIFICATION_CHANNEL_ID': '1',
+    'DATABASE_PATH': os.path.join(_tmpdir, 'test.db'),
+    'ARCHIVE_DATABASE_PATH': os.path.join(_tmpdir, 'archive.db'),
+    'LOG_FILE': os.path.join(_tmpdir, 'bot.log'),
+    'LOG_TO_CONSOLE': 'false',
+    'DB_WRITER_ADDRESS': '',
+    'LEVELS_CONFIG_FILE': '',
+    'LEVELS_CONFIG': '[{"name": "月费会员", "tier": 1, "role_ids": "11", "commission": 20, "price": 100},'
+                     ' {"name": "年费会员", "tier": 2, "role_ids": "22", "commission": 40, "price": 1000}]',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+_guild_ids = itertools.count(10_000)
+
+
+@pytest.fixture
+def guild_id():
+    return next(_guild_ids)
+
+
+@pytest.fixture
+def db(guild_id):
+    from database import Database
+
+    with Database(guild_id) as database:
+        yield database
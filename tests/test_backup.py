@@ -0,0 +1,36 @@
+import sqlite3
+import threading
+import time
+
+import backup
+from config import DATABASE_PATH
+
+
+def test_write_completes_while_paced_backup_runs(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'BACKUP_DIR', str(tmp_path))
+    monkeypatch.setattr(backup, 'BACKUP_PAGES_PER_STEP', 1)
+    monkeypatch.setattr(backup, 'BACKUP_STEP_SLEEP_MS', 5)
+    filler = sqlite3.connect(DATABASE_PATH)
+    filler.execute("CREATE TABLE IF NOT EXISTS backup_filler (data BLOB)")
+    filler.executemany("INSERT INTO backup_filler VALUES (randomblob(4000))", [()] * 100)
+    filler.commit()
+    filler.close()
+
+    results = {}
+    worker = threading.Thread(target=lambda: results.update(backup.backup_file(DATABASE_PATH, 'test')))
+    worker.start()
+    time.sleep(0.1)
+    assert worker.is_alive()
+
+    writer = sqlite3.connect(DATABASE_PATH, timeout=0.2)
+    started = time.perf_counter()
+    writer.execute("INSERT INTO backup_filler VALUES (x'00')")
+    writer.commit()
+    waited = time.perf_counter() - started
+    writer.close()
+    backup_running = worker.is_alive()
+    worker.join()
+
+    assert backup_running
+    assert waited < 0.1
+    assert results['integrity'] == 'ok'
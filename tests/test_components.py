@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import components
+
+
+def _interaction(guild_id, user_id=1):
+    return SimpleNamespace(guild_id=guild_id, user=SimpleNamespace(id=user_id))
+
+
+def test_concurrent_clicks_share_one_execution(guild_id):
+    router = components.ComponentRouter(cooldown=0)
+    calls = []
+
+    @router.register('invite_friend')
+    async def handler(interaction):
+        calls.append(interaction)
+        await asyncio.sleep(0.05)
+        return [{'content': 'link'}]
+
+    async def scenario():
+        first = asyncio.create_task(router.dispatch(_interaction(guild_id), 'invite_friend'))
+        await asyncio.sleep(0)
+        assert router.inflight() == 1
+        # 其他用户不受影响
+        other = router.dispatch(_interaction(guild_id, user_id=2), 'invite_friend')
+        return await asyncio.gather(first, router.dispatch(_interaction(guild_id), 'invite_friend'), other)
+
+    first, second, other = asyncio.run(scenario())
+    assert first == ('executed', [{'content': 'link'}])
+    assert second == ('coalesced', [{'content': 'link'}])
+    assert other[0] == 'executed'
+    assert len(calls) == 2
+    assert router.inflight() == 0
+
+
+def test_click_during_cooldown_is_rejected(guild_id, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(components.time, 'monotonic', lambda: now[0])
+    router = components.ComponentRouter(cooldown=5)
+    calls = []
+
+    @router.register('check_commission')
+    async def handler(interaction):
+        calls.append(interaction)
+        return [{'content': 'panel'}]
+
+    assert asyncio.run(router.dispatch(_interaction(guild_id), 'check_commission'))[0] == 'executed'
+    now[0] += 2
+    outcome, messages = asyncio.run(router.dispatch(_interaction(guild_id), 'check_commission'))
+    assert outcome == 'rejected'
+    assert messages == [{'content': "操作过于频繁，请 3 秒后再试。"}]
+    now[0] += 3
+    assert asyncio.run(router.dispatch(_interaction(guild_id), 'check_commission'))[0] == 'executed'
+    assert len(calls) == 2
+
+
+def test_failed_handler_releases_the_slot_without_cooldown(guild_id):
+    router = components.ComponentRouter(cooldown=60)
+    attempts = []
+
+    @router.register('check_records')
+    async def handler(interaction):
+        attempts.append(interaction)
+        if len(attempts) == 1:
+            raise RuntimeError("discord unavailable")
+        return [{'content': 'records'}]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(router.dispatch(_interaction(guild_id), 'check_records'))
+    assert router.inflight() == 0
+    # 失败不计冷却：立即重试会再次执行
+    assert asyncio.run(router.dispatch(_interaction(guild_id), 'check_records')) == ('executed', [{'content': 'records'}])
+    assert len(attempts) == 2
+
+
+def test_cancelled_first_click_does_not_cancel_the_shared_execution(guild_id):
+    router = components.ComponentRouter(cooldown=0)
+
+    @router.register('invite_friend')
+    async def handler(interaction):
+        await asyncio.sleep(0.05)
+        return [{'content': 'link'}]
+
+    async def scenario():
+        first = asyncio.create_task(router.dispatch(_interaction(guild_id), 'invite_friend'))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(router.dispatch(_interaction(guild_id), 'invite_friend'))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == ('coalesced', [{'content': 'link'}])
+    assert router.inflight() == 0
@@ -0,0 +1,49 @@
+def test_rejoin_through_new_inviter_moves_subtree(db):
+    # 1 -> 2 -> 3 -> 4，另有 6 -> 7
+    db.add_or_update_user(2, "u2", referred_by=1)
+    db.add_or_update_user(3, "u3", referred_by=2)
+    db.add_or_update_user(4, "u4", referred_by=3)
+    db.add_or_update_user(7, "u7", referred_by=6)
+
+    # 3 退群后经 7 的邀请重新加入
+    db.add_or_update_user(3, "u3", referred_by=7)
+
+    assert db.get_user_by_id(3)[2] == 7
+    assert db.get_upline(3, 5) == [(7, 1), (6, 2)]
+    assert db.get_upline(4, 5) == [(3, 1), (7, 2), (6, 3)]
+    assert db.get_downline_counts(2) == []
+    assert db.get_downline_counts(1) == [(1, 1)]
+    assert db.get_downline_counts(7) == [(1, 1), (2, 1)]
+
+
+def test_rejoin_through_same_inviter_keeps_closure(db):
+    db.add_or_update_user(2, "u2", referred_by=1)
+    db.add_or_update_user(3, "u3", referred_by=2)
+    db.add_or_update_user(3, "u3", referred_by=2)
+    db.add_or_update_user(3, "u3")
+
+    assert db.get_upline(3, 5) == [(2, 1), (1, 2)]
+
+
+def test_adopt_legacy_rows_runs_once_and_reports_conflicts(guild_id, caplog):
+    from database import Database
+
+    legacy_guild_id = guild_id + 500_000
+    with Database(legacy_guild_id) as legacy:
+        legacy.add_or_update_user(1, "legacy-1")
+        legacy.add_or_update_user(2, "legacy-2")
+    with Database(guild_id) as db:
+        db.add_or_update_user(2, "current-2")
+
+        with caplog.at_level('ERROR'):
+            moved = db.adopt_legacy_rows(legacy_guild_id)
+        assert moved == 1
+        assert db.get_user_by_id(1)[1] == "legacy-1"
+        assert db.get_user_by_id(2)[1] == "current-2"
+        assert "Skipped 1 legacy rows" in caplog.text and "users=1" in caplog.text
+
+        # 之后写入默认分区的数据不再被归属
+        with Database(legacy_guild_id) as legacy:
+            legacy.add_or_update_user(3, "legacy-3")
+        assert db.adopt_legacy_rows(legacy_guild_id) == 0
+        assert db.get_user_by_id(3) is None
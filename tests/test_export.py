@@ -0,0 +1,38 @@
+import io
+import sqlite3
+
+import export
+
+
+def _events_db(path, ids):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE referral_events (id INTEGER PRIMARY KEY, guild_id INTEGER, inviter_id INTEGER,
+                    invite_code TEXT, new_member_id INTEGER, joined_at TEXT, commission_amount REAL, settled INTEGER)''')
+    conn.executemany("INSERT INTO referral_events VALUES (?, 7, 1, NULL, ?, '2024-01-01 00:00:00', 10, 1)",
+                     [(i, 100 + i) for i in ids])
+    conn.commit()
+    conn.close()
+
+
+def _exported_ids(**options):
+    output = io.BytesIO()
+    export.export_table(output, 'referral_events', 7, compress=False, include_archived=True, **options)
+    lines = output.getvalue().decode('utf-8').splitlines()[1:]
+    return [int(line.split(',')[0]) for line in lines]
+
+
+def test_db_override_merges_its_own_archive(tmp_path):
+    main_db = str(tmp_path / 'other.db')
+    _events_db(main_db, [3, 4])
+    _events_db(str(tmp_path / 'other_archive.db'), [1, 2])
+
+    assert export.archive_path_for(main_db) == str(tmp_path / 'other_archive.db')
+    assert _exported_ids(database_path=main_db) == [1, 2, 3, 4]
+
+
+def test_explicit_archive_path(tmp_path):
+    main_db = str(tmp_path / 'other.db')
+    _events_db(main_db, [3])
+    _events_db(str(tmp_path / 'elsewhere.db'), [1])
+
+    assert _exported_ids(database_path=main_db, archive_path=str(tmp_path / 'elsewhere.db')) == [1, 3]
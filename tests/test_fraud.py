@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import fraud
+
+NOW = 1_700_000_000.0
+
+
+def _detector(**overrides):
+    options = dict(window_seconds=600, max_joins=3, new_account_days=7, new_account_ratio=0.5, min_joins=3,
+                   burst_seconds=60, burst_joins=10)
+    options.update(overrides)
+    return fraud.Detector(**options)
+
+
+def test_joins_outside_the_window_expire(guild_id):
+    detector = _detector()
+    young = datetime.fromtimestamp(NOW - 86400)
+    for offset in (0, 100, 200):
+        reasons, stats = detector.observe(guild_id, 1, young, now=NOW + offset)
+    assert (stats['joins'], stats['young']) == (3, 3)
+
+    # 第一次加入已滑出窗口（边界上的条目同样过期）
+    reasons, stats = detector.observe(guild_id, 1, now=NOW + 600)
+    assert (stats['joins'], stats['young']) == (3, 2)
+    reasons, stats = detector.observe(guild_id, 1, now=NOW + 2000)
+    assert (stats['joins'], stats['young']) == (1, 0)
+
+
+def test_join_rate_flags_once_until_reset(guild_id):
+    detector = _detector(new_account_ratio=2)
+    results = [detector.observe(guild_id, 1, now=NOW + i)[0] for i in range(5)]
+    assert results == [[], [], [], ['join_rate'], []]
+
+    # 审核释放后重新累计
+    detector.reset(guild_id, 1)
+    reasons, stats = detector.observe(guild_id, 1, now=NOW + 10)
+    assert (reasons, stats['joins']) == ([], 1)
+
+
+def test_new_account_ratio_needs_min_joins(guild_id):
+    detector = _detector(max_joins=100)
+    young = datetime.fromtimestamp(NOW - 86400)
+    old = datetime.fromtimestamp(NOW - 365 * 86400)
+    assert detector.observe(guild_id, 1, young, now=NOW)[0] == []
+    assert detector.observe(guild_id, 1, young, now=NOW + 1)[0] == []
+    assert detector.observe(guild_id, 1, old, now=NOW + 2)[0] == ['new_accounts']
+
+    # 老账号为主时不触发
+    for i in range(3):
+        assert detector.observe(guild_id, 2, old if i else young, now=NOW + i)[0] == []
+
+
+def test_invite_code_burst(guild_id):
+    detector = _detector(max_joins=100, burst_joins=3)
+    assert detector.observe(guild_id, 1, invite_code='abc', now=NOW)[0] == []
+    assert detector.observe(guild_id, 2, invite_code='abc', now=NOW + 30)[0] == []
+    # 早于 burst_seconds 的使用不计入
+    reasons, stats = detector.observe(guild_id, 3, invite_code='abc', now=NOW + 61)
+    assert (reasons, stats['code_joins']) == ([], 2)
+    reasons, stats = detector.observe(guild_id, 3, invite_code='abc', now=NOW + 62)
+    assert (reasons, stats['code_joins']) == (['invite_burst'], 3)
+
+
+def test_flag_is_persisted_and_not_overwritten_while_pending(db):
+    detector = _detector()
+    for i in range(4):
+        reasons, stats = detector.observe(db.guild_id, 1, now=NOW + i)
+    details = fraud.describe(reasons, stats)
+    assert details.startswith('加入速率过高：10 分钟内加入 4 人')
+
+    db.add_or_update_user(1, "inviter")
+    flagged_at = "2026-01-01 01:00:00"
+    assert db.flag_inviter(1, ",".join(reasons), details, flagged_at, hold=True) is True
+    assert db.flag_inviter(1, 'new_accounts', 'again', flagged_at) is False
+
+    assert db.get_flag_status(1) == 'flagged'
+    assert db.is_commission_held(1)
+    rows = db.get_flagged_inviters()
+    assert [(row[0], row[1], row[2], row[3], row[5]) for row in rows] == [(1, "inviter", 'join_rate', details, 1)]
+
+    db.release_flagged_inviter(1, flagged_at)
+    assert db.get_flag_status(1) == 'cleared'
+    assert db.get_flagged_inviters() == []
+    # 释放后可再次被标记
+    assert db.flag_inviter(1, 'join_rate', details, flagged_at) is True
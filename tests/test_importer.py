@@ -0,0 +1,77 @@
+import importer
+
+
+def _write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_identical_rows_within_a_file_are_merged_once(db, guild_id, tmp_path):
+    events = _write(tmp_path / 'events.csv', (
+        "inviter_id,new_member_id,joined_at,commission_amount,role_id\n"
+        "1,2,2024-01-01 10:00:00,20,11\n"
+        "1,2,2024-01-01 10:00:00,20,11\n"
+        "1,3,2024-01-01 10:00:00,20,11\n"
+    ))
+    payouts = _write(tmp_path / 'payouts.csv', (
+        "user_id,amount,created_at\n"
+        "1,15,2024-02-01 00:00:00\n"
+        "1,15,2024-02-01 00:00:00\n"
+    ))
+    job = importer.Importer(guild_id, allow_missing_references=True)
+    try:
+        job.load('referral_events', events)
+        job.load('payouts', payouts)
+        job.validate()
+        merged = job.merge()
+    finally:
+        job.close()
+
+    assert merged['referral_events'] == 2
+    assert merged['payouts'] == 1
+    assert job.errors['referral_events: duplicate in file'] == 1
+    assert job.errors['payouts: duplicate in file'] == 1
+    assert db.get_commission_stats(1)[0] == 40.0
+
+
+def test_rerun_skips_rows_already_imported(db, guild_id, tmp_path):
+    events = _write(tmp_path / 'events.csv', (
+        "inviter_id,new_member_id,joined_at,commission_amount,role_id\n"
+        "1,2,2024-01-01 10:00:00,20,11\n"
+    ))
+    for expected in (1, 0):
+        job = importer.Importer(guild_id, allow_missing_references=True)
+        try:
+            job.load('referral_events', events)
+            job.validate()
+            assert job.merge()['referral_events'] == expected
+        finally:
+            job.close()
+
+
+def test_rerun_skips_rows_moved_to_the_archive(db, guild_id, tmp_path):
+    import archive
+
+    events = _write(tmp_path / 'events.csv', (
+        "inviter_id,new_member_id,joined_at,commission_amount,settled,role_id\n"
+        "1,2,2020-01-01 10:00:00,20,1,11\n"
+        "1,3,2020-01-01 10:00:00,20,0,11\n"
+    ))
+    job = importer.Importer(guild_id, allow_missing_references=True)
+    try:
+        job.load('referral_events', events)
+        job.validate()
+        assert job.merge()['referral_events'] == 2
+    finally:
+        job.close()
+    assert archive.archive_settled_events(30, guild_id=guild_id)['events'] == 1
+
+    job = importer.Importer(guild_id, allow_missing_references=True)
+    try:
+        job.load('referral_events', events)
+        job.validate()
+        assert job.merge()['referral_events'] == 0
+    finally:
+        job.close()
+    assert job.errors['referral_events: already imported'] == 2
+    assert db.get_commission_stats(1)[0] == 40.0
@@ -0,0 +1,86 @@
+import ledger
+
+
+def _credit(db, inviter_id, member_id, amount, joined_at='2026-01-05 10:00:00'):
+    db.add_or_update_user(inviter_id, f"u{inviter_id}")
+    db.add_referral_event(inviter_id, "code", member_id, joined_at, amount, role_id=11)
+    db.adjust_reward_balance(inviter_id, amount)
+
+
+def _ledger_row(db, user_id):
+    db.cursor.execute("SELECT credits, payouts FROM balance_ledger WHERE guild_id = ? AND user_id = ?",
+                      (db.guild_id, user_id))
+    return db.cursor.fetchone()
+
+
+def test_incremental_run_only_adds_new_rows(db):
+    _credit(db, 1, 100, 20)
+    _credit(db, 2, 101, 40)
+
+    first = ledger.reconcile(db.guild_id)
+    assert (first['mode'], first['events'], first['drifted_count']) == ('full', 2, 0)
+
+    _credit(db, 1, 102, 20)
+    db.settle_user_amount(2, 40)
+    second = ledger.reconcile(db.guild_id)
+    assert (second['mode'], second['events'], second['payouts'], second['drifted_count']) == ('incremental', 1, 1, 0)
+    assert _ledger_row(db, 1) == (40, 0)
+    assert _ledger_row(db, 2) == (40, 40)
+
+    # 余额被直接改动（不产生流水）时报告偏差
+    db.adjust_reward_balance(1, 5)
+    third = ledger.reconcile(db.guild_id)
+    assert (third['events'], third['drifted_count'], third['drift_total']) == (0, 1, 5)
+    assert third['drifted'][0][0] == 1
+
+
+def test_full_rebuild_after_archiving_uses_rollups(db):
+    import archive
+
+    _credit(db, 1, 100, 20, joined_at='2020-01-05 10:00:00')
+    _credit(db, 1, 101, 40, joined_at='2020-02-05 10:00:00')
+    _credit(db, 1, 102, 20)
+    db.settle_user_amount(1, 60)
+    ledger.reconcile(db.guild_id)
+
+    assert archive.archive_settled_events(30, guild_id=db.guild_id)['events'] == 2
+    assert ledger.reconcile(db.guild_id)['drifted_count'] == 0
+    result = ledger.reconcile(db.guild_id, full=True)
+    assert (result['mode'], result['drifted_count']) == ('full', 0)
+    assert _ledger_row(db, 1) == (80, 60)
+
+
+def test_split_remainder_is_not_counted_twice(db):
+    _credit(db, 1, 100, 40)
+    ledger.reconcile(db.guild_id)
+
+    # 局部结算：原事件改为 15 并拆出 25 的余数事件
+    assert db.settle_user_amount(1, 15) == 15
+    result = ledger.reconcile(db.guild_id)
+    assert (result['mode'], result['events'], result['drifted_count']) == ('incremental', 1, 0)
+    assert _ledger_row(db, 1) == (40, 15)
+
+    full = ledger.reconcile(db.guild_id, full=True)
+    assert (full['mode'], full['drifted_count']) == ('full', 0)
+    assert _ledger_row(db, 1) == (40, 15)
+
+
+def test_updates_go_through_the_writer_process(db, monkeypatch):
+    import database
+
+    submitted = []
+
+    class FakeWriter:
+        def submit(self, ops):
+            # 写入进程：单事务执行并提交
+            submitted.append(ops)
+            results = database.run_write_ops(db.cursor, ops)
+            db.conn.commit()
+            return results
+
+    _credit(db, 1, 100, 20)
+    monkeypatch.setattr(database, 'DB_WRITER_ADDRESS', 'writer:1')
+    monkeypatch.setattr(database, 'get_writer_client', lambda: FakeWriter())
+    result = ledger.reconcile(db.guild_id)
+    assert len(submitted) == 1
+    assert (result['mode'], result['events'], result['drifted_count']) == ('full', 1, 0)
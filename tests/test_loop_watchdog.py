@@ -0,0 +1,23 @@
+import asyncio
+import traceback
+
+import loop_watchdog
+import metrics
+
+
+def _blocking_call():
+    return traceback.extract_stack()
+
+
+@metrics.timed_handler()
+async def on_member_join():
+    return _blocking_call()
+
+
+def test_blocking_site_reports_decorated_handler_name():
+    frames = asyncio.run(on_member_join())
+
+    handler, site = loop_watchdog._blocking_site(frames)
+
+    assert handler == 'on_member_join'
+    assert site.startswith('test_loop_watchdog.py:') and site.endswith(' in _blocking_call')
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import panel_cache
+
+
+def _interaction(guild_id, user_id):
+    return SimpleNamespace(guild_id=guild_id, user=SimpleNamespace(id=user_id))
+
+
+def _counting_render(cache, action='check_records'):
+    calls = []
+
+    @cache.cached(action)
+    async def render(interaction):
+        calls.append(interaction.user.id)
+        return [{'content': f"render {len(calls)}"}]
+
+    return render, calls
+
+
+def test_referral_event_invalidates_inviter_panel(guild_id):
+    cache = panel_cache.PanelCache(max_users=10, ttl=60)
+    render, calls = _counting_render(cache)
+
+    first = asyncio.run(render(_interaction(guild_id, 1)))
+    assert asyncio.run(render(_interaction(guild_id, 1))) is first
+    # on_member_join 记录流水后失效新成员与邀请者
+    cache.invalidate(guild_id, 2, 1)
+    assert asyncio.run(render(_interaction(guild_id, 1)))[0]['content'] == "render 2"
+    assert calls == [1, 1]
+
+
+def test_entries_expire_after_ttl(guild_id, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(panel_cache.time, 'monotonic', lambda: now[0])
+    cache = panel_cache.PanelCache(max_users=10, ttl=30)
+    render, calls = _counting_render(cache)
+
+    asyncio.run(render(_interaction(guild_id, 1)))
+    now[0] += 29
+    asyncio.run(render(_interaction(guild_id, 1)))
+    assert len(calls) == 1
+    now[0] += 1
+    asyncio.run(render(_interaction(guild_id, 1)))
+    assert len(calls) == 2
+
+
+def test_least_recently_used_user_is_evicted(guild_id):
+    cache = panel_cache.PanelCache(max_users=2, ttl=60)
+    cache.put(guild_id, 1, 'check_records', ['a'])
+    cache.put(guild_id, 2, 'check_records', ['b'])
+    assert cache.get(guild_id, 1, 'check_records') == ['a']
+
+    cache.put(guild_id, 3, 'check_records', ['c'])
+    assert len(cache) == 2
+    assert cache.get(guild_id, 2, 'check_records') is None
+    assert cache.get(guild_id, 1, 'check_records') == ['a']
+    assert cache.get(guild_id, 3, 'check_records') == ['c']
+
+
+def test_invalidation_during_render_discards_result(guild_id):
+    cache = panel_cache.PanelCache(max_users=10, ttl=60)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        @cache.cached('check_records')
+        async def render(interaction):
+            started.set()
+            await release.wait()
+            return ['stale']
+
+        task = asyncio.create_task(render(_interaction(guild_id, 1)))
+        await started.wait()
+        # 渲染期间数据变化：本次结果仍返回给调用方，但不写入缓存
+        cache.invalidate(guild_id, 1)
+        release.set()
+        assert await task == ['stale']
+
+    asyncio.run(scenario())
+    assert cache.get(guild_id, 1, 'check_records') is None
+    assert len(cache) == 0
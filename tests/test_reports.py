@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+import reports
+
+
+def test_leaderboard_job_runs_in_worker_process(db, guild_id, caplog):
+    db.add_or_update_user(1, "top")
+    db.adjust_reward_balance(1, 30)
+    db.add_or_update_user(2, "second")
+    db.adjust_reward_balance(2, 10)
+    db.add_or_update_user(3, "zero")
+    seen = []
+
+    async def on_progress(text):
+        seen.append(text)
+
+    service = reports.ReportService(progress_interval=0)
+    with caplog.at_level(logging.INFO):
+        result = asyncio.run(service.run('leaderboard', {'guild_id': guild_id}, on_progress=on_progress))
+
+    assert [(row[0], row[2]) for row in result['rows']] == [(1, 30.0), (2, 10.0)]
+    assert service.running() == {}
+    # 工作进程的日志经结果队列交给本进程
+    assert any(record.process != reports.os.getpid() and f"guild {guild_id}" in record.getMessage()
+               for record in caplog.records)
+
+
+def test_busy_report_type_is_rejected(guild_id):
+    service = reports.ReportService()
+
+    async def scenario():
+        first = asyncio.ensure_future(service.run('leaderboard', {'guild_id': guild_id}))
+        await asyncio.sleep(0)
+        try:
+            await service.run('leaderboard', {'guild_id': guild_id})
+        except reports.ReportBusy as busy:
+            rejected = busy.kind
+        else:
+            rejected = None
+        await first
+        return rejected
+
+    assert asyncio.run(scenario()) == 'leaderboard'
@@ -0,0 +1,18 @@
+import sqlite3
+
+import sqltrace
+
+
+def test_close_records_statement_left_unfinished_by_fetchone():
+    sqltrace.reset()
+    conn = sqlite3.connect(':memory:', factory=sqltrace.TracingConnection)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 UNION ALL SELECT 2")
+    assert cursor.fetchone() == (1,)
+    assert "SELECT 1 UNION ALL SELECT 2" not in sqltrace.stats
+
+    conn.close()
+
+    entry = sqltrace.stats["SELECT 1 UNION ALL SELECT 2"]
+    assert entry.calls == 1
+    assert entry.rows == 1